@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+Generate large and adversarial documents for benchmarks and soak tests: PDFs with
+thousands of pages, very wide spreadsheets, images near the 10000x10000 page size
+limit, and decks with many slides. It can also make the pixel folders that
+document-to-pixels would have made, including broken ones, to test
+validate_convert_to_pixel_output directly.
+
+Everything is generated deterministically, so the same arguments always make the same
+files.
+
+Usage:
+    ./benchmarks/corpus.py all OUTPUT_DIR [--scale small|large]
+    ./benchmarks/corpus.py pdf OUTPUT --pages 5000
+    ./benchmarks/corpus.py xlsx OUTPUT --columns 16384 --rows 10
+    ./benchmarks/corpus.py png OUTPUT --width 9999 --height 9999
+    ./benchmarks/corpus.py odp OUTPUT --slides 1000
+    ./benchmarks/corpus.py pixels OUTPUT_DIR --pages 5000 [--defect too-wide]
+"""
+import os
+import sys
+import zlib
+import struct
+import zipfile
+import argparse
+
+# Zip files get this timestamp, so they're the same every time
+zip_date_time = (1980, 1, 1, 0, 0, 0)
+
+# What can be wrong with a generated pixel folder
+pixel_defects = ["none", "too-wide", "too-tall", "bad-rgb-size", "missing-page"]
+
+
+def make_pdf(filename, num_pages, width=612, height=792):
+    """
+    A PDF with num_pages pages, each with its page number on it
+    """
+    # Objects 1 and 2 are the catalog and the page tree, 3 is the font, and then each
+    # page has a page object and a content stream
+    num_objects = 3 + num_pages * 2
+    offsets = []
+
+    with open(filename, "wb") as f:
+
+        def write_object(obj):
+            offsets.append(f.tell())
+            f.write(f"{len(offsets)} 0 obj\n".encode() + obj + b"\nendobj\n")
+
+        f.write(b"%PDF-1.4\n")
+        write_object(b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{4 + i * 2} 0 R" for i in range(num_pages))
+        write_object(f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>".encode())
+        write_object(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+        for page in range(1, num_pages + 1):
+            write_object(
+                (
+                    f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> "
+                    f"/Contents {len(offsets) + 2} 0 R >>"
+                ).encode()
+            )
+            content = (
+                f"BT /F1 24 Tf 72 {height - 96} Td (Page {page} of {num_pages}) Tj ET"
+            )
+            write_object(
+                f"<< /Length {len(content)} >>\nstream\n{content}\nendstream".encode()
+            )
+
+        xref = f.tell()
+        f.write(f"xref\n0 {num_objects + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(
+            (
+                f"trailer\n<< /Size {num_objects + 1} /Root 1 0 R >>\n"
+                f"startxref\n{xref}\n%%EOF\n"
+            ).encode()
+        )
+
+
+def column_name(index):
+    """
+    Spreadsheet column name for a 0-based index: A, B, ..., Z, AA, AB, ...
+    """
+    name = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord("A") + remainder) + name
+    return name
+
+
+def write_zip_entry(z, name, data, compress=True):
+    info = zipfile.ZipInfo(name, date_time=zip_date_time)
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    z.writestr(info, data)
+
+
+def make_xlsx(filename, num_columns, num_rows):
+    """
+    A spreadsheet with one sheet that's num_columns wide (Excel allows up to 16384)
+    """
+    rows = []
+    for row in range(1, num_rows + 1):
+        cells = "".join(
+            f'<c r="{column_name(column)}{row}"><v>{row * num_columns + column}</v></c>'
+            for column in range(num_columns)
+        )
+        rows.append(f'<row r="{row}">{cells}</row>')
+    sheet = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        f"<sheetData>{''.join(rows)}</sheetData></worksheet>"
+    )
+
+    with zipfile.ZipFile(filename, "w") as z:
+        write_zip_entry(
+            z,
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            "</Types>",
+        )
+        write_zip_entry(
+            z,
+            "_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>",
+        )
+        write_zip_entry(
+            z,
+            "xl/workbook.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+        )
+        write_zip_entry(
+            z,
+            "xl/_rels/workbook.xml.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+            "</Relationships>",
+        )
+        write_zip_entry(z, "xl/worksheets/sheet1.xml", sheet)
+
+
+def make_png(filename, width, height):
+    """
+    An RGB PNG with a gradient, written a row at a time so huge images don't need to
+    fit in memory
+    """
+
+    def write_chunk(f, chunk_type, data):
+        f.write(struct.pack(">I", len(data)))
+        f.write(chunk_type + data)
+        f.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xFFFFFFFF))
+
+    row_pattern = bytes((x * 255 // max(1, width - 1)) for x in range(width))
+    compressor = zlib.compressobj(6)
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        write_chunk(f, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+
+        data = b""
+        for y in range(height):
+            shade = y * 255 // max(1, height - 1)
+            row = bytearray(width * 3)
+            row[0::3] = row_pattern
+            row[1::3] = bytes([shade]) * width
+            row[2::3] = row_pattern[::-1]
+
+            # Each row starts with the filter type, 0 for none
+            data += compressor.compress(b"\x00" + bytes(row))
+            if len(data) > 1024 * 1024:
+                write_chunk(f, b"IDAT", data)
+                data = b""
+        data += compressor.flush()
+        write_chunk(f, b"IDAT", data)
+        write_chunk(f, b"IEND", b"")
+
+
+def make_odp(filename, num_slides):
+    """
+    An OpenDocument presentation with num_slides slides
+    """
+    slides = "".join(
+        f'<draw:page draw:name="page{i}">'
+        f'<draw:frame svg:x="2cm" svg:y="2cm" svg:width="20cm" svg:height="3cm">'
+        f"<draw:text-box><text:p>Slide {i} of {num_slides}</text:p></draw:text-box>"
+        f"</draw:frame></draw:page>"
+        for i in range(1, num_slides + 1)
+    )
+    content = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        "<office:document-content "
+        'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+        'xmlns:draw="urn:oasis:names:tc:opendocument:xmlns:drawing:1.0" '
+        'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+        'xmlns:svg="urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0" '
+        'office:version="1.2">'
+        f"<office:body><office:presentation>{slides}</office:presentation></office:body>"
+        "</office:document-content>"
+    )
+    mimetype = "application/vnd.oasis.opendocument.presentation"
+
+    with zipfile.ZipFile(filename, "w") as z:
+        # The mimetype has to be first, and not compressed
+        write_zip_entry(z, "mimetype", mimetype, compress=False)
+        write_zip_entry(
+            z,
+            "META-INF/manifest.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">'
+            f'<manifest:file-entry manifest:full-path="/" manifest:media-type="{mimetype}"/>'
+            '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+            "</manifest:manifest>",
+        )
+        write_zip_entry(z, "content.xml", content)
+
+
+def make_pixel_dir(path, num_pages, width=2, height=2, defect="none"):
+    """
+    Fill path with the files that document-to-pixels makes, and return the output it
+    would have printed. defect is one of pixel_defects, to make a folder that should
+    fail validation.
+    """
+    os.makedirs(path, exist_ok=True)
+    output = f"Document has {num_pages} pages\n"
+    rgb = b"\xff" * (width * height * 3)
+    for page in range(1, num_pages + 1):
+        output += f"Converting page {page}/{num_pages} to pixels\n"
+
+        # The defect is always on the last page, so everything before it is checked
+        page_width = width
+        page_height = height
+        page_rgb = rgb
+        if page == num_pages:
+            if defect == "missing-page":
+                break
+            elif defect == "too-wide":
+                page_width = 10001
+            elif defect == "too-tall":
+                page_height = 10001
+            elif defect == "bad-rgb-size":
+                page_rgb = rgb[:-1]
+
+        with open(os.path.join(path, f"page-{page}.width"), "w") as f:
+            f.write(str(page_width))
+        with open(os.path.join(path, f"page-{page}.height"), "w") as f:
+            f.write(str(page_height))
+        with open(os.path.join(path, f"page-{page}.rgb"), "wb") as f:
+            f.write(page_rgb)
+    return output
+
+
+def make_all(output_dir, scale):
+    """
+    The standard corpus. "small" is quick to make, "large" goes up to the limits.
+    """
+    large = scale == "large"
+    os.makedirs(output_dir, exist_ok=True)
+
+    def path(name):
+        filename = os.path.join(output_dir, name)
+        print(filename)
+        return filename
+
+    for num_pages in [100, 1000] + ([5000] if large else []):
+        make_pdf(path(f"pdf-{num_pages}-pages.pdf"), num_pages)
+    make_xlsx(
+        path(f"xlsx-{16384 if large else 1024}-columns.xlsx"),
+        16384 if large else 1024,
+        10,
+    )
+    make_odp(path(f"odp-{1000 if large else 100}-slides.odp"), 1000 if large else 100)
+    if large:
+        make_png(path("png-10000x10000.png"), 10000, 10000)
+        make_png(path("png-10001x100.png"), 10001, 100)
+    else:
+        make_png(path("png-2000x2000.png"), 2000, 2000)
+        make_png(path("png-10001x10.png"), 10001, 10)
+
+    # Pixel folders, one that's valid and one of each kind of broken
+    num_pages = 5000 if large else 500
+    make_pixel_dir(path(f"pixels-{num_pages}"), num_pages)
+    for defect in pixel_defects[1:]:
+        make_pixel_dir(path(f"pixels-{num_pages}-{defect}"), num_pages, defect=defect)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("all", help="Make the standard corpus")
+    p.add_argument("output_dir")
+    p.add_argument("--scale", choices=["small", "large"], default="large")
+
+    p = subparsers.add_parser("pdf", help="A PDF with many pages")
+    p.add_argument("output")
+    p.add_argument("--pages", type=int, default=1000)
+
+    p = subparsers.add_parser("xlsx", help="A very wide spreadsheet")
+    p.add_argument("output")
+    p.add_argument("--columns", type=int, default=16384)
+    p.add_argument("--rows", type=int, default=10)
+
+    p = subparsers.add_parser("png", help="A huge image")
+    p.add_argument("output")
+    p.add_argument("--width", type=int, default=9999)
+    p.add_argument("--height", type=int, default=9999)
+
+    p = subparsers.add_parser("odp", help="A presentation with many slides")
+    p.add_argument("output")
+    p.add_argument("--slides", type=int, default=1000)
+
+    p = subparsers.add_parser("pixels", help="A pixel folder, like document-to-pixels")
+    p.add_argument("output_dir")
+    p.add_argument("--pages", type=int, default=1000)
+    p.add_argument("--width", type=int, default=2)
+    p.add_argument("--height", type=int, default=2)
+    p.add_argument("--defect", choices=pixel_defects, default="none")
+
+    args = parser.parse_args()
+    if args.command == "all":
+        make_all(args.output_dir, args.scale)
+    elif args.command == "pdf":
+        make_pdf(args.output, args.pages)
+    elif args.command == "xlsx":
+        make_xlsx(args.output, args.columns, args.rows)
+    elif args.command == "png":
+        make_png(args.output, args.width, args.height)
+    elif args.command == "odp":
+        make_odp(args.output, args.slides)
+    elif args.command == "pixels":
+        make_pixel_dir(
+            args.output_dir, args.pages, args.width, args.height, args.defect
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+A stand-in for podman or docker, for benchmarking dangerzone on a computer without a
+container engine. It understands the commands that dangerzone-container runs, and
+instead of running the real container it prints the same kind of output and writes
+real-sized pixel data and PDFs, so that everything dangerzone does on the host side
+can be measured.
+
+Use it by setting DANGERZONE_CONTAINER_RUNTIME to the path of this script. It can be
+tuned with these environment variables:
+
+    FAKE_RUNTIME_PAGES       Number of pages, instead of guessing from the document
+    FAKE_RUNTIME_WIDTH       Width of each page in pixels (default 1275, letter at 150 DPI)
+    FAKE_RUNTIME_HEIGHT      Height of each page in pixels (default 1650)
+    FAKE_RUNTIME_PAGE_DELAY  Seconds to spend on each page, per stage (default 0)
+    FAKE_RUNTIME_STATE_DIR   Folder to keep track of containers in. Containers that
+                             aren't run with --rm are left behind, like with the real
+                             runtime, and are listed by "ps -a -q". Containers run
+                             with --name can be stopped with "kill".
+    FAKE_RUNTIME_BUSY_RUNS   Fail this many "run" commands like a busy runtime does,
+                             before running any (default 0, needs the state dir)
+    FAKE_RUNTIME_IGNORE_PAGES  Convert every page even if PAGES is set, like the
+                             container images that don't know about page ranges
+
+Documents with "FAKE_RUNTIME_FAIL" in their first line fail to convert, like a document
+that LibreOffice can't open, and ones with "FAKE_RUNTIME_HANG" never finish converting,
+like a document that hangs LibreOffice. Use fake_document() to make them look like PDFs,
+so they get past dangerzone's format check.
+"""
+import os
+import re
+import sys
+import time
+import signal
+import uuid
+import zipfile
+
+image_name = "docker.io/flmcode/dangerzone"
+image_id = "sha256:" + "0" * 64
+
+# Documents with these in their first line fail to convert, or hang
+fail_marker = b"FAKE_RUNTIME_FAIL"
+hang_marker = b"FAKE_RUNTIME_HANG"
+
+
+def fake_document(marker):
+    return b"%PDF-1.4 " + marker + b"\n%%EOF\n"
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def count_pages(filename):
+    """
+    Guess how many pages a document has, without actually parsing it
+    """
+    if os.environ.get("FAKE_RUNTIME_PAGES"):
+        return env_int("FAKE_RUNTIME_PAGES", 1)
+
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except OSError:
+        return 1
+
+    # PDFs have a "/Type /Page" object for each page
+    if data.startswith(b"%PDF"):
+        return max(1, len(re.findall(rb"/Type\s*/Page[^s]", data)))
+
+    # Office documents are zip files, with a file for each slide or sheet
+    if data.startswith(b"PK"):
+        try:
+            with zipfile.ZipFile(filename) as z:
+                names = z.namelist()
+                if "content.xml" in names:
+                    content = z.read("content.xml")
+                    return max(
+                        1,
+                        content.count(b"<draw:page ") + content.count(b"<table:table "),
+                    )
+                slides = [n for n in names if re.match(r"ppt/slides/slide\d+\.xml$", n)]
+                sheets = [
+                    n for n in names if re.match(r"xl/worksheets/sheet\d+\.xml$", n)
+                ]
+                return max(1, len(slides) + len(sheets))
+        except zipfile.BadZipFile:
+            pass
+
+    return 1
+
+
+def parse_run_args(args):
+    """
+    Get the volumes, environment variables and command out of the arguments to "run"
+    """
+    volumes = {}
+    env = {}
+    i = 0
+    while i < len(args) - 1:
+        if args[i] == "-v":
+            src, dst = args[i + 1].rsplit(":", 1)
+            volumes[dst] = src
+            i += 2
+        elif args[i] == "-e":
+            key, _, value = args[i + 1].partition("=")
+            env[key] = value
+            i += 2
+        elif args[i] in ["--network", "--name"]:
+            i += 2
+        else:
+            i += 1
+    return volumes, env, args[-1]
+
+
+def get_pages(env, num_pages):
+    """
+    The pages to convert, from the PAGES environment variable, like "1-10,15,20-"
+    """
+    if not env.get("PAGES") or os.environ.get("FAKE_RUNTIME_IGNORE_PAGES"):
+        return range(1, num_pages + 1)
+
+    pages = set()
+    for part in env["PAGES"].split(","):
+        first, _, last = part.partition("-")
+        first = int(first)
+        if not _:
+            last = first
+        elif last:
+            last = int(last)
+        else:
+            last = num_pages
+        pages.update(range(first, min(last, num_pages) + 1))
+    return sorted(pages)
+
+
+def document_to_pixels(volumes, env):
+    with open(volumes["/tmp/input_file"], "rb") as f:
+        first_line = f.readline(1024)
+    if fail_marker in first_line:
+        print("Converting document to PDF", flush=True)
+        print("The document format is not supported", flush=True)
+        return 1
+    if hang_marker in first_line:
+        print("Converting document to PDF", flush=True)
+        while True:
+            time.sleep(60)
+
+    num_pages = count_pages(volumes["/tmp/input_file"])
+    width = env_int("FAKE_RUNTIME_WIDTH", 1275)
+    height = env_int("FAKE_RUNTIME_HEIGHT", 1650)
+    delay = float(os.environ.get("FAKE_RUNTIME_PAGE_DELAY", "0"))
+    pixel_dir = volumes["/dangerzone"]
+
+    print(f"Document has {num_pages} page{'s' if num_pages != 1 else ''}", flush=True)
+    row = b"\xff" * (width * 3)
+    for page in get_pages(env, num_pages):
+        print(f"Converting page {page}/{num_pages} to pixels", flush=True)
+        with open(os.path.join(pixel_dir, f"page-{page}.width"), "w") as f:
+            f.write(str(width))
+        with open(os.path.join(pixel_dir, f"page-{page}.height"), "w") as f:
+            f.write(str(height))
+        with open(os.path.join(pixel_dir, f"page-{page}.rgb"), "wb") as f:
+            for _ in range(height):
+                f.write(row)
+        if delay:
+            time.sleep(delay)
+    return 0
+
+
+def pixels_to_pdf(volumes, env):
+    pixel_dir = volumes["/dangerzone"]
+    safe_dir = volumes["/safezone"]
+    delay = float(os.environ.get("FAKE_RUNTIME_PAGE_DELAY", "0"))
+    ocr = env.get("OCR") == "1"
+
+    num_pages = len([n for n in os.listdir(pixel_dir) if n.endswith(".rgb")])
+    sizes = []
+    for page in range(1, num_pages + 1):
+        print(f"Converting page {page}/{num_pages} from pixels to PDF", flush=True)
+        if ocr:
+            print(f"Running OCR on page {page}/{num_pages}", flush=True)
+        with open(os.path.join(pixel_dir, f"page-{page}.width")) as f:
+            width = int(f.read())
+        with open(os.path.join(pixel_dir, f"page-{page}.height")) as f:
+            height = int(f.read())
+
+        # Read the pixels, like the real conversion does
+        with open(os.path.join(pixel_dir, f"page-{page}.rgb"), "rb") as f:
+            while f.read(1024 * 1024):
+                pass
+        sizes.append((width, height))
+        if delay:
+            time.sleep(delay)
+
+    print("Merging pages into a single PDF", flush=True)
+    write_pdf(os.path.join(safe_dir, "safe-output.pdf"), sizes)
+    print("Compressing PDF", flush=True)
+    write_pdf(os.path.join(safe_dir, "safe-output-compressed.pdf"), sizes)
+    return 0
+
+
+def write_pdf(filename, sizes):
+    """
+    Write a valid PDF with a blank page of each size
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids ["
+        + b" ".join(f"{i + 3} 0 R".encode() for i in range(len(sizes)))
+        + f"] /Count {len(sizes)} >>".encode(),
+    ]
+    for width, height in sizes:
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] >>".encode()
+        )
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(data))
+        data += f"{i + 1} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        data += f"{offset:010d} 00000 n \n".encode()
+    data += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+        f"startxref\n{xref}\n%%EOF\n"
+    ).encode()
+
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+def get_containers_dir():
+    state_dir = os.environ.get("FAKE_RUNTIME_STATE_DIR")
+    if not state_dir:
+        return None
+    containers_dir = os.path.join(state_dir, "containers")
+    os.makedirs(containers_dir, exist_ok=True)
+    return containers_dir
+
+
+def is_busy():
+    """
+    Whether this run should fail like it does when the runtime is busy, which it does
+    for the first FAKE_RUNTIME_BUSY_RUNS runs
+    """
+    busy_runs = env_int("FAKE_RUNTIME_BUSY_RUNS", 0)
+    state_dir = os.environ.get("FAKE_RUNTIME_STATE_DIR")
+    if not busy_runs or not state_dir:
+        return False
+
+    os.makedirs(state_dir, exist_ok=True)
+    counter_filename = os.path.join(state_dir, "busy-runs")
+    try:
+        with open(counter_filename) as f:
+            count = int(f.read())
+    except (OSError, ValueError):
+        count = 0
+    if count >= busy_runs:
+        return False
+    with open(counter_filename, "w") as f:
+        f.write(str(count + 1))
+    return True
+
+
+def run(args):
+    volumes, env, command = parse_run_args(args)
+
+    if is_busy():
+        print("Error: database is locked", file=sys.stderr)
+        return 125
+
+    # Keep track of the container, and leave it behind unless it's run with --rm
+    containers_dir = get_containers_dir()
+    container_filename = None
+    if containers_dir:
+        container_id = uuid.uuid4().hex[:12]
+        if "--name" in args:
+            container_id = args[args.index("--name") + 1]
+        container_filename = os.path.join(containers_dir, container_id)
+        with open(container_filename, "w") as f:
+            f.write(f"{os.getpid()} {' '.join(args)}")
+
+    try:
+        if command == "document-to-pixels":
+            return document_to_pixels(volumes, env)
+        if command == "pixels-to-pdf":
+            return pixels_to_pdf(volumes, env)
+        print(f"fake_runtime: unsupported command: {command}", file=sys.stderr)
+        return 125
+    finally:
+        if container_filename and "--rm" in args:
+            os.remove(container_filename)
+
+
+def main():
+    args = sys.argv[1:]
+
+    if args[:2] == ["image", "ls"]:
+        print("REPOSITORY                    TAG     IMAGE ID")
+        print(f"{image_name}  latest  {image_id[7:19]}")
+        return 0
+
+    if args[:2] == ["image", "inspect"]:
+        print(image_id)
+        return 0
+
+    if args[:1] == ["pull"]:
+        print(f"Trying to pull {image_name}:latest...")
+        print(image_id[7:])
+        return 0
+
+    if args[:1] == ["run"]:
+        return run(args[1:])
+
+    if args[:1] == ["ps"]:
+        containers_dir = get_containers_dir()
+        if containers_dir:
+            for container_id in sorted(os.listdir(containers_dir)):
+                print(container_id)
+        return 0
+
+    if args[:1] == ["kill"]:
+        containers_dir = get_containers_dir()
+        for container_id in args[1:]:
+            container_filename = os.path.join(containers_dir or "", container_id)
+            try:
+                with open(container_filename) as f:
+                    pid, container_args = f.read().split(" ", 1)
+            except (OSError, ValueError):
+                print(f"Error: no container with name {container_id}", file=sys.stderr)
+                return 1
+            try:
+                os.kill(int(pid), getattr(signal, "SIGKILL", signal.SIGTERM))
+            except ProcessLookupError:
+                pass
+
+            # The killed process can't remove its container, so do it here
+            if "--rm" in container_args.split():
+                os.remove(container_filename)
+            print(container_id)
+        return 0
+
+    if args[:1] == ["rm"]:
+        containers_dir = get_containers_dir()
+        for container_id in args[1:]:
+            if containers_dir and not container_id.startswith("-"):
+                try:
+                    os.remove(os.path.join(containers_dir, container_id))
+                except FileNotFoundError:
+                    pass
+        return 0
+
+    print(f"fake_runtime: unsupported command: {' '.join(args)}", file=sys.stderr)
+    return 125
+
+
+if __name__ == "__main__":
+    sys.exit(main())
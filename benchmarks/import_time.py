@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Measure how long it takes to import the code for each of dangerzone's modes, using
+`python -X importtime`, and fail if any of them goes over its budget.
+
+dangerzone-container runs at least twice per document, so its startup time matters
+the most.
+
+Usage:
+    ./benchmarks/import_time.py [--runs 5] [--budget container=100] [--json]
+"""
+import os
+import sys
+import json
+import subprocess
+import argparse
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module to import for each mode
+modes = {
+    "container": "dangerzone.container",
+    "cli": "dangerzone.cli",
+    "gui": "dangerzone.gui",
+}
+
+# Default budgets, in milliseconds of cumulative import time
+default_budgets = {
+    "container": 100,
+    "cli": 150,
+    "gui": 600,
+}
+
+
+def measure_import(mode, module):
+    """
+    Import module in a fresh interpreter, and return its cumulative import time in
+    milliseconds, or None if it can't be imported (for example, if PySide2 isn't
+    installed)
+    """
+    env = os.environ.copy()
+    env["DANGERZONE_MODE"] = mode
+    env["PYTHONPATH"] = root + os.pathsep + env.get("PYTHONPATH", "")
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if p.returncode != 0:
+        return None
+
+    # Lines look like: "import time:   self [us] | cumulative | imported package",
+    # and the last one for the module is its top-level import, including everything
+    # it imported
+    total_us = None
+    for line in p.stderr.split("\n"):
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            total_us = int(parts[1].strip())
+
+    if total_us is None:
+        return None
+    return total_us / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="Best of how many runs")
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="MODE=MS",
+        help="Override the import time budget for a mode",
+    )
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    args = parser.parse_args()
+
+    budgets = dict(default_budgets)
+    for budget in args.budget:
+        mode, ms = budget.split("=")
+        budgets[mode] = float(ms)
+
+    results = {}
+    over_budget = []
+    for mode, module in modes.items():
+        times = [measure_import(mode, module) for _ in range(args.runs)]
+        if None in times:
+            results[mode] = None
+            if not args.json:
+                print(f"{mode:<10} skipped, {module} can't be imported")
+            continue
+
+        results[mode] = min(times)
+        if results[mode] > budgets[mode]:
+            over_budget.append(mode)
+        if not args.json:
+            print(f"{mode:<10} {results[mode]:8.1f} ms  (budget {budgets[mode]} ms)")
+
+    if args.json:
+        print(json.dumps({"import_time_ms": results, "budget_ms": budgets}, indent=4))
+
+    if over_budget:
+        print(f"Over budget: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
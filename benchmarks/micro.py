@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the parts of dangerzone that run on the host for every document,
+with JSON baselines to catch regressions.
+
+Save a baseline, and later compare against it (this fails if any benchmark got slower
+by more than the threshold):
+
+    ./benchmarks/micro.py run --output baseline.json
+    ./benchmarks/micro.py run --baseline baseline.json [--threshold 0.2]
+
+Or compare two saved results:
+
+    ./benchmarks/micro.py compare baseline.json current.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import types
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from import_time import modes, measure_import
+from corpus import make_pixel_dir
+
+
+def best_time(func, repeat, number=1):
+    """
+    Run func number times, repeat times over, and return the fastest time for one call
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        seconds = (time.perf_counter() - start) / number
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+class FakeProcess:
+    """
+    Looks like the process that exec_dangerzone_container returns, but its output is
+    already in memory, so only the loop that reads it is measured
+    """
+
+    def __init__(self, lines):
+        self.stdout = iter(lines)
+        self.stderr = io.BytesIO(b"")
+        self.returncode = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        pass
+
+
+def container_output_lines(num_lines):
+    lines = [b"Document has 100 pages\n"]
+    for i in range(num_lines):
+        page = i % 100 + 1
+        lines.append(f"Running OCR on page {page}/100, line {i}\n".encode())
+    return lines
+
+
+def new_global_common():
+    import colorama
+    from dangerzone.global_common import GlobalCommon
+
+    global_common = GlobalCommon()
+
+    # GlobalCommon() wraps stdout with colorama every time, so undo that
+    colorama.deinit()
+    return global_common
+
+
+def bench_validate_pixel_output(work_dir, repeat):
+    global_common = new_global_common()
+    results = {}
+    for num_pages in [1, 100, 1000, 5000]:
+        pixel_dir = os.path.join(work_dir, f"pixels-{num_pages}")
+        output = make_pixel_dir(pixel_dir, num_pages)
+        common = types.SimpleNamespace(
+            pixel_dir=types.SimpleNamespace(name=pixel_dir),
+            trace_track=None,
+            num_pages=None,
+            page_range=None,
+        )
+
+        def validate():
+            success, error_message = global_common.validate_convert_to_pixel_output(
+                common, output
+            )
+            assert success, error_message
+
+        results[f"validate_pixel_output/{num_pages}_pages"] = best_time(
+            validate, repeat
+        )
+        shutil.rmtree(pixel_dir)
+    return results
+
+
+def bench_cli_log_loop(work_dir, repeat):
+    from dangerzone import cli
+    from dangerzone.common import Common
+    from dangerzone.log import setup_logging
+    from dangerzone.progress import ConversionProgress
+
+    global_common = new_global_common()
+    devnull = open(os.devnull, "w")
+    results = {}
+    for quiet in [False, True]:
+        # Log to nowhere, so the terminal isn't measured
+        setup_logging(work_dir, "INFO", False, quiet)
+        for handler in logging.getLogger("dangerzone").handlers:
+            handler.setStream(devnull)
+
+        for num_lines in [1000, 10000]:
+            lines = container_output_lines(num_lines)
+            global_common.exec_dangerzone_container = lambda args: FakeProcess(lines)
+            common = Common()
+            common.document_filename = "a.pdf"
+            common.progress = ConversionProgress(
+                global_common.throughput, "a.pdf", True
+            )
+            common.progress.start_stage("documenttopixels")
+
+            def loop():
+                cli.exec_container(global_common, ["documenttopixels"], common)
+
+            name = f"cli_log_loop/{num_lines}_lines{'_quiet' if quiet else ''}"
+            results[name] = best_time(loop, repeat)
+
+    logging.getLogger("dangerzone").handlers.clear()
+    devnull.close()
+    return results
+
+
+def bench_gui_log_loop(work_dir, repeat):
+    try:
+        from dangerzone.gui.tasks import TaskBase
+    except ImportError:
+        return None
+
+    from dangerzone.common import Common
+    from dangerzone.log import setup_logging
+    from dangerzone.progress import ConversionProgress
+
+    global_common = new_global_common()
+    setup_logging(work_dir, "INFO", False, True)
+
+    results = {}
+    for num_lines in [1000, 10000]:
+        lines = container_output_lines(num_lines)
+        global_common.exec_dangerzone_container = lambda args: FakeProcess(lines)
+        task = TaskBase()
+        task.global_common = global_common
+        task.common = Common()
+        task.common.document_filename = "a.pdf"
+        task.common.progress = ConversionProgress(
+            global_common.throughput, "a.pdf", True
+        )
+        task.common.progress.start_stage("documenttopixels")
+
+        def loop():
+            task.exec_container(["documenttopixels"])
+
+        results[f"gui_log_loop/{num_lines}_lines_quiet"] = best_time(loop, repeat)
+
+    logging.getLogger("dangerzone").handlers.clear()
+    return results
+
+
+def bench_settings(work_dir, repeat):
+    from dangerzone.settings import Settings
+
+    appdata_path = os.path.join(work_dir, "settings")
+    os.makedirs(appdata_path)
+    common = types.SimpleNamespace(appdata_path=appdata_path)
+
+    # The first one creates the settings file
+    settings = Settings(common)
+
+    def save():
+        settings.set("ocr", not settings.get("ocr"))
+        settings.save()
+
+    return {
+        "settings/load": best_time(lambda: Settings(common), repeat, 20),
+        "settings/save": best_time(save, repeat, 20),
+    }
+
+
+def bench_global_common(work_dir, repeat):
+    return {"global_common/init": best_time(new_global_common, repeat, 20)}
+
+
+def bench_find_pdf_viewers(work_dir, repeat):
+    if platform.system() != "Linux":
+        return None
+    try:
+        from dangerzone.gui.common import find_desktop_pdf_viewers
+    except ImportError:
+        return None
+
+    # A synthetic applications folder, where one in ten apps can open PDFs
+    apps_dir = os.path.join(work_dir, "applications")
+    os.makedirs(apps_dir)
+    for i in range(500):
+        mime_types = "application/pdf;" if i % 10 == 0 else "text/plain;"
+        with open(os.path.join(apps_dir, f"app{i}.desktop"), "w") as f:
+            f.write(
+                "[Desktop Entry]\n"
+                "Type=Application\n"
+                f"Name=App {i}\n"
+                f"Exec=app{i} %f\n"
+                f"MimeType={mime_types}\n"
+            )
+
+    return {
+        "find_pdf_viewers/500_apps": best_time(
+            lambda: find_desktop_pdf_viewers([apps_dir]), repeat
+        )
+    }
+
+
+def bench_import_time(work_dir, repeat):
+    results = {}
+    for mode, module in modes.items():
+        times = [measure_import(mode, module) for _ in range(repeat)]
+        if None not in times:
+            results[f"import_time/{mode}"] = min(times) / 1000
+    return results
+
+
+benchmarks = [
+    bench_validate_pixel_output,
+    bench_cli_log_loop,
+    bench_gui_log_loop,
+    bench_settings,
+    bench_global_common,
+    bench_find_pdf_viewers,
+    bench_import_time,
+]
+
+
+def run(args):
+    # Keep the benchmark's settings and scratch folders apart from the real ones
+    work_dir = tempfile.mkdtemp(prefix="dangerzone-micro-")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, "cache")
+    os.environ["XDG_CONFIG_HOME"] = os.path.join(work_dir, "config")
+
+    results = {}
+    try:
+        for bench in benchmarks:
+            name = bench.__name__[len("bench_") :]
+            if args.filter and args.filter not in name:
+                continue
+            bench_results = bench(work_dir, args.repeat)
+            if bench_results is None:
+                print(f"{name}: skipped", file=sys.stderr)
+                continue
+            for key, seconds in bench_results.items():
+                print(f"{key:<45} {seconds * 1000:10.3f} ms", file=sys.stderr)
+            results.update(bench_results)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    data = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return compare(baseline, data, args.threshold)
+    return 0
+
+
+def compare(baseline, current, threshold):
+    """
+    Print how each benchmark changed. Returns 1 if any of them is slower than the
+    baseline by more than threshold (a fraction), otherwise 0.
+    """
+    regressions = []
+    print(f"{'benchmark':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        before = baseline["results"].get(name)
+        after = current["results"].get(name)
+        if before is None or after is None:
+            status = "new" if before is None else "missing"
+            print(f"{name:<45} {'':>12} {'':>12} {status:>8}")
+            continue
+
+        change = (after - before) / before if before else 0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<45} {before * 1000:10.3f}ms {after * 1000:10.3f}ms "
+            f"{change * 100:+7.1f}%{flag}"
+        )
+
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) regressed by more than "
+            f"{threshold * 100:.0f}%: {', '.join(regressions)}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", help="Save the results to this JSON file")
+    run_parser.add_argument("--baseline", help="Compare the results to this baseline")
+    run_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fail if a benchmark is slower than the baseline by more than this",
+    )
+    run_parser.add_argument("--repeat", type=int, default=5, help="Best of how many")
+    run_parser.add_argument(
+        "--filter", help="Only run benchmarks with this in the name"
+    )
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Fail if a benchmark is slower than the baseline by more than this",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        sys.exit(compare(baseline, current, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Convert documents through dangerzone-cli, using the stand-in container runtime in
+fake_runtime.py, and report how long each stage took, pages per second, peak memory
+and peak scratch disk usage.
+
+By default it converts each of the samples in test_docs. Each document can be
+replicated (to see how a batch behaves), and synthetic variants with more pages can be
+added (the stand-in runtime pretends the document has that many pages).
+
+Usage:
+    ./benchmarks/pipeline.py [--replicas 3] [--pages 100 --pages 1000] [--json] [files...]
+"""
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import tempfile
+import argparse
+import platform
+import threading
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+fake_runtime_path = os.path.join(root, "benchmarks", "fake_runtime.py")
+cli_path = os.path.join(root, "dev_scripts", "dangerzone-cli")
+
+
+class ScratchSampler(threading.Thread):
+    """
+    Keep track of the most space that dangerzone's scratch folders use while a
+    conversion runs
+    """
+
+    def __init__(self, interval=0.05):
+        super(ScratchSampler, self).__init__(daemon=True)
+        self.interval = interval
+        self.peak_bytes = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        # Imported here, after XDG_CACHE_HOME points at the benchmark's cache folder
+        from dangerzone.metrics import get_scratch_bytes
+
+        while not self.stop_event.is_set():
+            self.peak_bytes = max(self.peak_bytes, get_scratch_bytes())
+            self.stop_event.wait(self.interval)
+        self.peak_bytes = max(self.peak_bytes, get_scratch_bytes())
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def run_cli(filenames, env):
+    """
+    Convert filenames with one dangerzone-cli process. Returns a tuple like:
+    (records (list), wall time (float), peak RSS in bytes (int or None), returncode)
+    """
+    args = [sys.executable, cli_path, "--json", "--skip-update", "--quiet"] + filenames
+
+    start_time = time.monotonic()
+    p = subprocess.Popen(
+        args,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    stdout = p.stdout.read()
+    p.stdout.close()
+
+    # wait4 gives us the resource usage of the process and everything it waited for
+    # (the broker, and the container runtime), so the peak RSS is the largest of them
+    peak_rss = None
+    if hasattr(os, "wait4"):
+        _, status, rusage = os.wait4(p.pid, 0)
+        p.returncode = os.waitstatus_to_exitcode(status)
+        peak_rss = rusage.ru_maxrss
+        if platform.system() != "Darwin":
+            # Linux reports kilobytes, macOS reports bytes
+            peak_rss *= 1024
+    else:
+        p.wait()
+    wall = time.monotonic() - start_time
+
+    records = []
+    for line in stdout.split("\n"):
+        if line.strip():
+            records.append(json.loads(line))
+    return records, wall, peak_rss, p.returncode
+
+
+def summarize(label, records, wall, peak_rss, peak_scratch):
+    stage_seconds = {}
+    pages = 0
+    failed = 0
+    for record in records:
+        if not record["success"]:
+            failed += 1
+            continue
+        pages += record["pages"] or 0
+        for stage in record["stages"]:
+            stage_seconds.setdefault(stage["stage"], []).append(stage["seconds"])
+
+    stages = {
+        stage: sum(seconds) / len(seconds) for stage, seconds in stage_seconds.items()
+    }
+    conversion_seconds = sum(sum(seconds) for seconds in stage_seconds.values())
+    return {
+        "label": label,
+        "documents": len(records),
+        "failed": failed,
+        "pages": pages,
+        "stage_seconds": stages,
+        "pages_per_second": pages / conversion_seconds if conversion_seconds else None,
+        "wall_seconds": wall,
+        "peak_rss_bytes": peak_rss,
+        "peak_scratch_bytes": peak_scratch,
+    }
+
+
+def format_mb(num_bytes):
+    if num_bytes is None:
+        return "?"
+    return f"{num_bytes / 1024 / 1024:.1f}"
+
+
+def print_table(results):
+    print(
+        f"{'document':<24} {'docs':>4} {'pages':>6} {'to pixels':>10} {'to pdf':>8} "
+        f"{'pages/s':>8} {'wall':>7} {'RSS MB':>7} {'disk MB':>8}"
+    )
+    for r in results:
+        pages_per_second = r["pages_per_second"]
+        print(
+            f"{r['label']:<24} {r['documents']:>4} {r['pages']:>6} "
+            f"{r['stage_seconds'].get('documenttopixels', 0):>9.2f}s "
+            f"{r['stage_seconds'].get('pixelstopdf', 0):>7.2f}s "
+            f"{pages_per_second if pages_per_second else 0:>8.1f} "
+            f"{r['wall_seconds']:>6.2f}s "
+            f"{format_mb(r['peak_rss_bytes']):>7} "
+            f"{format_mb(r['peak_scratch_bytes']):>8}"
+            + (f"  ({r['failed']} failed)" if r["failed"] else "")
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "filenames", nargs="*", help="Documents to convert (default: test_docs)"
+    )
+    parser.add_argument(
+        "--replicas", type=int, default=1, help="Convert this many copies of each"
+    )
+    parser.add_argument(
+        "--pages",
+        type=int,
+        action="append",
+        default=[],
+        help="Also convert a variant of each document with this many pages",
+    )
+    parser.add_argument(
+        "--page-delay",
+        type=float,
+        default=0,
+        help="Seconds the stand-in runtime spends on each page, per stage",
+    )
+    parser.add_argument("--width", type=int, default=1275, help="Page width in pixels")
+    parser.add_argument(
+        "--height", type=int, default=1650, help="Page height in pixels"
+    )
+    parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    args = parser.parse_args()
+
+    filenames = args.filenames or sorted(
+        glob.glob(os.path.join(root, "test_docs", "sample.*"))
+    )
+    if not filenames:
+        print("No documents to convert", file=sys.stderr)
+        sys.exit(1)
+
+    # Keep the benchmark's settings, throughput history and scratch folders apart from
+    # the real ones
+    work_dir = tempfile.mkdtemp(prefix="dangerzone-benchmark-")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, "cache")
+    os.environ["XDG_CONFIG_HOME"] = os.path.join(work_dir, "config")
+
+    env = os.environ.copy()
+    env["DANGERZONE_CONTAINER_RUNTIME"] = fake_runtime_path
+    env["FAKE_RUNTIME_WIDTH"] = str(args.width)
+    env["FAKE_RUNTIME_HEIGHT"] = str(args.height)
+    env["FAKE_RUNTIME_PAGE_DELAY"] = str(args.page_delay)
+    env.pop("FAKE_RUNTIME_PAGES", None)
+
+    # Each document as it is, and then with each of the synthetic page counts
+    variants = [(None, filename) for filename in filenames]
+    for num_pages in args.pages:
+        variants += [(num_pages, filename) for filename in filenames]
+
+    results = []
+    try:
+        for num_pages, filename in variants:
+            basename = os.path.basename(filename)
+            label = basename if num_pages is None else f"{basename} ({num_pages}p)"
+
+            # Copy the document, so the safe PDFs are written in the work folder
+            doc_dir = tempfile.mkdtemp(dir=work_dir)
+            name, ext = os.path.splitext(basename)
+            copies = []
+            for i in range(args.replicas):
+                copy = os.path.join(doc_dir, f"{name}-{i + 1}{ext}")
+                shutil.copy(filename, copy)
+                copies.append(copy)
+
+            run_env = dict(env)
+            if num_pages is not None:
+                run_env["FAKE_RUNTIME_PAGES"] = str(num_pages)
+
+            sampler = ScratchSampler()
+            sampler.start()
+            records, wall, peak_rss, returncode = run_cli(copies, run_env)
+            sampler.stop()
+
+            if not records:
+                print(f"{label}: dangerzone-cli failed ({returncode})", file=sys.stderr)
+                continue
+            result = summarize(label, records, wall, peak_rss, sampler.peak_bytes)
+            results.append(result)
+            shutil.rmtree(doc_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    main()
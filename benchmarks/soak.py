@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Run thousands of conversions in one process, using the stand-in container runtime in
+fake_runtime.py, and fail if file descriptors, child processes, threads, memory,
+scratch folders or leftover containers keep growing.
+
+The cli engine converts documents one at a time like dangerzone-cli does. The gui
+engine converts them in batches through the GUI's queue (this needs PySide2, and runs
+with Qt's offscreen platform). Some of the documents fail to convert, so that failed
+conversions are covered too.
+
+Usage:
+    ./benchmarks/soak.py [--engine cli|gui] [--conversions 2000] [--json]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import contextlib
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+fake_runtime_path = os.path.join(root, "benchmarks", "fake_runtime.py")
+
+# How much each resource is allowed to grow between the start and the end of the
+# run (after warming up) before it counts as a leak
+tolerances = {
+    "fds": 4,
+    "children": 1,
+    "threads": 4,
+    "rss_bytes": 32 * 1024 * 1024,
+    "scratch_bytes": 1024 * 1024,
+    "scratch_dirs": 2,
+    "containers": 0,
+}
+
+
+def count_fds():
+    for fd_dir in ["/proc/self/fd", "/dev/fd"]:
+        if os.path.isdir(fd_dir):
+            return len(os.listdir(fd_dir))
+    return None
+
+
+def count_children():
+    """
+    How many processes are descended from this one (Linux only)
+    """
+    if not os.path.isdir("/proc"):
+        return None
+
+    parents = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The command name is in parentheses and can have spaces, so split
+                # after it
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(pid)] = int(fields[1])
+        except (OSError, IndexError, ValueError):
+            pass
+
+    descendants = set()
+    new = {os.getpid()}
+    while new:
+        new = {pid for pid, ppid in parents.items() if ppid in new} - descendants
+        descendants |= new
+    return len(descendants)
+
+
+def count_threads():
+    # Native threads too, like Qt's, if we can
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+def get_rss():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def count_scratch_dirs():
+    import appdirs
+
+    cache_dir = appdirs.user_cache_dir("dangerzone")
+    try:
+        return len(
+            [
+                name
+                for name in os.listdir(cache_dir)
+                if name.startswith("pixel-") or name.startswith("safe-")
+            ]
+        )
+    except OSError:
+        return 0
+
+
+def count_containers(state_dir):
+    try:
+        return len(os.listdir(os.path.join(state_dir, "containers")))
+    except OSError:
+        return 0
+
+
+def sample_resources(conversions, state_dir):
+    from dangerzone.metrics import get_scratch_bytes
+
+    return {
+        "conversions": conversions,
+        "fds": count_fds(),
+        "children": count_children(),
+        "threads": count_threads(),
+        "rss_bytes": get_rss(),
+        "scratch_bytes": get_scratch_bytes(),
+        "scratch_dirs": count_scratch_dirs(),
+        "containers": count_containers(state_dir),
+    }
+
+
+def find_leaks(samples, warmup=0.2):
+    """
+    Compare the first and last quarters of the samples after warming up. Returns a
+    list of (resource, start, end) for each resource that grew more than it's allowed.
+    """
+    samples = samples[int(len(samples) * warmup) :]
+    if len(samples) < 4:
+        return []
+    quarter = len(samples) // 4
+
+    leaks = []
+    for resource, tolerance in tolerances.items():
+        values = [s[resource] for s in samples if s[resource] is not None]
+        if len(values) < 4:
+            continue
+        start = sum(values[:quarter]) / quarter
+        end = sum(values[-quarter:]) / quarter
+        if end - start > tolerance:
+            leaks.append((resource, start, end))
+    return leaks
+
+
+def make_documents(work_dir, filenames, num_documents, fail_every):
+    """
+    Copies of the documents to convert, named so that their safe PDFs don't clash. Every
+    fail_every-th document is one the stand-in runtime can't convert.
+    """
+    from fake_runtime import fail_marker, fake_document
+
+    doc_dir = tempfile.mkdtemp(dir=work_dir, prefix="documents-")
+    documents = []
+    for i in range(num_documents):
+        filename = filenames[i % len(filenames)]
+        name, ext = os.path.splitext(os.path.basename(filename))
+        copy = os.path.join(doc_dir, f"{name}-{i}{ext}")
+        if fail_every and i % fail_every == fail_every - 1:
+            with open(copy, "wb") as f:
+                f.write(fake_document(fail_marker))
+        else:
+            shutil.copy(filename, copy)
+        documents.append(copy)
+    return doc_dir, documents
+
+
+def soak_cli(args, work_dir, state_dir):
+    from dangerzone import cli
+    from dangerzone.common import Common
+    from dangerzone.global_common import GlobalCommon
+
+    global_common = GlobalCommon()
+
+    # Run the container for the documents that fail every time, instead of
+    # remembering that they fail
+    global_common.settings.set("remember_failures", False)
+    global_common.start_broker()
+
+    samples = [sample_resources(0, state_dir)]
+    done = 0
+    try:
+        while done < args.conversions:
+            batch = min(args.sample_every, args.conversions - done)
+            doc_dir, documents = make_documents(
+                work_dir, args.filenames, batch, args.fail_every
+            )
+            for filename in documents:
+                common = Common()
+                common.document_filename = filename
+                common.save_filename = f"{os.path.splitext(filename)[0]}-safe.pdf"
+                cli.convert(global_common, common, None)
+                common = None
+            shutil.rmtree(doc_dir)
+
+            done += batch
+            samples.append(sample_resources(done, state_dir))
+            report_progress(samples[-1])
+    finally:
+        global_common.stop_broker()
+    return samples
+
+
+def soak_gui(args, work_dir, state_dir):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PySide2 import QtCore, QtWidgets
+        from dangerzone.gui.common import GuiCommon
+        from dangerzone.gui.queue_widget import QueueWidget
+    except ImportError as e:
+        print(f"The gui engine needs PySide2: {e}", file=sys.stderr)
+        sys.exit(2)
+    from dangerzone.global_common import GlobalCommon
+
+    app = QtWidgets.QApplication([])
+    global_common = GlobalCommon()
+    global_common.settings.set("update_container", False)
+    global_common.settings.set("ocr", False)
+    global_common.settings.set("remember_failures", False)
+    global_common.settings.save()
+    gui_common = GuiCommon(app, global_common)
+    gui_common.container_image_present = True
+    global_common.start_broker()
+
+    samples = [sample_resources(0, state_dir)]
+    done = 0
+    try:
+        while done < args.conversions:
+            batch = min(args.sample_every, args.conversions - done)
+            doc_dir, documents = make_documents(
+                work_dir, args.filenames, batch, args.fail_every
+            )
+
+            # Convert the batch through a queue, like a window would
+            queue_widget = QueueWidget(global_common, gui_common)
+            queue_widget.documents_selected(documents)
+            queue_widget.start()
+            while any(item.succeeded is None for item in queue_widget.items):
+                app.processEvents(QtCore.QEventLoop.AllEvents, 50)
+
+            # And close it
+            queue_widget.deleteLater()
+            queue_widget = None
+            QtCore.QCoreApplication.sendPostedEvents(None, QtCore.QEvent.DeferredDelete)
+            app.processEvents()
+            shutil.rmtree(doc_dir)
+
+            done += batch
+            samples.append(sample_resources(done, state_dir))
+            report_progress(samples[-1])
+    finally:
+        global_common.stop_broker()
+    return samples
+
+
+def report_progress(sample):
+    print(
+        f"{sample['conversions']:>7} conversions  fds {sample['fds']}  "
+        f"children {sample['children']}  threads {sample['threads']}  "
+        f"rss {(sample['rss_bytes'] or 0) / 1024 / 1024:.1f} MB  "
+        f"scratch {sample['scratch_bytes'] / 1024 / 1024:.1f} MB "
+        f"({sample['scratch_dirs']} dirs)  containers {sample['containers']}",
+        file=sys.stderr,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "filenames",
+        nargs="*",
+        help="Documents to convert over and over (default: test_docs/sample.pdf)",
+    )
+    parser.add_argument("--engine", choices=["cli", "gui"], default="cli")
+    parser.add_argument("--conversions", type=int, default=2000)
+    parser.add_argument(
+        "--sample-every",
+        type=int,
+        default=50,
+        help="Check resources after this many conversions",
+    )
+    parser.add_argument(
+        "--fail-every",
+        type=int,
+        default=10,
+        help="Every this many documents fails to convert (0 for none)",
+    )
+    parser.add_argument("--json", action="store_true", help="Output samples as JSON")
+    args = parser.parse_args()
+    args.filenames = [os.path.abspath(f) for f in args.filenames] or [
+        os.path.join(root, "test_docs", "sample.pdf")
+    ]
+
+    # Keep the soak test's settings, scratch folders and containers apart from the
+    # real ones. Small pages keep it fast, since it's the host side being tested.
+    work_dir = tempfile.mkdtemp(prefix="dangerzone-soak-")
+    state_dir = os.path.join(work_dir, "runtime")
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, "cache")
+    os.environ["XDG_CONFIG_HOME"] = os.path.join(work_dir, "config")
+    os.environ["DANGERZONE_CONTAINER_RUNTIME"] = fake_runtime_path
+    os.environ["FAKE_RUNTIME_STATE_DIR"] = state_dir
+    os.environ.setdefault("FAKE_RUNTIME_PAGES", "2")
+    os.environ.setdefault("FAKE_RUNTIME_WIDTH", "200")
+    os.environ.setdefault("FAKE_RUNTIME_HEIGHT", "200")
+
+    from dangerzone.log import setup_logging
+
+    setup_logging(work_dir, "ERROR", False, True)
+
+    start_time = time.monotonic()
+    try:
+        # The conversions print a lot, which isn't what's being tested
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if args.engine == "cli":
+                samples = soak_cli(args, work_dir, state_dir)
+            else:
+                samples = soak_gui(args, work_dir, state_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    seconds = time.monotonic() - start_time
+
+    leaks = find_leaks(samples)
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "engine": args.engine,
+                    "seconds": seconds,
+                    "samples": samples,
+                    "leaks": [
+                        {"resource": r, "start": s, "end": e} for r, s, e in leaks
+                    ],
+                },
+                indent=4,
+            )
+        )
+    else:
+        print(f"{args.conversions} conversions in {seconds:.1f} seconds")
+        for resource, start, end in leaks:
+            print(f"Leak: {resource} grew from {start:.0f} to {end:.0f}")
+
+    if leaks:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
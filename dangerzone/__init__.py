@@ -12,9 +12,15 @@ else:
     else:
         mode = "gui"
 
-if mode == "container":
-    from .container import container_main as main
-elif mode == "cli":
-    from .cli import cli_main as main
-else:
-    from .gui import gui_main as main
+
+def main():
+    # Only import the code for the mode we're running in, so that (for example)
+    # dangerzone-container doesn't have to load Qt
+    if mode == "container":
+        from .container import container_main as mode_main
+    elif mode == "cli":
+        from .cli import cli_main as mode_main
+    else:
+        from .gui import gui_main as mode_main
+
+    return mode_main()
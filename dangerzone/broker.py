@@ -0,0 +1,176 @@
+import json
+import queue
+import subprocess
+import threading
+
+
+class BrokerStream(object):
+    """
+    The stderr of a brokered command. Like a pipe, read() blocks until the command exits
+    """
+
+    def __init__(self, process):
+        self.process = process
+
+    def read(self):
+        self.process.wait()
+        return self.process.stderr_data
+
+
+class BrokerProcess(object):
+    """
+    A command running inside the broker. It quacks enough like subprocess.Popen for the
+    code that runs dangerzone-container: it's a context manager, stdout is an iterable
+    of lines (bytes), stderr can be read, it has a returncode once it's done, and it
+    can be stopped.
+    """
+
+    def __init__(self, broker, request_id):
+        self.broker = broker
+        self.request_id = request_id
+        self.returncode = None
+        self.stderr_data = b""
+        self.stderr = BrokerStream(self)
+        self.messages = queue.Queue()
+        self.stopped = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        self.wait()
+
+    @property
+    def stdout(self):
+        while self.returncode is None:
+            message = self.messages.get()
+            if "stdout" in message:
+                yield message["stdout"].encode()
+            if "stderr" in message:
+                self.stderr_data += message["stderr"].encode()
+            if "returncode" in message:
+                self.returncode = message["returncode"]
+                self.broker.finished(self.request_id)
+
+    def wait(self):
+        for _ in self.stdout:
+            pass
+        return self.returncode
+
+    def communicate(self):
+        stdout_data = b"".join(self.stdout)
+        return stdout_data, self.stderr_data
+
+    def poll(self):
+        return self.returncode
+
+    def terminate(self):
+        """
+        Stop waiting for the command, as if it was killed. The broker can't kill it, so
+        anything it outputs after this is ignored.
+        """
+        if not self.stopped:
+            self.stopped = True
+            self.messages.put({"returncode": -15})
+
+    def kill(self):
+        self.terminate()
+
+
+class ContainerBroker(object):
+    """
+    A long-lived `dangerzone-container broker` process. It's started (and authorized)
+    once per session, and then all of the container commands go through it instead of
+    starting a new dangerzone-container for each one.
+    """
+
+    def __init__(self, global_common):
+        self.global_common = global_common
+        self.p = None
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.processes = {}
+
+    def start(self):
+        """
+        Start the broker. Returns a tuple like: (success (boolean), error_message (str))
+        """
+        self.p = subprocess.Popen(
+            [self.global_common.dz_container_path, "broker"],
+            startupinfo=self.global_common.get_subprocess_startupinfo(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+        # Wait for the broker to say it's ready
+        try:
+            ready = json.loads(self.p.stdout.readline()).get("ready", False)
+        except ValueError:
+            ready = False
+
+        if not ready:
+            self.p.stdin.close()
+            returncode = self.p.wait()
+            self.p = None
+
+            # The user canceled, or permission denied
+            if returncode == 126 or returncode == 127:
+                return False, "Authorization failed"
+            return False, "Broker error"
+
+        t = threading.Thread(target=self.read_messages, daemon=True)
+        t.start()
+        return True, True
+
+    def is_running(self):
+        return self.p is not None and self.p.poll() is None
+
+    def stop(self):
+        if self.p:
+            try:
+                self.p.stdin.close()
+            except OSError:
+                pass
+            self.p.wait()
+            self.p = None
+
+    def exec(self, args):
+        with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            process = BrokerProcess(self, request_id)
+            self.processes[request_id] = process
+
+            request = json.dumps({"id": request_id, "args": args}) + "\n"
+            try:
+                self.p.stdin.write(request.encode())
+                self.p.stdin.flush()
+            except (OSError, AttributeError):
+                # The broker isn't running anymore
+                process.messages.put({"stderr": "Broker error\n", "returncode": 1})
+
+        return process
+
+    def finished(self, request_id):
+        with self.lock:
+            self.processes.pop(request_id, None)
+
+    def read_messages(self):
+        p = self.p
+        for line in p.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+
+            with self.lock:
+                process = self.processes.get(message.get("id"))
+            if process:
+                process.messages.put(message)
+
+        # The broker quit, so fail any commands that are still waiting on it
+        returncode = p.wait() or 1
+        with self.lock:
+            processes = list(self.processes.values())
+        for process in processes:
+            process.messages.put({"returncode": returncode})
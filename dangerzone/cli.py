@@ -1,10 +1,22 @@
 import os
-import shutil
+import sys
+import json
+import time
+import signal
 import click
+import colorama
 from colorama import Fore, Back, Style
 
 from .global_common import GlobalCommon
-from .common import Common
+from .common import Common, get_save_filenames, is_writable
+from .progress import ConversionProgress
+from .report import DocumentReport
+from .log import setup_logging, log_container_output, container_logger, logger
+from .janitor import ScratchJanitor
+from .watchdog import Watchdog
+from .failures import get_retry_delay, classify_invalid_output
+from .sniff import sniff_mime_type
+from .page_range import parse_page_range, format_page_range
 
 
 def print_header(s):
@@ -12,31 +24,76 @@ def print_header(s):
     click.echo(Style.BRIGHT + s)
 
 
-def exec_container(global_common, args):
-    output = ""
-
-    with global_common.exec_dangerzone_container(args) as p:
-        for line in p.stdout:
-            output += line.decode()
-
-            # Hack to add colors to the command executing
-            if line.startswith(b"> "):
-                print(
-                    Style.DIM + "> " + Style.NORMAL + Fore.CYAN + line.decode()[2:],
-                    end="",
-                )
-            else:
-                print("  " + line.decode(), end="")
+def print_progress(progress):
+    width = 30
+    filled = int(width * progress.fraction())
+    bar = "#" * filled + "-" * (width - filled)
+    click.echo(f"\r  [{bar}] {progress.describe()}".ljust(79), nl=False)
 
-        stderr = p.stderr.read().decode()
-        if len(stderr) > 0:
-            print("")
-            for line in stderr.strip().split("\n"):
-                print("  " + Style.DIM + line)
 
-    if p.returncode != 0:
+def exec_container(global_common, args, common=None, progress_bar=False):
+    output = ""
+    progress = common.progress if common else None
+    track = common.trace_track if common else None
+    progress_bar = progress_bar and progress is not None
+    trace_state = {}
+    start_time = time.monotonic()
+
+    # With a progress bar, don't show the container output
+    log_output = log_container_output() and not progress_bar
+
+    watchdog = Watchdog(global_common, common, args[0])
+    span = global_common.tracer.span(f"dangerzone-container {args[0]}", track)
+    with watchdog, span, global_common.exec_dangerzone_container(args) as p:
+        if common:
+            common.running_process = p
+        try:
+            if progress_bar:
+                print_progress(progress)
+
+            for line in p.stdout:
+                watchdog.activity()
+                line = line.decode()
+                if global_common.tracer.handle_trace_line(line, track, trace_state):
+                    continue
+                output += line
+
+                if progress and progress.parse_line(line) and progress_bar:
+                    print_progress(progress)
+                if common and common.stop_past_page_range(global_common):
+                    logger.info("Converted every page in the page range, stopping")
+
+                if log_output:
+                    container_logger.info(line.rstrip("\n"))
+
+            if progress_bar:
+                print_progress(progress)
+                click.echo("")
+
+            stderr = p.stderr.read().decode()
+            if len(stderr) > 0 and log_output:
+                for line in stderr.strip().split("\n"):
+                    container_logger.info(line, extra={"stream": "stderr"})
+        except KeyboardInterrupt:
+            # Kill the container, so waiting for it to exit doesn't take long
+            if common:
+                global_common.cancel_conversion(common)
+            raise
+
+    if common:
+        common.running_container = None
+        common.running_process = None
+
+    seconds = time.monotonic() - start_time
+    global_common.metrics.stage_duration.observe(seconds, stage=args[0])
+    if common and common.report:
+        common.report.add_stage(args[0], seconds, p.returncode)
+
+    if p.returncode != 0 and not (common and common.stage_succeeded(p.returncode)):
         click.echo(f"Return code: {p.returncode}")
-        if p.returncode == 126 or p.returncode == 127:
+        if common and common.timeout_error:
+            click.echo(f"Timed out: {common.timeout_error}")
+        elif p.returncode == 126 or p.returncode == 127:
             click.echo(f"Authorization failed")
 
     return p.returncode, output, stderr
@@ -46,63 +103,158 @@ def exec_container(global_common, args):
 @click.option("--custom-container", help="Use a custom container")
 @click.option("--safe-pdf-filename", help="Default is filename ending with -safe.pdf")
 @click.option("--ocr-lang", help="Language to OCR, defaults to none")
+@click.option("--pages", help="Only convert these pages, like 1-10,15 (default all)")
 @click.option(
     "--skip-update",
     is_flag=True,
     help="Don't update flmcode/dangerzone container",
 )
-@click.argument("filename", required=True)
-def cli_main(custom_container, safe_pdf_filename, ocr_lang, skip_update, filename):
+@click.option(
+    "--progress",
+    is_flag=True,
+    help="Show a progress bar instead of the container output",
+)
+@click.option(
+    "--trace",
+    "trace_filename",
+    help="Save how long each stage took to this file, as a Chrome trace",
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    help="Serve Prometheus metrics on this localhost port",
+)
+@click.option("--metrics-file", help="Save a JSON snapshot of metrics to this file")
+@click.option(
+    "--metrics-interval",
+    type=int,
+    default=10,
+    show_default=True,
+    help="Seconds between metrics snapshots",
+)
+@click.option(
+    "--json",
+    "json_output",
+    is_flag=True,
+    help="Print a JSON record for each document, instead of the banner and colors",
+)
+@click.option(
+    "--report",
+    "report_filename",
+    help="Save a JSON record for each document to this file",
+)
+@click.option(
+    "--log-level",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False),
+    default="INFO",
+    show_default=True,
+    help="Only show log messages at this level or above",
+)
+@click.option(
+    "--log-file",
+    is_flag=True,
+    help="Also log to a rotating log file in the app data folder",
+)
+@click.option(
+    "--quiet",
+    is_flag=True,
+    help="Don't show the output of the container",
+)
+@click.argument("filenames", required=True, nargs=-1)
+def cli_main(
+    custom_container,
+    safe_pdf_filename,
+    ocr_lang,
+    pages,
+    skip_update,
+    progress,
+    trace_filename,
+    metrics_port,
+    metrics_file,
+    metrics_interval,
+    json_output,
+    report_filename,
+    log_level,
+    log_file,
+    quiet,
+    filenames,
+):
     global_common = GlobalCommon()
-    common = Common()
-
-    global_common.display_banner()
 
-    # Validate filename
-    valid = True
-    try:
-        with open(os.path.abspath(filename), "rb") as f:
-            pass
-    except:
-        valid = False
+    # Being asked to terminate cancels the conversion, just like Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    # With --json, stdout only gets the JSON records. Everything else goes to stderr,
+    # without colors.
+    json_stream = None
+    if json_output:
+        colorama.deinit()
+        json_stream = sys.stdout
+        colorama.init(strip=True)
+        sys.stdout = sys.stderr
+    setup_logging(
+        global_common.appdata_path,
+        log_level.upper(),
+        log_file,
+        quiet,
+        color=False if json_output else None,
+    )
 
-    if not valid:
-        click.echo("Invalid filename")
-        return
+    if trace_filename:
+        global_common.tracer.enable()
+    if metrics_port:
+        global_common.metrics.serve(metrics_port)
+    if metrics_file:
+        global_common.metrics.start_snapshots(metrics_file, metrics_interval)
 
-    common.document_filename = os.path.abspath(filename)
+    if not json_output:
+        global_common.display_banner()
 
-    # Validate safe PDF output filename
-    if safe_pdf_filename:
+    # Validate filenames
+    documents = []
+    for filename in filenames:
         valid = True
-        if not safe_pdf_filename.endswith(".pdf"):
-            click.echo("Safe PDF filename must end in '.pdf'")
-            return
-
         try:
-            with open(os.path.abspath(safe_pdf_filename), "wb") as f:
+            with open(os.path.abspath(filename), "rb") as f:
                 pass
         except:
             valid = False
 
         if not valid:
+            click.echo(f"Invalid filename: {filename}")
+            return
+
+        common = Common()
+        common.document_filename = os.path.abspath(filename)
+        documents.append(common)
+
+    # Validate safe PDF output filename
+    if safe_pdf_filename:
+        if len(documents) > 1:
+            click.echo("--safe-pdf-filename can only be used with a single document")
+            return
+
+        common = documents[0]
+        if not safe_pdf_filename.endswith(".pdf"):
+            click.echo("Safe PDF filename must end in '.pdf'")
+            return
+
+        if not is_writable(os.path.abspath(safe_pdf_filename)):
             click.echo("Safe PDF filename is not writable")
             return
 
         common.save_filename = os.path.abspath(safe_pdf_filename)
 
     else:
-        common.save_filename = (
-            f"{os.path.splitext(common.document_filename)[0]}-safe.pdf"
-        )
-        try:
-            with open(common.save_filename, "wb") as f:
-                pass
-        except:
-            click.echo(
-                f"Output filename {common.save_filename} is not writable, use --safe-pdf-filename"
-            )
-            return
+        # Documents with the same name get different safe PDF filenames
+        save_filenames = get_save_filenames([c.document_filename for c in documents])
+        for common, save_filename in zip(documents, save_filenames):
+            common.save_filename = save_filename
+            if not is_writable(common.save_filename):
+                click.echo(
+                    f"Output filename {common.save_filename} is not writable, use --safe-pdf-filename"
+                )
+                return
 
     # Validate OCR language
     if ocr_lang:
@@ -117,57 +269,238 @@ def cli_main(custom_container, safe_pdf_filename, ocr_lang, skip_update, filenam
                 click.echo(f"{global_common.ocr_languages[lang]}: {lang}")
             return
 
-    # Validate custom container
-    if custom_container:
-        success, error_message = global_common.container_exists(custom_container)
-        if not success:
-            click.echo(error_message)
+    # Validate page range
+    try:
+        page_range = parse_page_range(pages)
+    except ValueError as e:
+        click.echo(f"{e}. Page ranges look like: 1-10,15,20-")
+        return
+    for common in documents:
+        common.page_range = page_range
+
+    reporting = json_output or report_filename
+    if reporting:
+        for common in documents:
+            common.report = DocumentReport(
+                common.document_filename,
+                custom_container or global_common.get_container_name(),
+                ocr_lang,
+                page_range,
+            )
+
+    # Clean up scratch directories that earlier conversions left behind
+    ScratchJanitor(global_common).clean()
+
+    # Start the broker, so the container commands for all of the documents only need
+    # to be authorized once
+    success, error_message = global_common.start_broker()
+    if not success:
+        click.echo(error_message)
+        if error_message == "Authorization failed":
             return
 
-        global_common.custom_container = custom_container
-    else:
-        if skip_update:
-            # Make sure flmcode/dangerzone exists
-            success, error_message = global_common.container_exists(
-                "flmcode/dangerzone"
-            )
+    try:
+        # Validate custom container
+        if custom_container:
+            success, error_message = global_common.container_exists(custom_container)
             if not success:
-                click.echo(
-                    "You don't have the flmcode/dangerzone container so you can't use --skip-update"
+                click.echo(error_message)
+                return
+
+            global_common.custom_container = custom_container
+        else:
+            if skip_update:
+                # Make sure flmcode/dangerzone exists
+                success, error_message = global_common.container_exists(
+                    "flmcode/dangerzone"
                 )
+                if not success:
+                    click.echo(
+                        "You don't have the flmcode/dangerzone container so you can't use --skip-update"
+                    )
+                    return
+
+        # Pull the latest image
+        if not skip_update:
+            print_header("Pulling container image (this might take a few minutes)")
+            returncode, _, _ = exec_container(global_common, ["pull"])
+            if returncode != 0:
                 return
 
-    # Pull the latest image
-    if not skip_update:
-        print_header("Pulling container image (this might take a few minutes)")
-        returncode, _, _ = exec_container(global_common, ["pull"])
-        if returncode != 0:
-            return
+        if reporting:
+            image_id = global_common.get_container_image_id()
+            for common in documents:
+                common.report.image_id = image_id
+
+        global_common.metrics.queue_depth.set(len(documents))
+        for common in documents:
+            global_common.metrics.queue_depth.dec()
+            if len(documents) > 1:
+                print_header(f"Document: {common.document_filename}")
+            global_common.metrics.jobs_running.set(1)
+            try:
+                convert(global_common, common, ocr_lang, progress)
+            finally:
+                global_common.metrics.jobs_running.set(0)
+                if json_stream:
+                    print_report(json_stream, common.report)
+
+    except KeyboardInterrupt:
+        click.echo("")
+        click.echo("Cancelled")
+
+    finally:
+        global_common.stop_broker()
+        global_common.metrics.stop()
+        if trace_filename:
+            global_common.tracer.save(trace_filename)
+
+        if reporting:
+            # Documents that never started, because something went wrong first
+            for common in documents:
+                if not common.report.success and not common.report.failure_reason:
+                    common.report.failed("not_converted")
+                    if json_stream:
+                        print_report(json_stream, common.report)
+
+            if report_filename:
+                with open(report_filename, "w") as f:
+                    for common in documents:
+                        print_report(f, common.report)
+
+
+def print_report(f, report):
+    f.write(json.dumps(report.to_dict()) + "\n")
+    f.flush()
+
+
+def document_failed(global_common, common, failure_reason, error=None):
+    global_common.conversion_failed(common, failure_reason, error)
+    if common.report:
+        common.report.failed(failure_reason, error)
+
+
+def convert(global_common, common, ocr_lang, progress_bar=False):
+    """
+    Convert a single document to a safe PDF. Returns True if it succeeded
+    """
+    common.progress = ConversionProgress(
+        global_common.throughput, common.document_filename, bool(ocr_lang)
+    )
+    common.trace_track = global_common.tracer.new_track(
+        os.path.basename(common.document_filename)
+    )
+    try:
+        with global_common.tracer.span(
+            "convert", common.trace_track, document=common.document_filename
+        ):
+            return _convert(global_common, common, ocr_lang, progress_bar)
+    except KeyboardInterrupt:
+        document_failed(global_common, common, "cancelled")
+        raise
+    finally:
+        common.cleanup()
+
+
+def exec_stage(global_common, args, common, progress_bar=False):
+    """
+    Run a stage of the conversion, and run it again if it fails for a reason that
+    might not happen the next time. Returns a tuple like:
+    (returncode (int), output (str), failure_reason (str or None))
+    """
+    attempt = 0
+    while True:
+        common.progress.start_stage(args[0])
+        common.stopped_early = False
+        returncode, output, stderr = exec_container(
+            global_common,
+            args + ["--name", common.name_container()],
+            common,
+            progress_bar,
+        )
+        if common.stage_succeeded(returncode):
+            return 0, output, None
+
+        failure_reason = global_common.get_failure_reason(
+            returncode, common, output, stderr
+        )
+        delay = get_retry_delay(global_common.settings, failure_reason, attempt)
+        if delay is None:
+            return returncode, output, failure_reason
+
+        click.echo(f"Failed ({failure_reason}), trying again in {delay} seconds")
+        global_common.metrics.retries.inc(reason=failure_reason)
+        common.clear_stage_output(args[0])
+        time.sleep(delay)
+        attempt += 1
+
+
+def _convert(global_common, common, ocr_lang, progress_bar):
+    # Don't bother starting a container for files that aren't documents
+    common.mime_type = sniff_mime_type(common.document_filename)
+    if not common.mime_type:
+        error = "The document format is not supported"
+        click.echo(error)
+        document_failed(global_common, common, "unsupported_format", error)
+        return False
+
+    # Documents that failed before for a reason that will happen every time, fail
+    # right away
+    known_failure = global_common.failure_cache.get(common)
+    if known_failure:
+        click.echo(
+            f"This document failed to convert before ({known_failure['reason']})"
+        )
+        document_failed(
+            global_common, common, known_failure["reason"], known_failure["error"]
+        )
+        return False
+
+    # Guess how many pages there are, so there's an estimate of how long it will take
+    # before the container has counted them
+    common.progress.estimated_pages = common.estimate_pages()
+    common.progress.page_range = common.page_range
+    if common.report:
+        common.report.estimated_pages = common.estimated_pages
 
     # Convert to pixels
     print_header("Converting document to pixels")
-    returncode, output, _ = exec_container(
-        global_common,
-        [
-            "documenttopixels",
-            "--document-filename",
-            common.document_filename,
-            "--pixel-dir",
-            common.pixel_dir.name,
-            "--container-name",
-            global_common.get_container_name(),
-        ],
+    args = [
+        "documenttopixels",
+        "--document-filename",
+        common.document_filename,
+        "--pixel-dir",
+        common.pixel_dir.name,
+        "--container-name",
+        global_common.get_container_name(),
+        "--mime-type",
+        common.mime_type,
+    ]
+    if common.page_range:
+        args += ["--pages", format_page_range(common.page_range)]
+    returncode, output, failure_reason = exec_stage(
+        global_common, args, common, progress_bar
     )
 
     if returncode != 0:
-        return
+        # The last thing the container said is usually why it failed
+        error = common.timeout_error or output.strip().split("\n")[-1] or None
+        document_failed(global_common, common, failure_reason, error)
+        return False
 
     success, error_message = global_common.validate_convert_to_pixel_output(
         common, output
     )
     if not success:
         click.echo(error_message)
-        return
+        document_failed(
+            global_common,
+            common,
+            classify_invalid_output(error_message),
+            error_message,
+        )
+        return False
+    common.progress.finish_stage()
 
     # Convert to PDF
     print_header("Converting pixels to safe PDF")
@@ -178,7 +511,7 @@ def cli_main(custom_container, safe_pdf_filename, ocr_lang, skip_update, filenam
         ocr = "0"
         ocr_lang = ""
 
-    returncode, _, _ = exec_container(
+    returncode, _, failure_reason = exec_stage(
         global_common,
         [
             "pixelstopdf",
@@ -193,13 +526,27 @@ def cli_main(custom_container, safe_pdf_filename, ocr_lang, skip_update, filenam
             "--ocr-lang",
             ocr_lang,
         ],
+        common,
+        progress_bar,
     )
 
     if returncode != 0:
-        return
+        document_failed(global_common, common, failure_reason, common.timeout_error)
+        return False
+    common.progress.finish_stage()
 
     # Save the safe PDF
-    source_filename = f"{common.safe_dir.name}/safe-output-compressed.pdf"
-    shutil.move(source_filename, common.save_filename)
+    try:
+        with global_common.tracer.span("save", common.trace_track):
+            common.save_safe_pdf()
+    except OSError as e:
+        error = f"Couldn't save the safe PDF: {e}"
+        click.echo(error)
+        document_failed(global_common, common, "save_failed", error)
+        return False
+    global_common.metrics.document_converted(common, common.save_filename)
+    if common.report:
+        common.report.succeeded(common.save_filename, common.num_pages)
     print_header("Safe PDF created successfully")
     click.echo(common.save_filename)
+    return True
@@ -1,9 +1,86 @@
 import os
 import stat
+import shutil
 import platform
 import tempfile
+import threading
+import uuid
 import appdirs
 
+from .report import hash_file
+from .page_count import count_pages
+from .page_range import count_pages_before
+
+# Scratch directories that conversions in this process are using right now, so the
+# janitor leaves them alone
+active_scratch_dirs = set()
+active_scratch_dirs_lock = threading.Lock()
+
+
+def new_scratch_dir(kind):
+    """
+    Create a pixel or safe scratch directory in the cache folder. The name includes
+    our pid, so the janitor can tell when it's been left behind by a process that's
+    no longer running.
+    """
+    cache_dir = appdirs.user_cache_dir("dangerzone")
+    os.makedirs(cache_dir, exist_ok=True)
+    with active_scratch_dirs_lock:
+        scratch_dir = tempfile.TemporaryDirectory(
+            prefix=os.path.join(cache_dir, f"{kind}-{os.getpid()}-")
+        )
+        active_scratch_dirs.add(scratch_dir.name)
+
+    try:
+        # Make the folder world-readable to ensure that the container has permission
+        # to access it even if it's owned by root or someone else
+        permissions = (
+            stat.S_IRUSR
+            | stat.S_IWUSR
+            | stat.S_IXUSR
+            | stat.S_IRGRP
+            | stat.S_IXGRP
+            | stat.S_IROTH
+            | stat.S_IXOTH
+        )
+        os.chmod(scratch_dir.name, permissions)
+    except:
+        pass
+
+    return scratch_dir
+
+
+def get_save_filenames(document_filenames):
+    """
+    The filename to save each document's safe PDF as, like "[filename]-safe.pdf".
+    Documents with the same name but a different extension, like sample.pdf and
+    sample.docx, would get the same one, so the later ones get a number too, like
+    "sample-safe-2.pdf". A safe PDF is never saved over one of the documents.
+    """
+    used = set(os.path.normcase(os.path.abspath(f)) for f in document_filenames)
+    save_filenames = []
+    for document_filename in document_filenames:
+        base = os.path.splitext(document_filename)[0]
+        save_filename = f"{base}-safe.pdf"
+        i = 2
+        while os.path.normcase(os.path.abspath(save_filename)) in used:
+            save_filename = f"{base}-safe-{i}.pdf"
+            i += 1
+        used.add(os.path.normcase(os.path.abspath(save_filename)))
+        save_filenames.append(save_filename)
+    return save_filenames
+
+
+def is_writable(filename):
+    """
+    Whether a file can be saved as filename, without creating it
+    """
+    if os.path.isdir(filename):
+        return False
+    if os.path.exists(filename):
+        return os.access(filename, os.W_OK)
+    return os.access(os.path.dirname(os.path.abspath(filename)), os.W_OK)
+
 
 class Common(object):
     """
@@ -11,33 +88,191 @@ class Common(object):
     """
 
     def __init__(self):
-        # Temporary directory to store pixel data and safe PDFs
-        cache_dir = appdirs.user_cache_dir("dangerzone")
-        os.makedirs(cache_dir, exist_ok=True)
-        self.pixel_dir = tempfile.TemporaryDirectory(
-            prefix=os.path.join(cache_dir, "pixel-")
-        )
-        self.safe_dir = tempfile.TemporaryDirectory(
-            prefix=os.path.join(cache_dir, "safe-")
-        )
-
-        try:
-            # Make the folders world-readable to ensure that the container has permission
-            # to access it even if it's owned by root or someone else
-            permissions = (
-                stat.S_IRUSR
-                | stat.S_IWUSR
-                | stat.S_IXUSR
-                | stat.S_IRGRP
-                | stat.S_IXGRP
-                | stat.S_IROTH
-                | stat.S_IXOTH
-            )
-            os.chmod(self.pixel_dir.name, permissions)
-            os.chmod(self.safe_dir.name, permissions)
-        except:
-            pass
+        # Temporary directories to store pixel data and safe PDFs. They're created
+        # the first time they're needed, when a conversion starts.
+        self._pixel_dir = None
+        self._safe_dir = None
 
         # Name of input and out files
         self.document_filename = None
         self.save_filename = None
+
+        # Number of pages in the document, once it's been converted to pixels
+        self.num_pages = None
+
+        # A guess at the number of pages that will be converted, from looking at the
+        # document before converting it, or None if it couldn't tell
+        self.estimated_pages = None
+
+        # Which pages to convert, from parse_page_range(), or None for every page
+        self.page_range = None
+
+        # ConversionProgress, once the conversion starts
+        self.progress = None
+
+        # Which track of the trace this document's conversion is recorded on
+        self.trace_track = None
+
+        # DocumentReport, if dangerzone-cli is reporting what happened
+        self.report = None
+
+        # The name of the container that's running a stage of the conversion right
+        # now, so it can be killed if the conversion is cancelled, and the
+        # dangerzone-container process (Popen) that's running it
+        self.running_container = None
+        self.running_process = None
+        self.cancelled = False
+
+        # If a stage of the conversion timed out, why
+        self.timeout_error = None
+
+        # Whether converting to pixels was stopped once it had converted all of the
+        # pages in the page range, because the container was converting every page
+        self.stopped_early = False
+
+        # The sha256 of the document, once it's been needed
+        self.sha256 = None
+
+        # The kind of document it is, from looking at it before starting the container
+        self.mime_type = None
+
+    @property
+    def pixel_dir(self):
+        if self._pixel_dir is None:
+            self._pixel_dir = new_scratch_dir("pixel")
+        return self._pixel_dir
+
+    def get_pixel_dir_name(self):
+        """
+        The path to the pixel data, or None if it was never created. Unlike pixel_dir,
+        this doesn't create it.
+        """
+        if self._pixel_dir is None:
+            return None
+        return self._pixel_dir.name
+
+    @property
+    def safe_dir(self):
+        if self._safe_dir is None:
+            self._safe_dir = new_scratch_dir("safe")
+        return self._safe_dir
+
+    def get_sha256(self):
+        if self.sha256 is None and self.document_filename:
+            self.sha256 = hash_file(self.document_filename)
+        return self.sha256
+
+    def estimate_pages(self):
+        """
+        Guess how many pages will be converted, once mime_type is known
+        """
+        self.estimated_pages = count_pages(self.document_filename, self.mime_type)
+        if self.estimated_pages and self.page_range:
+            self.estimated_pages = count_pages_before(
+                self.page_range, self.estimated_pages + 1
+            )
+        return self.estimated_pages
+
+    def save_safe_pdf(self, save_filename=None):
+        """
+        Move the safe PDF out of the safe dir, to save_filename (save_filename of the
+        document by default). It's moved to a temporary file next to it first, and
+        only renamed once it's all there, so a failure never leaves a partial PDF
+        behind. Raises OSError if it can't be saved.
+        """
+        if save_filename is None:
+            save_filename = self.save_filename
+        source_filename = os.path.join(self.safe_dir.name, "safe-output-compressed.pdf")
+
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=f".{os.path.basename(save_filename)}-",
+            suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(save_filename)),
+        )
+        os.close(fd)
+        try:
+            shutil.move(source_filename, tmp_filename)
+            os.replace(tmp_filename, save_filename)
+        except:
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
+            raise
+
+    def stop_past_page_range(self, global_common):
+        """
+        Container images that don't know about page ranges convert every page, so
+        once one has converted the last page in the range, kill it. Returns True if
+        it was killed.
+        """
+        if self.stopped_early or not (self.progress and self.progress.past_page_range):
+            return False
+        self.stopped_early = True
+        global_common.kill_container(self)
+        return True
+
+    def stage_succeeded(self, returncode):
+        """
+        Whether a stage that exited with returncode did what it needed to
+        """
+        if returncode == 0:
+            return True
+        return self.stopped_early and not self.cancelled and not self.timeout_error
+
+    def clear_stage_output(self, stage):
+        """
+        Delete what a stage that failed left in its output folder, so it can be run
+        again
+        """
+        scratch_dir = {
+            "documenttopixels": self._pixel_dir,
+            "pixelstopdf": self._safe_dir,
+        }.get(stage)
+        if scratch_dir is None:
+            return
+
+        for name in os.listdir(scratch_dir.name):
+            path = os.path.join(scratch_dir.name, name)
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def name_container(self):
+        """
+        Pick a new name for the container that runs the next stage of the conversion
+        """
+        self.running_container = f"dangerzone-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        return self.running_container
+
+    def cleanup(self, keep_pixel_dir=False):
+        """
+        Delete the scratch directories. If keep_pixel_dir is True, the pixel data is
+        left behind (so it can be looked at when a conversion fails), and it's up to
+        the janitor to delete it eventually.
+        """
+        scratch_dirs = [self._safe_dir]
+        if not keep_pixel_dir:
+            scratch_dirs.append(self._pixel_dir)
+
+        for scratch_dir in scratch_dirs:
+            if scratch_dir is None:
+                continue
+            try:
+                scratch_dir.cleanup()
+            except OSError:
+                # The janitor might have deleted it already
+                pass
+
+        with active_scratch_dirs_lock:
+            for scratch_dir in [self._pixel_dir, self._safe_dir]:
+                if scratch_dir is not None:
+                    active_scratch_dirs.discard(scratch_dir.name)
+
+        self._safe_dir = None
+        if not keep_pixel_dir:
+            self._pixel_dir = None
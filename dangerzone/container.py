@@ -6,36 +6,94 @@ import pipes
 import shutil
 import os
 import getpass
+import json
+import time
+import signal
+import threading
 
-# What is the container runtime for this platform?
-if platform.system() == "Darwin":
-    container_tech = "docker"
-    container_runtime = "/usr/local/bin/docker"
-elif platform.system() == "Windows":
-    container_tech = "docker"
-    container_runtime = shutil.which("docker.exe")
-elif platform.system() == "Linux":
-    container_tech = "podman"
-    container_runtime = shutil.which("podman")
-else:
-    print("Unknown operating system, defaulting to Docker")
-    container_tech = "docker"
-    container_runtime = shutil.which("docker")
-
-# Define startupinfo for subprocesses
-if platform.system() == "Windows":
-    startupinfo = subprocess.STARTUPINFO()
-    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-else:
-    startupinfo = None
+from .trace import trace_line_prefix
+
+# The container runtime and startupinfo are figured out the first time they're needed,
+# instead of at import time, so that commands that don't run a container (and the
+# broker, until it gets its first request) start as quickly as possible
+container_tech = None
+container_runtime = None
+startupinfo = None
+
+
+def get_container_runtime():
+    """
+    What is the container runtime for this platform? Returns a tuple like:
+    (container_tech (str), container_runtime (str))
+    """
+    global container_tech, container_runtime
+    if container_tech is None:
+        if os.environ.get("DANGERZONE_CONTAINER_RUNTIME"):
+            # Use a different runtime, like the stand-in that the benchmarks use
+            container_runtime = os.environ["DANGERZONE_CONTAINER_RUNTIME"]
+            if "docker" in os.path.basename(container_runtime):
+                container_tech = "docker"
+            else:
+                container_tech = "podman"
+        elif platform.system() == "Darwin":
+            container_tech = "docker"
+            container_runtime = "/usr/local/bin/docker"
+        elif platform.system() == "Windows":
+            container_tech = "docker"
+            container_runtime = shutil.which("docker.exe")
+        elif platform.system() == "Linux":
+            container_tech = "podman"
+            container_runtime = shutil.which("podman")
+        else:
+            # Not stdout, since in the broker that's where the messages go
+            print("Unknown operating system, defaulting to Docker", file=sys.stderr)
+            container_tech = "docker"
+            container_runtime = shutil.which("docker")
+
+    return container_tech, container_runtime
+
+
+def get_startupinfo():
+    # Define startupinfo for subprocesses
+    global startupinfo
+    if startupinfo is None and platform.system() == "Windows":
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+
+# When running as a broker, each request is handled in its own thread, and its output
+# is sent back to the host as messages instead of being written to stdout
+broker_local = threading.local()
+
+
+def print_line(line):
+    send = getattr(broker_local, "send", None)
+    if send:
+        send("stdout", line + "\n")
+    else:
+        print(line)
+        sys.stdout.flush()
+
+
+def trace(event, *args):
+    # If the host is tracing, tell it when this happened
+    if os.environ.get("DANGERZONE_TRACE"):
+        print_line(
+            " ".join(
+                [trace_line_prefix + event, f"{time.time():.6f}"]
+                + [str(arg) for arg in args]
+            )
+        )
 
 
 def exec_container(args):
-    args = [container_runtime] + args
+    _, runtime = get_container_runtime()
+    args = [runtime] + args
 
     args_str = " ".join(pipes.quote(s) for s in args)
-    print("> " + args_str)
-    sys.stdout.flush()
+    print_line("> " + args_str)
+    send = getattr(broker_local, "send", None)
 
     # In Tails, tell the container runtime to download over Tor
     if (
@@ -48,6 +106,33 @@ def exec_container(args):
     else:
         env = None
 
+    trace("container-start")
+    if send:
+        with subprocess.Popen(
+            args,
+            stdin=None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1,
+            universal_newlines=True,
+            startupinfo=get_startupinfo(),
+            env=env,
+        ) as p:
+            # Read stderr at the same time, so the container never blocks on writing
+            # to a full stderr pipe while this waits for stdout to end
+            stderr = []
+            stderr_thread = threading.Thread(
+                target=lambda: stderr.append(p.stderr.read()), daemon=True
+            )
+            stderr_thread.start()
+
+            for line in p.stdout:
+                send("stdout", line)
+            stderr_thread.join()
+            send("stderr", "".join(stderr))
+        trace("container-exit", p.returncode)
+        return p.returncode
+
     with subprocess.Popen(
         args,
         stdin=None,
@@ -55,11 +140,12 @@ def exec_container(args):
         stderr=sys.stderr,
         bufsize=1,
         universal_newlines=True,
-        startupinfo=startupinfo,
+        startupinfo=get_startupinfo(),
         env=env,
     ) as p:
         p.communicate()
-        return p.returncode
+    trace("container-exit", p.returncode)
+    return p.returncode
 
 
 @click.group()
@@ -78,22 +164,49 @@ def ls(container_name):
     sys.exit(exec_container(["image", "ls", container_name]))
 
 
+@container_main.command()
+@click.option("--container-name", default="docker.io/flmcode/dangerzone")
+def inspect(container_name):
+    """docker image inspect --format {{.Id}} [container_name]"""
+    sys.exit(
+        exec_container(["image", "inspect", "--format", "{{.Id}}", container_name])
+    )
+
+
 @container_main.command()
 def pull():
     """docker pull flmcode/dangerzone"""
     sys.exit(exec_container(["pull", "docker.io/flmcode/dangerzone"]))
 
 
+@container_main.command()
+@click.option("--name", required=True)
+def kill(name):
+    """docker kill [name]"""
+    sys.exit(exec_container(["kill", name]))
+
+
 @container_main.command()
 @click.option("--document-filename", required=True)
 @click.option("--pixel-dir", required=True)
 @click.option("--container-name", default="docker.io/flmcode/dangerzone")
-def documenttopixels(document_filename, pixel_dir, container_name):
-    """docker run --network none -v [document_filename]:/tmp/input_file -v [pixel_dir]:/dangerzone [container_name] document-to-pixels"""
-    args = ["run", "--network", "none"]
+@click.option("--name")  # Name the container, so it can be killed
+@click.option("--mime-type")  # The type the host detected, so the container can skip it
+@click.option("--pages")  # Only convert these pages, like "1-10,15"
+def documenttopixels(
+    document_filename, pixel_dir, container_name, name, mime_type, pages
+):
+    """docker run --rm --network none [--name name] [-e MIME_TYPE=mime_type] [-e PAGES=pages] -v [document_filename]:/tmp/input_file -v [pixel_dir]:/dangerzone [container_name] document-to-pixels"""
+    args = ["run", "--rm", "--network", "none"]
+    if name:
+        args += ["--name", name]
+    if mime_type:
+        args += ["-e", f"MIME_TYPE={mime_type}"]
+    if pages:
+        args += ["-e", f"PAGES={pages}"]
 
     # docker uses --security-opt, podman doesn't
-    if container_tech == "docker":
+    if get_container_runtime()[0] == "docker":
         args += ["--security-opt=no-new-privileges:true"]
 
     args += [
@@ -113,24 +226,90 @@ def documenttopixels(document_filename, pixel_dir, container_name):
 @click.option("--container-name", default="docker.io/flmcode/dangerzone")
 @click.option("--ocr", required=True)
 @click.option("--ocr-lang", required=True)
-def pixelstopdf(pixel_dir, safe_dir, container_name, ocr, ocr_lang):
-    """docker run --network none -v [pixel_dir]:/dangerzone -v [safe_dir]:/safezone [container_name] -e OCR=[ocr] -e OCR_LANGUAGE=[ocr_lang] pixels-to-pdf"""
-    sys.exit(
-        exec_container(
-            [
-                "run",
-                "--network",
-                "none",
-                "-v",
-                f"{pixel_dir}:/dangerzone",
-                "-v",
-                f"{safe_dir}:/safezone",
-                "-e",
-                f"OCR={ocr}",
-                "-e",
-                f"OCR_LANGUAGE={ocr_lang}",
-                container_name,
-                "pixels-to-pdf",
-            ]
+@click.option("--name")  # Name the container, so it can be killed
+def pixelstopdf(pixel_dir, safe_dir, container_name, ocr, ocr_lang, name):
+    """docker run --rm --network none [--name name] -v [pixel_dir]:/dangerzone -v [safe_dir]:/safezone [container_name] -e OCR=[ocr] -e OCR_LANGUAGE=[ocr_lang] pixels-to-pdf"""
+    args = ["run", "--rm", "--network", "none"]
+    if name:
+        args += ["--name", name]
+
+    args += [
+        "-v",
+        f"{pixel_dir}:/dangerzone",
+        "-v",
+        f"{safe_dir}:/safezone",
+        "-e",
+        f"OCR={ocr}",
+        "-e",
+        f"OCR_LANGUAGE={ocr_lang}",
+        container_name,
+        "pixels-to-pdf",
+    ]
+    sys.exit(exec_container(args))
+
+
+@container_main.command()
+def broker():
+    """Run commands sent over stdin, for the lifetime of one session"""
+    # The broker is started (and authorized) once, and then the host sends it one JSON
+    # request per line, like: {"id": 1, "args": ["documenttopixels", ...]}
+    #
+    # For each request it replies with any number of {"id": 1, "stdout": "..."} and
+    # {"id": 1, "stderr": "..."} messages, followed by {"id": 1, "returncode": 0}
+    write_lock = threading.Lock()
+
+    # Pressing Ctrl-C in a terminal interrupts the host too, and it cancels the
+    # conversions by sending kill requests, so the broker needs to stay up for them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def write_message(message):
+        with write_lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+    def handle_request(request_id, request_args):
+        def send(stream, data):
+            if data:
+                write_message({"id": request_id, stream: data})
+
+        broker_local.send = send
+        try:
+            if len(request_args) == 0 or request_args[0] == "broker":
+                raise click.UsageError("Invalid broker request")
+            container_main.main(
+                args=request_args,
+                prog_name="dangerzone-container",
+                standalone_mode=False,
+            )
+            returncode = 0
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except click.ClickException as e:
+            send("stderr", e.format_message() + "\n")
+            returncode = e.exit_code
+        except Exception as e:
+            send("stderr", f"{e}\n")
+            returncode = 1
+
+        write_message({"id": request_id, "returncode": returncode})
+
+    write_message({"ready": True})
+
+    threads = []
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+            request_id = request["id"]
+            request_args = [str(arg) for arg in request["args"]]
+        except (ValueError, KeyError, TypeError):
+            continue
+
+        t = threading.Thread(
+            target=handle_request, args=(request_id, request_args), daemon=True
         )
-    )
+        t.start()
+        threads = [t for t in threads if t.is_alive()] + [t]
+
+    # The host closed stdin, so finish the requests that are still running
+    for t in threads:
+        t.join()
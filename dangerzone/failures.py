@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+import appdirs
+
+from .log import logger
+from .page_range import format_page_range
+
+# Failures that might not happen again if the stage is run again, like the machine
+# being short on memory or disk space, or the container runtime being busy
+transient_failures = ["out_of_memory", "out_of_disk", "runtime_busy"]
+
+# Failures that will happen every time with the same document, so they're remembered:
+# documents the container can't open, and ones with a page count or page sizes it
+# won't convert. Other invalid output isn't one of them, since it can be caused by a
+# crash or a bug that converting the document again might not hit.
+permanent_failures = ["unsupported_format", "invalid_geometry"]
+
+# What the container runtime says when it can't run a container right now
+runtime_busy_re = re.compile(
+    r"cannot connect to the docker daemon"
+    r"|is the docker daemon running"
+    r"|error during connect"
+    r"|database is locked"
+    r"|resource temporarily unavailable"
+    r"|too many open files",
+    re.IGNORECASE,
+)
+
+
+def classify_container_failure(returncode, output, stderr):
+    """
+    Why a dangerzone-container command failed, from its return code and output
+    """
+    if returncode == 126 or returncode == 127:
+        return "authorization"
+
+    # The container was killed by SIGKILL, which is what the kernel's OOM killer sends
+    if returncode == 137 or returncode == -9:
+        return "out_of_memory"
+
+    text = f"{output}\n{stderr}"
+    if "No space left on device" in text:
+        return "out_of_disk"
+    if runtime_busy_re.search(text):
+        return "runtime_busy"
+    if "The document format is not supported" in text:
+        return "unsupported_format"
+    return "container_error"
+
+
+def classify_invalid_output(error_message):
+    """
+    Why the pixels that documenttopixels returned didn't pass validation
+    """
+    if "No space left on device" in error_message:
+        return "out_of_disk"
+    if "The document format is not supported" in error_message:
+        return "unsupported_format"
+    if error_message == "Invalid number of pages returned":
+        return "invalid_geometry"
+    if error_message.endswith("has invalid geometry"):
+        return "invalid_geometry"
+    if "None of the requested pages" in error_message:
+        # Converting a different page range might work, so it's not remembered
+        return "page_range"
+    return "invalid_output"
+
+
+def get_retry_delay(settings, failure_reason, attempt):
+    """
+    How many seconds to wait before running a stage again, after it failed for
+    failure_reason attempt + 1 times, or None if it shouldn't be retried
+    """
+    if failure_reason not in transient_failures:
+        return None
+    if attempt >= settings.get("retries"):
+        return None
+    return settings.get("retry_backoff") * 2 ** attempt
+
+
+def wait_to_retry(common, seconds):
+    """
+    Wait before retrying a stage. Returns False if the conversion was cancelled in the
+    meantime.
+    """
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if common and common.cancelled:
+            return False
+        time.sleep(min(0.1, max(0, deadline - time.monotonic())))
+    return not (common and common.cancelled)
+
+
+class FailureCache(object):
+    """
+    The documents that failed to convert for a reason that will happen every time, by
+    sha256, container image and page range, stored in the cache folder. When one of
+    them is converted again the same way, it fails right away instead of running the
+    container.
+    """
+
+    # Forget failures after this many seconds, in case the container image was updated
+    # and can convert the document now
+    max_age = 7 * 24 * 60 * 60
+
+    # Keep at most this many
+    max_entries = 1000
+
+    def __init__(self, global_common):
+        self.global_common = global_common
+        self.cache_dir = appdirs.user_cache_dir("dangerzone")
+        self.filename = os.path.join(self.cache_dir, "failures.json")
+        self.lock = threading.Lock()
+        self.failures = None
+        self.image = None
+
+    def load(self):
+        try:
+            with open(self.filename) as f:
+                self.failures = json.load(f)
+            if not isinstance(self.failures, dict):
+                self.failures = {}
+        except (OSError, ValueError):
+            self.failures = {}
+
+        now = time.time()
+        for key in list(self.failures):
+            entry = self.failures[key]
+            if not isinstance(entry, dict) or now - entry.get("time", 0) > self.max_age:
+                del self.failures[key]
+
+    def save(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_filename = tempfile.mkstemp(
+                prefix="failures-", suffix=".json.tmp", dir=self.cache_dir
+            )
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.failures, f, indent=4)
+            os.replace(tmp_filename, self.filename)
+        except OSError:
+            pass
+
+    def enabled(self):
+        return self.global_common.settings.get("remember_failures")
+
+    def get_key(self, common):
+        """
+        The key that common's document is remembered by, or None if it can't be read.
+        A different container image might be able to convert it, and a different page
+        range might not include the pages it failed on, so they're part of the key.
+        """
+        sha256 = common.get_sha256()
+        if not sha256:
+            return None
+
+        # Looking up the image id runs a command, so only do it once
+        if self.image is None:
+            self.image = (
+                self.global_common.get_container_image_id()
+                or self.global_common.get_container_name()
+            )
+
+        if common.page_range:
+            pages = format_page_range(common.page_range)
+        else:
+            pages = "all"
+        return f"{sha256}:{self.image}:{pages}"
+
+    def get(self, common):
+        """
+        If common's document failed permanently before, returns a dict like:
+        {"reason": str, "error": str or None, "time": float}. Otherwise None.
+        """
+        if not self.enabled():
+            return None
+
+        key = self.get_key(common)
+        with self.lock:
+            if self.failures is None:
+                self.load()
+            entry = self.failures.get(key) if key else None
+
+        if entry:
+            self.global_common.metrics.cache_hits.inc(cache="failures")
+        else:
+            self.global_common.metrics.cache_misses.inc(cache="failures")
+        return entry
+
+    def add(self, common, failure_reason, error=None):
+        """
+        Remember that common's document failed, if it's a failure that will happen
+        every time
+        """
+        if failure_reason not in permanent_failures or not self.enabled():
+            return
+
+        # If the format check rejected it, it never got to the container. Checking
+        # again is cheaper than looking it up, which hashes it and inspects the image.
+        if common.mime_type is None:
+            return
+
+        key = self.get_key(common)
+        if not key:
+            return
+
+        logger.info(f"Remembering that {common.document_filename} can't be converted")
+        with self.lock:
+            # Another process might have added some since this one loaded them
+            self.load()
+
+            # If it's failing again because it's known to fail, keep the original error
+            if error is None and key in self.failures:
+                error = self.failures[key].get("error")
+
+            self.failures[key] = {
+                "reason": failure_reason,
+                "error": error,
+                "time": time.time(),
+            }
+
+            if len(self.failures) > self.max_entries:
+                oldest = sorted(self.failures, key=lambda k: self.failures[k]["time"])
+                for key in oldest[: len(self.failures) - self.max_entries]:
+                    del self.failures[key]
+
+            self.save()
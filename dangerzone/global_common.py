@@ -1,14 +1,22 @@
 import sys
 import os
+import re
+import time
 import inspect
 import appdirs
 import platform
 import subprocess
+import threading
 import pipes
 import colorama
 from colorama import Fore, Back, Style
 
-from .settings import Settings
+from .trace import Tracer
+from .metrics import Metrics
+from .log import logger
+
+# The files that the convert to pixels stage writes for each page
+page_filename_re = re.compile(r"^page-(\d+)\.(?:rgb|width|height)$")
 
 
 class GlobalCommon(object):
@@ -38,172 +46,59 @@ class GlobalCommon(object):
         # dangerzone-container path
         self.dz_container_path = self.get_dangerzone_container_path()
 
-        # Languages supported by tesseract
-        self.ocr_languages = {
-            "Afrikaans": "ar",
-            "Albanian": "sqi",
-            "Amharic": "amh",
-            "Arabic": "ara",
-            "Arabic script": "Arabic",
-            "Armenian": "hye",
-            "Armenian script": "Armenian",
-            "Assamese": "asm",
-            "Azerbaijani": "aze",
-            "Azerbaijani (Cyrillic)": "aze_cyrl",
-            "Basque": "eus",
-            "Belarusian": "bel",
-            "Bengali": "ben",
-            "Bengali script": "Bengali",
-            "Bosnian": "bos",
-            "Breton": "bre",
-            "Bulgarian": "bul",
-            "Burmese": "mya",
-            "Canadian Aboriginal script": "Canadian_Aboriginal",
-            "Catalan": "cat",
-            "Cebuano": "ceb",
-            "Cherokee": "chr",
-            "Cherokee script": "Cherokee",
-            "Chinese - Simplified": "chi_sim",
-            "Chinese - Simplified (vertical)": "chi_sim_vert",
-            "Chinese - Traditional": "chi_tra",
-            "Chinese - Traditional (vertical)": "chi_tra_vert",
-            "Corsican": "cos",
-            "Croatian": "hrv",
-            "Cyrillic script": "Cyrillic",
-            "Czech": "ces",
-            "Danish": "dan",
-            "Devanagari script": "Devanagari",
-            "Divehi": "div",
-            "Dutch": "nld",
-            "Dzongkha": "dzo",
-            "English": "eng",
-            "English, Middle (1100-1500)": "enm",
-            "Esperanto": "epo",
-            "Estonian": "est",
-            "Ethiopic script": "Ethiopic",
-            "Faroese": "fao",
-            "Filipino": "fil",
-            "Finnish": "fin",
-            "Fraktur script": "Fraktur",
-            "Frankish": "frk",
-            "French": "fra",
-            "French, Middle (ca.1400-1600)": "frm",
-            "Frisian (Western)": "fry",
-            "Gaelic (Scots)": "gla",
-            "Galician": "glg",
-            "Georgian": "kat",
-            "Georgian script": "Georgian",
-            "German": "deu",
-            "Greek": "ell",
-            "Greek script": "Greek",
-            "Gujarati": "guj",
-            "Gujarati script": "Gujarati",
-            "Gurmukhi script": "Gurmukhi",
-            "Hangul script": "Hangul",
-            "Hangul (vertical) script": "Hangul_vert",
-            "Han - Simplified script": "HanS",
-            "Han - Simplified (vertical) script": "HanS_vert",
-            "Han - Traditional script": "HanT",
-            "Han - Traditional (vertical) script": "HanT_vert",
-            "Hatian": "hat",
-            "Hebrew": "heb",
-            "Hebrew script": "Hebrew",
-            "Hindi": "hin",
-            "Hungarian": "hun",
-            "Icelandic": "isl",
-            "Indonesian": "ind",
-            "Inuktitut": "iku",
-            "Irish": "gle",
-            "Italian": "ita",
-            "Italian - Old": "ita_old",
-            "Japanese": "jpn",
-            "Japanese script": "Japanese",
-            "Japanese (vertical)": "jpn_vert",
-            "Japanese (vertical) script": "Japanese_vert",
-            "Javanese": "jav",
-            "Kannada": "kan",
-            "Kannada script": "Kannada",
-            "Kazakh": "kaz",
-            "Khmer": "khm",
-            "Khmer script": "Khmer",
-            "Korean": "kor",
-            "Korean (vertical)": "kor_vert",
-            "Kurdish (Arabic)": "kur_ara",
-            "Kyrgyz": "kir",
-            "Lao": "lao",
-            "Lao script": "Lao",
-            "Latin": "lat",
-            "Latin script": "Latin",
-            "Latvian": "lav",
-            "Lithuanian": "lit",
-            "Luxembourgish": "ltz",
-            "Macedonian": "mkd",
-            "Malayalam": "mal",
-            "Malayalam script": "Malayalam",
-            "Malay": "msa",
-            "Maltese": "mlt",
-            "Maori": "mri",
-            "Marathi": "mar",
-            "Mongolian": "mon",
-            "Myanmar script": "Myanmar",
-            "Nepali": "nep",
-            "Norwegian": "nor",
-            "Occitan (post 1500)": "oci",
-            "Old Georgian": "kat_old",
-            "Oriya (Odia) script": "Oriya",
-            "Oriya": "ori",
-            "Pashto": "pus",
-            "Persian": "fas",
-            "Polish": "pol",
-            "Portuguese": "por",
-            "Punjabi": "pan",
-            "Quechua": "que",
-            "Romanian": "ron",
-            "Russian": "rus",
-            "Sanskrit": "san",
-            "script and orientation": "osd",
-            "Serbian (Latin)": "srp_latn",
-            "Serbian": "srp",
-            "Sindhi": "snd",
-            "Sinhala script": "Sinhala",
-            "Sinhala": "sin",
-            "Slovakian": "slk",
-            "Slovenian": "slv",
-            "Spanish, Castilian - Old": "spa_old",
-            "Spanish": "spa",
-            "Sundanese": "sun",
-            "Swahili": "swa",
-            "Swedish": "swe",
-            "Syriac script": "Syriac",
-            "Syriac": "syr",
-            "Tajik": "tgk",
-            "Tamil script": "Tamil",
-            "Tamil": "tam",
-            "Tatar": "tat",
-            "Telugu script": "Telugu",
-            "Telugu": "tel",
-            "Thaana script": "Thaana",
-            "Thai script": "Thai",
-            "Thai": "tha",
-            "Tibetan script": "Tibetan",
-            "Tibetan Standard": "bod",
-            "Tigrinya": "tir",
-            "Tonga": "ton",
-            "Turkish": "tur",
-            "Ukrainian": "ukr",
-            "Urdu": "urd",
-            "Uyghur": "uig",
-            "Uzbek (Cyrillic)": "uzb_cyrl",
-            "Uzbek": "uzb",
-            "Vietnamese script": "Vietnamese",
-            "Vietnamese": "vie",
-            "Welsh": "cym",
-            "Yiddish": "yid",
-            "Yoruba": "yor",
-        }
-
-        # Load settings
-        self.settings = Settings(self)
+        # Long-lived dangerzone-container broker, if one is running
+        self.broker = None
+
+        # How many times to try killing the container of a cancelled or timed out
+        # conversion
+        self.cancel_attempts = 5
+
+        # Records how long things take, if tracing is enabled
+        self.tracer = Tracer()
+
+        # Counters and histograms, for long-running deployments
+        self.metrics = Metrics()
+
+        # Languages supported by tesseract, settings, the throughput history and the
+        # documents that can't be converted are loaded the first time they're used
+        self._ocr_languages = None
+        self._settings = None
+        self._throughput = None
+        self._failure_cache = None
+        self._failure_cache_lock = threading.Lock()
+
+    @property
+    def ocr_languages(self):
+        if self._ocr_languages is None:
+            self._ocr_languages = get_ocr_languages()
+        return self._ocr_languages
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            from .settings import Settings
+
+            self._settings = Settings(self)
+        return self._settings
+
+    @property
+    def throughput(self):
+        if self._throughput is None:
+            from .progress import ThroughputHistory
+
+            self._throughput = ThroughputHistory(self.appdata_path)
+        return self._throughput
+
+    @property
+    def failure_cache(self):
+        # Documents that can't be converted, so they fail right away next time. GUI
+        # conversions run in several threads, so only one of them creates it.
+        with self._failure_cache_lock:
+            if self._failure_cache is None:
+                from .failures import FailureCache
+
+                self._failure_cache = FailureCache(self)
+        return self._failure_cache
 
     def display_banner(self):
         """
@@ -438,10 +333,41 @@ class GlobalCommon(object):
             else:
                 return "/usr/bin/dangerzone-container"
 
+    def start_broker(self):
+        """
+        Start a dangerzone-container broker, so that the rest of the container commands
+        in this session don't each need to be authorized and started separately. Returns
+        a tuple like: (success (boolean), error_message (str))
+        """
+        if self.broker and self.broker.is_running():
+            return True, True
+
+        args_str = " ".join(pipes.quote(s) for s in [self.dz_container_path, "broker"])
+        logger.info("> " + args_str)
+
+        from .broker import ContainerBroker
+
+        self.broker = ContainerBroker(self)
+        success, error_message = self.broker.start()
+        if not success:
+            self.broker = None
+        return success, error_message
+
+    def stop_broker(self):
+        if self.broker:
+            self.broker.stop()
+            self.broker = None
+
     def exec_dangerzone_container(self, args):
+        # If there's a broker, send the command to it instead of starting a new process
+        if self.broker and self.broker.is_running():
+            args_str = " ".join(pipes.quote(s) for s in args)
+            logger.info("> [broker] " + args_str)
+            return self.broker.exec(args)
+
         args = [self.dz_container_path] + args
         args_str = " ".join(pipes.quote(s) for s in args)
-        print(Style.DIM + "> " + Style.NORMAL + Fore.CYAN + args_str)
+        logger.info("> " + args_str)
 
         # Execute dangerzone-container
         return subprocess.Popen(
@@ -459,6 +385,72 @@ class GlobalCommon(object):
         else:
             return None
 
+    def cancel_conversion(self, common):
+        """
+        Cancel the conversion of a document: none of its stages start after this, and
+        the container running the current one is killed, so it stops right away
+        """
+        common.cancelled = True
+        if common.running_container:
+            logger.info(f"Cancelling the conversion of {common.document_filename}")
+            self.kill_container(common)
+
+    def kill_container(self, common):
+        """
+        Kill the container that's running a stage of common's conversion, if there is
+        one
+        """
+        name = common.running_container
+        if not name:
+            return
+
+        for _ in range(self.cancel_attempts):
+            with self.exec_dangerzone_container(["kill", "--name", name]) as p:
+                p.communicate()
+
+            # If it didn't work, the container might not have been created yet
+            if p.returncode == 0 or common.running_container != name:
+                return
+            time.sleep(0.5)
+
+        logger.warning(f"Couldn't kill container {name}")
+
+        # At least stop waiting for it, by stopping the dangerzone-container process
+        # that's running it
+        p = common.running_process
+        if p is None or p.poll() is not None:
+            return
+        p.terminate()
+        for _ in range(10):
+            if p.poll() is not None:
+                return
+            time.sleep(0.2)
+        p.kill()
+
+    def get_failure_reason(self, returncode, common=None, output="", stderr=""):
+        """
+        Why a dangerzone-container command failed, for metrics, reports and deciding
+        whether to retry it
+        """
+        if common and common.cancelled:
+            return "cancelled"
+        if common and common.timeout_error:
+            return "timeout"
+
+        from .failures import classify_container_failure
+
+        return classify_container_failure(returncode, output, stderr)
+
+    def conversion_failed(self, common, failure_reason, error=None, remember=True):
+        """
+        Count a failed conversion, and remember the document if it will fail every
+        time. Remembering it hashes the document, so the GUI does that in the job's
+        thread instead, and passes remember=False.
+        """
+        self.metrics.document_failed(failure_reason)
+        if remember:
+            self.failure_cache.add(common, failure_reason, error)
+
     def container_exists(self, container_name):
         """
         Check if container_name is a valid container. Returns a tuple like:
@@ -487,11 +479,36 @@ class GlobalCommon(object):
 
         return True, True
 
+    def get_container_image_id(self):
+        """
+        Get the id (sha256 digest) of the container image that conversions use, or None
+        if it can't be found
+        """
+        with self.exec_dangerzone_container(
+            ["inspect", "--container-name", self.get_container_name()]
+        ) as p:
+            stdout_data, _ = p.communicate()
+            if p.returncode != 0:
+                return None
+
+            for line in stdout_data.decode().split("\n"):
+                line = line.strip()
+                if line.startswith("sha256:"):
+                    return line
+
+        return None
+
     def validate_convert_to_pixel_output(self, common, output):
         """
-        Take the output from the convert to pixels tasks and validate it. Returns
-        a tuple like: (success (boolean), error_message (str))
+        Take the output from the convert to pixels tasks and validate it. If only some
+        pages were converted, they're renumbered starting at 1, so converting them to a
+        PDF works the same as for a whole document. Returns a tuple like:
+        (success (boolean), error_message (str))
         """
+        with self.tracer.span("validate_convert_to_pixel_output", common.trace_track):
+            return self._validate_convert_to_pixel_output(common, output)
+
+    def _validate_convert_to_pixel_output(self, common, output):
         max_image_width = 10000
         max_image_height = 10000
 
@@ -514,16 +531,40 @@ class GlobalCommon(object):
             return False, "Invalid number of pages returned"
         num_pages = int(num_pages)
 
-        # Make sure we have the files we expect
+        # Which pages we asked for
+        from .page_range import select_pages
+
+        pages = select_pages(common.page_range, num_pages)
+        if not pages:
+            return (
+                False,
+                f"None of the requested pages are in the document, it has {num_pages} pages",
+            )
+        common.num_pages = len(pages)
+
+        # Container images that don't know about page ranges convert every page, so
+        # delete the ones that weren't asked for
+        actual_filenames = os.listdir(common.pixel_dir.name)
+        if common.page_range:
+            wanted = set(pages)
+            for filename in actual_filenames:
+                m = page_filename_re.match(filename)
+                if not m:
+                    continue
+                i = int(m.group(1))
+                if i <= num_pages and i not in wanted:
+                    os.remove(os.path.join(common.pixel_dir.name, filename))
+            actual_filenames = os.listdir(common.pixel_dir.name)
+
+        # Make sure we have exactly the files we expect
         expected_filenames = []
-        for i in range(1, num_pages + 1):
+        for i in pages:
             expected_filenames += [
                 f"page-{i}.rgb",
                 f"page-{i}.width",
                 f"page-{i}.height",
             ]
         expected_filenames.sort()
-        actual_filenames = os.listdir(common.pixel_dir.name)
         actual_filenames.sort()
 
         if expected_filenames != actual_filenames:
@@ -533,7 +574,7 @@ class GlobalCommon(object):
             )
 
         # Make sure the files are the correct sizes
-        for i in range(1, num_pages + 1):
+        for i in pages:
             with open(f"{common.pixel_dir.name}/page-{i}.width") as f:
                 w_str = f.read().strip()
             with open(f"{common.pixel_dir.name}/page-{i}.height") as f:
@@ -554,4 +595,183 @@ class GlobalCommon(object):
             if os.path.getsize(f"{common.pixel_dir.name}/page-{i}.rgb") != w * h * 3:
                 return False, f"Page {i} has an invalid RGB file size"
 
+        # Renumber the pages. They're in order, so each one is moved to a number
+        # that's already free.
+        for new_i, i in enumerate(pages, 1):
+            if new_i == i:
+                continue
+            for ext in ["rgb", "width", "height"]:
+                os.rename(
+                    f"{common.pixel_dir.name}/page-{i}.{ext}",
+                    f"{common.pixel_dir.name}/page-{new_i}.{ext}",
+                )
+
         return True, True
+
+
+def get_ocr_languages():
+    """
+    Languages supported by tesseract
+    """
+    return {
+        "Afrikaans": "ar",
+        "Albanian": "sqi",
+        "Amharic": "amh",
+        "Arabic": "ara",
+        "Arabic script": "Arabic",
+        "Armenian": "hye",
+        "Armenian script": "Armenian",
+        "Assamese": "asm",
+        "Azerbaijani": "aze",
+        "Azerbaijani (Cyrillic)": "aze_cyrl",
+        "Basque": "eus",
+        "Belarusian": "bel",
+        "Bengali": "ben",
+        "Bengali script": "Bengali",
+        "Bosnian": "bos",
+        "Breton": "bre",
+        "Bulgarian": "bul",
+        "Burmese": "mya",
+        "Canadian Aboriginal script": "Canadian_Aboriginal",
+        "Catalan": "cat",
+        "Cebuano": "ceb",
+        "Cherokee": "chr",
+        "Cherokee script": "Cherokee",
+        "Chinese - Simplified": "chi_sim",
+        "Chinese - Simplified (vertical)": "chi_sim_vert",
+        "Chinese - Traditional": "chi_tra",
+        "Chinese - Traditional (vertical)": "chi_tra_vert",
+        "Corsican": "cos",
+        "Croatian": "hrv",
+        "Cyrillic script": "Cyrillic",
+        "Czech": "ces",
+        "Danish": "dan",
+        "Devanagari script": "Devanagari",
+        "Divehi": "div",
+        "Dutch": "nld",
+        "Dzongkha": "dzo",
+        "English": "eng",
+        "English, Middle (1100-1500)": "enm",
+        "Esperanto": "epo",
+        "Estonian": "est",
+        "Ethiopic script": "Ethiopic",
+        "Faroese": "fao",
+        "Filipino": "fil",
+        "Finnish": "fin",
+        "Fraktur script": "Fraktur",
+        "Frankish": "frk",
+        "French": "fra",
+        "French, Middle (ca.1400-1600)": "frm",
+        "Frisian (Western)": "fry",
+        "Gaelic (Scots)": "gla",
+        "Galician": "glg",
+        "Georgian": "kat",
+        "Georgian script": "Georgian",
+        "German": "deu",
+        "Greek": "ell",
+        "Greek script": "Greek",
+        "Gujarati": "guj",
+        "Gujarati script": "Gujarati",
+        "Gurmukhi script": "Gurmukhi",
+        "Hangul script": "Hangul",
+        "Hangul (vertical) script": "Hangul_vert",
+        "Han - Simplified script": "HanS",
+        "Han - Simplified (vertical) script": "HanS_vert",
+        "Han - Traditional script": "HanT",
+        "Han - Traditional (vertical) script": "HanT_vert",
+        "Hatian": "hat",
+        "Hebrew": "heb",
+        "Hebrew script": "Hebrew",
+        "Hindi": "hin",
+        "Hungarian": "hun",
+        "Icelandic": "isl",
+        "Indonesian": "ind",
+        "Inuktitut": "iku",
+        "Irish": "gle",
+        "Italian": "ita",
+        "Italian - Old": "ita_old",
+        "Japanese": "jpn",
+        "Japanese script": "Japanese",
+        "Japanese (vertical)": "jpn_vert",
+        "Japanese (vertical) script": "Japanese_vert",
+        "Javanese": "jav",
+        "Kannada": "kan",
+        "Kannada script": "Kannada",
+        "Kazakh": "kaz",
+        "Khmer": "khm",
+        "Khmer script": "Khmer",
+        "Korean": "kor",
+        "Korean (vertical)": "kor_vert",
+        "Kurdish (Arabic)": "kur_ara",
+        "Kyrgyz": "kir",
+        "Lao": "lao",
+        "Lao script": "Lao",
+        "Latin": "lat",
+        "Latin script": "Latin",
+        "Latvian": "lav",
+        "Lithuanian": "lit",
+        "Luxembourgish": "ltz",
+        "Macedonian": "mkd",
+        "Malayalam": "mal",
+        "Malayalam script": "Malayalam",
+        "Malay": "msa",
+        "Maltese": "mlt",
+        "Maori": "mri",
+        "Marathi": "mar",
+        "Mongolian": "mon",
+        "Myanmar script": "Myanmar",
+        "Nepali": "nep",
+        "Norwegian": "nor",
+        "Occitan (post 1500)": "oci",
+        "Old Georgian": "kat_old",
+        "Oriya (Odia) script": "Oriya",
+        "Oriya": "ori",
+        "Pashto": "pus",
+        "Persian": "fas",
+        "Polish": "pol",
+        "Portuguese": "por",
+        "Punjabi": "pan",
+        "Quechua": "que",
+        "Romanian": "ron",
+        "Russian": "rus",
+        "Sanskrit": "san",
+        "script and orientation": "osd",
+        "Serbian (Latin)": "srp_latn",
+        "Serbian": "srp",
+        "Sindhi": "snd",
+        "Sinhala script": "Sinhala",
+        "Sinhala": "sin",
+        "Slovakian": "slk",
+        "Slovenian": "slv",
+        "Spanish, Castilian - Old": "spa_old",
+        "Spanish": "spa",
+        "Sundanese": "sun",
+        "Swahili": "swa",
+        "Swedish": "swe",
+        "Syriac script": "Syriac",
+        "Syriac": "syr",
+        "Tajik": "tgk",
+        "Tamil script": "Tamil",
+        "Tamil": "tam",
+        "Tatar": "tat",
+        "Telugu script": "Telugu",
+        "Telugu": "tel",
+        "Thaana script": "Thaana",
+        "Thai script": "Thai",
+        "Thai": "tha",
+        "Tibetan script": "Tibetan",
+        "Tibetan Standard": "bod",
+        "Tigrinya": "tir",
+        "Tonga": "ton",
+        "Turkish": "tur",
+        "Ukrainian": "ukr",
+        "Urdu": "urd",
+        "Uyghur": "uig",
+        "Uzbek (Cyrillic)": "uzb_cyrl",
+        "Uzbek": "uzb",
+        "Vietnamese script": "Vietnamese",
+        "Vietnamese": "vie",
+        "Welsh": "cym",
+        "Yiddish": "yid",
+        "Yoruba": "yor",
+    }
@@ -8,13 +8,15 @@ from PySide2 import QtCore, QtWidgets
 
 from .common import GuiCommon
 from .main_window import MainWindow
+from .single_instance import send_to_running_instance, InstanceServer
 from .docker_installer import (
     is_docker_installed,
-    is_docker_ready,
+    DockerReadyChecker,
     DockerInstaller,
     AuthorizationFailed,
 )
 from ..global_common import GlobalCommon
+from ..log import setup_logging
 
 
 # For some reason, Dangerzone segfaults if I inherit from QApplication directly, so instead
@@ -46,38 +48,72 @@ class ApplicationWrapper(QtCore.QObject):
 
 @click.command()
 @click.option("--custom-container")  # Use this container instead of flmcode/dangerzone
-@click.argument("filename", required=False)
-def gui_main(custom_container, filename):
+@click.option("--trace", "trace_filename")  # Save a Chrome trace to this file on quit
+@click.option("--metrics-port", type=int)  # Serve Prometheus metrics on this port
+@click.option("--metrics-file")  # Save JSON snapshots of metrics to this file
+@click.option("--metrics-interval", type=int, default=10)
+@click.option(
+    "--log-level",
+    type=click.Choice(["DEBUG", "INFO", "WARNING", "ERROR"], case_sensitive=False),
+    default="INFO",
+)
+@click.option("--log-file", is_flag=True)  # Also log to a file in the app data folder
+@click.option("--quiet", is_flag=True)  # Don't log the output of the container
+@click.option("--new-instance", is_flag=True)  # Don't hand documents to a running one
+@click.argument("filenames", required=False, nargs=-1)
+def gui_main(
+    custom_container,
+    trace_filename,
+    metrics_port,
+    metrics_file,
+    metrics_interval,
+    log_level,
+    log_file,
+    quiet,
+    new_instance,
+    filenames,
+):
+    # If dangerzone is already running, let it open the documents, which is a lot
+    # faster than starting up. Options that change how dangerzone runs need a new
+    # instance though.
+    if (
+        not new_instance
+        and not custom_container
+        and not trace_filename
+        and not metrics_port
+        and not metrics_file
+        and send_to_running_instance(filenames)
+    ):
+        return
+
     if platform.system() == "Darwin":
         # Required for macOS Big Sur: https://stackoverflow.com/a/64878899
         os.environ["QT_MAC_WANTS_LAYER"] = "1"
 
-        # Strip ANSI colors from stdout output, to prevent terminal colors from breaking
-        # the macOS GUI app
-        from strip_ansi import strip_ansi
-
-        class StdoutFilter:
-            def __init__(self, stream):
-                self.stream = stream
-
-            def __getattr__(self, attr_name):
-                return getattr(self.stream, attr_name)
-
-            def write(self, data):
-                self.stream.write(strip_ansi(data))
-
-            def flush(self):
-                self.stream.flush()
-
-        sys.stdout = StdoutFilter(sys.stdout)
-        sys.stderr = StdoutFilter(sys.stderr)
-
     # Create the Qt app
     app_wrapper = ApplicationWrapper()
     app = app_wrapper.app
 
+    # Listen for new launches right away, so they don't start an instance of their own
+    # while this one is starting up. Documents they hand over are opened once the
+    # event loop is running.
+    instance_server = None
+    if not new_instance:
+        instance_server = InstanceServer()
+        instance_server.listen()
+
     # Common objects
     global_common = GlobalCommon()
+
+    # Colors are only used if stdout is a terminal, so they don't break the macOS app
+    setup_logging(global_common.appdata_path, log_level.upper(), log_file, quiet)
+
+    if trace_filename:
+        global_common.tracer.enable()
+    if metrics_port:
+        global_common.metrics.serve(metrics_port)
+    if metrics_file:
+        global_common.metrics.start_snapshots(metrics_file, metrics_interval)
     gui_common = GuiCommon(app, global_common)
 
     if custom_container:
@@ -88,61 +124,128 @@ def gui_main(custom_container, filename):
 
         global_common.custom_container = custom_container
 
-    # Allow Ctrl-C to smoothly quit the program instead of throwing an exception
-    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Start the broker, so the container commands for every window only need to be
+    # authorized once
+    success, error_message = global_common.start_broker()
+    if not success:
+        click.echo(error_message)
+
+    # Allow Ctrl-C to smoothly quit the program instead of throwing an exception. The
+    # conversions that are still running get cancelled on the way out.
+    signal.signal(signal.SIGINT, lambda signum, frame: app.quit())
+
+    # Python only handles signals when it gets to run, so let it run every so often
+    signal_timer = QtCore.QTimer()
+    signal_timer.timeout.connect(lambda: None)
+    signal_timer.start(500)
 
     # See if we need to install Docker...
-    if (platform.system() == "Darwin" or platform.system() == "Windows") and (
-        not is_docker_installed() or not is_docker_ready(global_common)
-    ):
-        click.echo("Docker is either not installed or not running")
+    if (
+        platform.system() == "Darwin" or platform.system() == "Windows"
+    ) and not is_docker_installed():
+        click.echo("Docker is not installed")
         docker_installer = DockerInstaller(gui_common)
         docker_installer.start()
         return
 
-    closed_windows = {}
     windows = {}
 
+    # Windows that have been closed, until Qt deletes them
+    closing_windows = {}
+
+    # A closed window is kept, reset, to open the next one faster. Any others are
+    # deleted, so closing windows doesn't keep using more memory.
+    spare_windows = []
+
     def delete_window(window_id):
-        closed_windows[window_id] = windows[window_id]
-        del windows[window_id]
+        window = windows.pop(window_id)
+        if not spare_windows and not window.is_converting():
+            window.reset()
+            spare_windows.append(window)
+        else:
+            closing_windows[window_id] = window
+            window.destroyed.connect(lambda: closing_windows.pop(window_id, None))
+            window.teardown()
+
+        # Documents from later launches are opened in new windows of this instance, so
+        # only quit once the last window is closed. In macOS, dangerzone keeps running
+        # without any windows.
+        if not windows and platform.system() != "Darwin":
+            app.quit()
 
     # Open a document in a window
     def select_document(filename=None):
+        if filename:
+            return select_documents([filename])
+        return select_documents([])
+
+    # Open documents in a window. If there's more than one, they're opened as a queue.
+    def select_documents(filenames):
+        # Validate filenames
+        valid_filenames = []
+        for filename in filenames:
+            filename = os.path.abspath(os.path.expanduser(filename))
+            try:
+                open(filename, "rb")
+            except FileNotFoundError:
+                click.echo(f"File not found: {filename}")
+                return False
+            except PermissionError:
+                click.echo(f"Permission denied: {filename}")
+                return False
+            valid_filenames.append(filename)
+
         if (
             len(windows) == 1
             and windows[list(windows.keys())[0]].common.document_filename == None
+            and not windows[list(windows.keys())[0]].queue_mode
         ):
             window = windows[list(windows.keys())[0]]
+        elif spare_windows:
+            window = spare_windows.pop()
+            windows[window.window_id] = window
+            window.show()
         else:
             window_id = uuid.uuid4().hex
             window = MainWindow(global_common, gui_common, window_id)
             window.delete_window.connect(delete_window)
             windows[window_id] = window
 
-        if filename:
-            # Validate filename
-            filename = os.path.abspath(os.path.expanduser(filename))
-            try:
-                open(filename, "rb")
-            except FileNotFoundError:
-                click.echo("File not found")
-                return False
-            except PermissionError:
-                click.echo("Permission denied")
-                return False
-            window.common.document_filename = filename
+        window.raise_()
+        window.activateWindow()
+
+        if len(valid_filenames) == 1:
+            window.common.document_filename = valid_filenames[0]
             window.doc_selection_widget.document_selected.emit()
+        elif len(valid_filenames) > 1:
+            window.doc_selection_widget.documents_selected.emit(valid_filenames)
 
         return True
 
-    # Open a new window if not filename is passed
-    if filename is None:
-        select_document()
-    else:
-        # If filename is passed as an argument, open it
-        if not select_document(filename):
-            return True
+    # Open a new window if not filename is passed, otherwise open the filenames
+    if not select_documents(filenames):
+        return True
+
+    # Make sure Docker is running, in the background so the window can open right away
+    if platform.system() == "Darwin" or platform.system() == "Windows":
+
+        def docker_ready_checked(ready):
+            if not ready:
+                click.echo("Docker is not running")
+                for window in list(windows.values()):
+                    window.hide()
+                docker_installer = DockerInstaller(gui_common)
+                docker_installer.start()
+                app.quit()
+
+        def docker_authorization_failed():
+            click.echo("Authorization failed")
+            app.quit()
+
+        docker_ready_checker = DockerReadyChecker(global_common)
+        docker_ready_checker.docker_ready_checked.connect(docker_ready_checked)
+        docker_ready_checker.authorization_failed.connect(docker_authorization_failed)
+        docker_ready_checker.start()
 
     # Open a new window, if all windows are closed
     def application_activated():
@@ -155,4 +258,21 @@ def gui_main(custom_container, filename):
     # If the application is activated and all windows are closed, open a new one
     app_wrapper.application_activated.connect(application_activated)
 
-    sys.exit(app.exec_())
+    # If dangerzone is launched again, open its documents here
+    if instance_server:
+        instance_server.documents_selected.connect(select_documents)
+
+    returncode = app.exec_()
+
+    # Don't leave containers running
+    for window in list(windows.values()) + list(closing_windows.values()):
+        if window.is_converting():
+            window.cancel()
+    gui_common.scheduler.wait_for_done()
+    gui_common.wait_for_threads()
+
+    global_common.stop_broker()
+    global_common.metrics.stop()
+    if trace_filename:
+        global_common.tracer.save(trace_filename)
+    sys.exit(returncode)
@@ -1,10 +1,13 @@
 import os
+import json
 import platform
 import subprocess
 import shlex
 import pipes
+import appdirs
 from PySide2 import QtCore, QtGui, QtWidgets
-from colorama import Fore
+
+from ..log import logger
 
 if platform.system() == "Darwin":
     import CoreServices
@@ -16,27 +19,77 @@ elif platform.system() == "Linux":
     import getpass
     from xdg.DesktopEntry import DesktopEntry
 
-from .docker_installer import is_docker_ready
-from ..settings import Settings
+from .scheduler import ConversionScheduler
+from ..janitor import ScratchJanitor
 
 
-class GuiCommon(object):
+class GuiCommon(QtCore.QObject):
     """
     The GuiCommon class is a singleton of shared functionality for the GUI
     """
 
+    pdf_viewers_updated = QtCore.Signal()
+
+    # How often to clean up scratch directories, in seconds
+    janitor_interval = 10 * 60
+
     def __init__(self, app, global_common):
+        super(GuiCommon, self).__init__()
+
         # Qt app
         self.app = app
 
         # Global common singleton
         self.global_common = global_common
 
+        # Conversions from every window share this scheduler
+        self.scheduler = ConversionScheduler(
+            self.global_common.settings.get("max_concurrent_conversions")
+        )
+        self.scheduler.queue_changed.connect(self.queue_changed)
+
+        # Whether the container image exists, if we know yet
+        self.container_image_present = None
+
         # Preload font
         self.fixed_font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
 
-        # Preload list of PDF viewers on computer
-        self.pdf_viewers = self._find_pdf_viewers()
+        # List of PDF viewers on computer. Start with the cached list, and if the
+        # applications folders changed since it was cached, look for them again in
+        # the background
+        self.pdf_viewers_cache_filename = os.path.join(
+            appdirs.user_cache_dir("dangerzone"), "pdf_viewers.json"
+        )
+        self.pdf_viewers = {}
+        self.pdf_viewers_finder = None
+        self.load_pdf_viewers()
+
+        # Clean up scratch directories now, and then every so often, in the background
+        self.janitor = ScratchJanitor(self.global_common)
+        self.janitor_thread = None
+        self.janitor_timer = QtCore.QTimer()
+        self.janitor_timer.timeout.connect(self.clean_scratch_dirs)
+        self.janitor_timer.start(self.janitor_interval * 1000)
+        self.clean_scratch_dirs()
+
+    def clean_scratch_dirs(self):
+        if self.janitor_thread and self.janitor_thread.isRunning():
+            return
+        self.janitor_thread = ScratchJanitorThread(self.janitor)
+        self.janitor_thread.start()
+
+    def wait_for_threads(self):
+        """
+        Wait for the background threads to finish, before the app quits
+        """
+        self.janitor_timer.stop()
+        for thread in [self.janitor_thread, self.pdf_viewers_finder]:
+            if thread:
+                thread.wait()
+
+    def queue_changed(self, waiting_jobs, running_jobs):
+        self.global_common.metrics.queue_depth.set(waiting_jobs)
+        self.global_common.metrics.jobs_running.set(running_jobs)
 
     def get_window_icon(self):
         if platform.system() == "Windows":
@@ -56,7 +109,7 @@ class GuiCommon(object):
 
                 # Run
                 args_str = " ".join(pipes.quote(s) for s in args)
-                print(Fore.YELLOW + "> " + Fore.CYAN + args_str)
+                logger.info("> " + args_str)
                 subprocess.run(args)
 
             elif platform.system() == "Linux":
@@ -76,9 +129,78 @@ class GuiCommon(object):
 
                 # Open as a background process
                 args_str = " ".join(pipes.quote(s) for s in args)
-                print(Fore.YELLOW + "> " + Fore.CYAN + args_str)
+                logger.info("> " + args_str)
                 subprocess.Popen(args)
 
+    def load_pdf_viewers(self):
+        # PDF viewers can't be chosen in Windows
+        if platform.system() == "Windows":
+            return
+
+        search_paths_mtimes = self._get_pdf_viewers_search_paths_mtimes()
+        try:
+            with open(self.pdf_viewers_cache_filename) as f:
+                cache = json.load(f)
+            self.pdf_viewers = cache["pdf_viewers"]
+            if cache["search_paths_mtimes"] == search_paths_mtimes:
+                self.global_common.metrics.cache_hits.inc(cache="pdf_viewers")
+                return
+        except:
+            pass
+
+        self.global_common.metrics.cache_misses.inc(cache="pdf_viewers")
+        self.pdf_viewers_finder = PdfViewersFinder(self)
+        self.pdf_viewers_finder.pdf_viewers_found.connect(self.pdf_viewers_found)
+        self.pdf_viewers_finder.start()
+
+    def pdf_viewers_found(self, pdf_viewers, search_paths_mtimes):
+        # Keep the thread around, since it's still finishing when this is called
+        self.pdf_viewers = pdf_viewers
+        self.pdf_viewers_updated.emit()
+
+        # Cache them, so next time we don't have to look again
+        try:
+            os.makedirs(os.path.dirname(self.pdf_viewers_cache_filename), exist_ok=True)
+            with open(self.pdf_viewers_cache_filename, "w") as f:
+                json.dump(
+                    {
+                        "search_paths_mtimes": search_paths_mtimes,
+                        "pdf_viewers": pdf_viewers,
+                    },
+                    f,
+                    indent=4,
+                )
+        except OSError:
+            pass
+
+    def _get_pdf_viewers_search_paths(self):
+        if platform.system() == "Darwin":
+            return [
+                "/Applications",
+                "/System/Applications",
+                os.path.expanduser("~/Applications"),
+            ]
+        elif platform.system() == "Linux":
+            return [
+                "/usr/share/applications",
+                "/usr/local/share/applications",
+                os.path.expanduser("~/.local/share/applications"),
+            ]
+        return []
+
+    def _get_pdf_viewers_search_paths_mtimes(self):
+        """
+        The mtime of each applications folder, which changes whenever an app is
+        installed or removed, so we know when the cached list of PDF viewers is stale
+        """
+        mtimes = {}
+        for search_path in self._get_pdf_viewers_search_paths():
+            try:
+                mtimes[search_path] = os.stat(search_path).st_mtime_ns
+            except OSError:
+                mtimes[search_path] = None
+        return mtimes
+
     def _find_pdf_viewers(self):
         pdf_viewers = {}
 
@@ -116,33 +238,71 @@ class GuiCommon(object):
                     pdf_viewers[plist_dict["CFBundleName"]] = bundle_identifier
 
         elif platform.system() == "Linux":
-            # Find all .desktop files
-            for search_path in [
-                "/usr/share/applications",
-                "/usr/local/share/applications",
-                os.path.expanduser("~/.local/share/applications"),
-            ]:
-                try:
-                    for filename in os.listdir(search_path):
-                        full_filename = os.path.join(search_path, filename)
-                        if os.path.splitext(filename)[1] == ".desktop":
-
-                            # See which ones can open PDFs
-                            desktop_entry = DesktopEntry(full_filename)
-                            if (
-                                "application/pdf" in desktop_entry.getMimeTypes()
-                                and desktop_entry.getName() != "dangerzone"
-                            ):
-                                pdf_viewers[
-                                    desktop_entry.getName()
-                                ] = desktop_entry.getExec()
-
-                except FileNotFoundError:
-                    pass
+            pdf_viewers = find_desktop_pdf_viewers(self._get_pdf_viewers_search_paths())
 
         return pdf_viewers
 
 
+def find_desktop_pdf_viewers(search_paths):
+    """
+    Find the apps that can open PDFs in the .desktop files in search_paths. Returns a
+    dict mapping each app's name to its command.
+    """
+    pdf_viewers = {}
+    for search_path in search_paths:
+        try:
+            for filename in os.listdir(search_path):
+                full_filename = os.path.join(search_path, filename)
+                if os.path.splitext(filename)[1] == ".desktop":
+
+                    # See which ones can open PDFs
+                    desktop_entry = DesktopEntry(full_filename)
+                    if (
+                        "application/pdf" in desktop_entry.getMimeTypes()
+                        and desktop_entry.getName() != "dangerzone"
+                    ):
+                        pdf_viewers[desktop_entry.getName()] = desktop_entry.getExec()
+
+        except FileNotFoundError:
+            pass
+
+    return pdf_viewers
+
+
+class PdfViewersFinder(QtCore.QThread):
+    """
+    Look for PDF viewers in the background, because on Linux this means parsing every
+    .desktop file, which can take a while
+    """
+
+    pdf_viewers_found = QtCore.Signal(object, object)
+
+    def __init__(self, gui_common):
+        super(PdfViewersFinder, self).__init__()
+        self.gui_common = gui_common
+
+    def run(self):
+        # Get the mtimes first, so if something changes while we're looking, the cache
+        # will be refreshed next time
+        search_paths_mtimes = self.gui_common._get_pdf_viewers_search_paths_mtimes()
+        pdf_viewers = self.gui_common._find_pdf_viewers()
+        self.pdf_viewers_found.emit(pdf_viewers, search_paths_mtimes)
+
+
+class ScratchJanitorThread(QtCore.QThread):
+    """
+    Clean up scratch directories in the background, since deleting gigabytes of pixel
+    data can take a while
+    """
+
+    def __init__(self, janitor):
+        super(ScratchJanitorThread, self).__init__()
+        self.janitor = janitor
+
+    def run(self):
+        self.janitor.clean()
+
+
 class Alert(QtWidgets.QDialog):
     def __init__(
         self, gui_common, global_common, message, ok_text="Ok", extra_button_text=None
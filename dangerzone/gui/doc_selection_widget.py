@@ -1,8 +1,50 @@
+import os
 from PySide2 import QtCore, QtGui, QtWidgets
 
+# File extensions of the documents that dangerzone can convert
+document_extensions = [
+    ".pdf",
+    ".docx",
+    ".doc",
+    ".docm",
+    ".xlsx",
+    ".xls",
+    ".pptx",
+    ".ppt",
+    ".odt",
+    ".odg",
+    ".odp",
+    ".ods",
+    ".jpg",
+    ".jpeg",
+    ".gif",
+    ".png",
+    ".tif",
+    ".tiff",
+]
+
+
+def find_documents(paths):
+    """
+    Expand a list of files and folders into the list of documents to convert. Folders
+    are searched recursively, but only for files that look like documents.
+    """
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, dir_filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(dir_filenames):
+                    if os.path.splitext(filename)[1].lower() in document_extensions:
+                        filenames.append(os.path.join(dirpath, filename))
+        elif os.path.isfile(path):
+            filenames.append(path)
+    return filenames
+
 
 class DocSelectionWidget(QtWidgets.QWidget):
     document_selected = QtCore.Signal()
+    documents_selected = QtCore.Signal(list)
 
     def __init__(self, common):
         super(DocSelectionWidget, self).__init__()
@@ -12,7 +54,7 @@ class DocSelectionWidget(QtWidgets.QWidget):
         self.dangerous_doc_label = QtWidgets.QLabel()
         self.dangerous_doc_label.hide()
         self.dangerous_doc_button = QtWidgets.QPushButton(
-            "Select dangerous document ..."
+            "Select dangerous documents ..."
         )
         self.dangerous_doc_button.setStyleSheet(
             "QPushButton { font-weight: bold; padding: 10px; }"
@@ -24,20 +66,43 @@ class DocSelectionWidget(QtWidgets.QWidget):
         dangerous_doc_layout.addWidget(self.dangerous_doc_button)
         dangerous_doc_layout.addStretch()
 
+        drop_label = QtWidgets.QLabel("or drop documents and folders here")
+        drop_label.setAlignment(QtCore.Qt.AlignCenter)
+        drop_label.setStyleSheet("QLabel { color: #666666; }")
+
         # Layout
         layout = QtWidgets.QVBoxLayout()
         layout.addStretch()
         layout.addLayout(dangerous_doc_layout)
+        layout.addWidget(drop_label)
         layout.addStretch()
         self.setLayout(layout)
 
+        self.setAcceptDrops(True)
+
     def dangerous_doc_button_clicked(self):
-        filename = QtWidgets.QFileDialog.getOpenFileName(
+        extensions = " ".join(f"*{ext}" for ext in document_extensions)
+        filenames = QtWidgets.QFileDialog.getOpenFileNames(
             self,
-            "Open document",
-            filter="Documents (*.pdf *.docx *.doc *.docm *.xlsx *.xls *.pptx *.ppt *.odt *.odg *.odp *.ods *.jpg *.jpeg *.gif *.png *.tif *.tiff)",
+            "Open documents",
+            filter=f"Documents ({extensions})",
         )
-        if filename[0] != "":
-            filename = filename[0]
-            self.common.document_filename = filename
+        self.select(filenames[0])
+
+    def dragEnterEvent(self, e):
+        if e.mimeData().hasUrls():
+            e.acceptProposedAction()
+
+    def dropEvent(self, e):
+        paths = [url.toLocalFile() for url in e.mimeData().urls() if url.isLocalFile()]
+        e.acceptProposedAction()
+        self.select(find_documents(paths))
+
+    def select(self, filenames):
+        # Files that aren't documents, whatever their extension says, are rejected by
+        # the conversion, which looks at them off the GUI thread
+        if len(filenames) == 1:
+            self.common.document_filename = filenames[0]
             self.document_selected.emit()
+        elif len(filenames) > 1:
+            self.documents_selected.emit(filenames)
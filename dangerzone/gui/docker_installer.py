@@ -8,7 +8,8 @@ import time
 import platform
 from PySide2 import QtCore, QtGui, QtWidgets
 
-from ..container import container_runtime
+from ..container import get_container_runtime
+from ..log import logger
 
 
 class AuthorizationFailed(Exception):
@@ -16,6 +17,8 @@ class AuthorizationFailed(Exception):
 
 
 def is_docker_installed():
+    _, container_runtime = get_container_runtime()
+
     if platform.system() == "Darwin":
         # Does the docker binary exist?
         if os.path.isdir("/Applications/Docker.app") and os.path.exists(
@@ -44,11 +47,30 @@ def is_docker_ready(global_common):
         if p.returncode == 0:
             return True
         else:
-            print(outs.decode())
-            print(errs.decode())
+            logger.warning(outs.decode())
+            logger.warning(errs.decode())
             return False
 
 
+class DockerReadyChecker(QtCore.QThread):
+    """
+    Run is_docker_ready in the background, because Docker can take a while to answer
+    """
+
+    docker_ready_checked = QtCore.Signal(bool)
+    authorization_failed = QtCore.Signal()
+
+    def __init__(self, global_common):
+        super(DockerReadyChecker, self).__init__()
+        self.global_common = global_common
+
+    def run(self):
+        try:
+            self.docker_ready_checked.emit(is_docker_ready(self.global_common))
+        except AuthorizationFailed:
+            self.authorization_failed.emit()
+
+
 def launch_docker_windows(global_common):
     docker_desktop_path = "C:\\Program Files\\Docker\\Docker\\Docker Desktop.exe"
     subprocess.Popen(
@@ -141,7 +163,7 @@ class DockerInstaller(QtWidgets.QDialog):
         self.open_finder_button.show()
 
     def download_failed(self, status_code):
-        print(f"Download failed: status code {status_code}")
+        logger.error(f"Download failed: status code {status_code}")
         self.download_t = None
 
     def download(self):
@@ -234,7 +256,7 @@ class Downloader(QtCore.QThread):
             self.installer_url = "https://download.docker.com/win/stable/Docker%20for%20Windows%20Installer.exe"
 
     def run(self):
-        print(f"Downloading docker to {self.installer_filename}")
+        logger.info(f"Downloading docker to {self.installer_filename}")
         with requests.get(self.installer_url, stream=True) as r:
             if r.status_code != 200:
                 self.download_failed.emit(r.status_code)
@@ -1,11 +1,11 @@
 import shutil
 import os
-import platform
 from PySide2 import QtCore, QtGui, QtWidgets
 
 from .doc_selection_widget import DocSelectionWidget
 from .settings_widget import SettingsWidget
 from .tasks_widget import TasksWidget
+from .queue_widget import QueueWidget
 from ..common import Common
 
 
@@ -17,14 +17,25 @@ class MainWindow(QtWidgets.QMainWindow):
         self.global_common = global_common
         self.gui_common = gui_common
         self.window_id = window_id
-        self.common = Common()
-
         self.setWindowTitle("dangerzone")
         self.setWindowIcon(self.gui_common.get_window_icon())
 
         self.setMinimumWidth(600)
         self.setMinimumHeight(400)
 
+        # Whether the window should be deleted as soon as its conversion is done
+        self.teardown_pending = False
+
+        self.create_widgets()
+        self.show()
+
+    def create_widgets(self):
+        """
+        Create everything inside the window, with a new Common. When this is called
+        again, the widgets from before are deleted.
+        """
+        self.common = Common()
+
         # Header
         logo = QtWidgets.QLabel()
         logo.setPixmap(
@@ -45,8 +56,12 @@ class MainWindow(QtWidgets.QMainWindow):
         # Doc selection widget
         self.doc_selection_widget = DocSelectionWidget(self.common)
         self.doc_selection_widget.document_selected.connect(self.document_selected)
+        self.doc_selection_widget.documents_selected.connect(self.documents_selected)
         self.doc_selection_widget.show()
 
+        # Whether this window is converting a queue of documents, instead of just one
+        self.queue_mode = False
+
         # Settings
         self.settings_widget = SettingsWidget(
             self.global_common, self.gui_common, self.common
@@ -54,6 +69,9 @@ class MainWindow(QtWidgets.QMainWindow):
         self.doc_selection_widget.document_selected.connect(
             self.settings_widget.document_selected
         )
+        self.doc_selection_widget.documents_selected.connect(
+            self.settings_widget.documents_selected
+        )
         self.settings_widget.start_clicked.connect(self.start_clicked)
         self.settings_widget.close_window.connect(self.close)
         self.settings_widget.hide()
@@ -66,36 +84,94 @@ class MainWindow(QtWidgets.QMainWindow):
             self.global_common, self.gui_common, self.common
         )
         self.tasks_widget.close_window.connect(self.close)
+        self.tasks_widget.conversion_finished.connect(self.conversion_finished)
         self.doc_selection_widget.document_selected.connect(
             self.tasks_widget.document_selected
         )
-        self.settings_widget.start_clicked.connect(self.tasks_widget.start)
         self.tasks_widget.hide()
 
+        # Queue of documents
+        self.queue_widget = QueueWidget(self.global_common, self.gui_common)
+        self.doc_selection_widget.documents_selected.connect(
+            self.queue_widget.documents_selected
+        )
+        self.queue_widget.conversion_finished.connect(self.conversion_finished)
+        self.queue_widget.hide()
+
         # Layout
         layout = QtWidgets.QVBoxLayout()
         layout.addLayout(header_layout)
         layout.addWidget(self.doc_selection_widget, stretch=1)
         layout.addWidget(self.settings_widget, stretch=1)
         layout.addWidget(self.tasks_widget, stretch=1)
+        layout.addWidget(self.queue_widget, stretch=1)
 
+        # If there was a central widget already, Qt deletes it along with the old
+        # widgets inside of it
         central_widget = QtWidgets.QWidget()
         central_widget.setLayout(layout)
         self.setCentralWidget(central_widget)
 
-        self.show()
-
     def document_selected(self):
         self.doc_selection_widget.hide()
         self.settings_widget.show()
 
+    def documents_selected(self, filenames):
+        self.queue_mode = True
+        self.doc_selection_widget.hide()
+        self.settings_widget.show()
+
     def start_clicked(self):
         self.settings_widget.hide()
-        self.tasks_widget.show()
+        if self.queue_mode:
+            self.queue_widget.show()
+            self.queue_widget.start(self.settings_widget.page_range)
+        else:
+            self.tasks_widget.show()
+            self.tasks_widget.start()
 
     def closeEvent(self, e):
         e.accept()
         self.delete_window.emit(self.window_id)
 
-        if platform.system() != "Darwin":
-            self.gui_common.app.quit()
+    def is_converting(self):
+        return self.tasks_widget.converting or self.queue_widget.converting
+
+    def cancel(self):
+        if self.queue_mode:
+            self.queue_widget.cancel()
+        else:
+            self.tasks_widget.cancel()
+
+    def cleanup(self):
+        """
+        Wait for the window's background threads, and delete its scratch directories
+        """
+        self.settings_widget.wait_for_threads()
+        self.common.cleanup()
+
+    def reset(self):
+        """
+        Make the window like new again, so it can be reused instead of creating another
+        one. It shouldn't be converting.
+        """
+        self.cleanup()
+        self.create_widgets()
+
+    def teardown(self):
+        """
+        Release everything the window holds, and delete it. If it's still converting,
+        the conversion is cancelled, and this happens once it's done.
+        """
+        if self.is_converting():
+            self.teardown_pending = True
+            self.cancel()
+            return
+
+        self.cleanup()
+        self.deleteLater()
+
+    def conversion_finished(self):
+        if self.teardown_pending:
+            self.teardown_pending = False
+            self.teardown()
@@ -0,0 +1,311 @@
+import os
+import time
+from PySide2 import QtCore, QtGui, QtWidgets
+
+from .tasks import (
+    PullImageTask,
+    PullImageIfMissingTask,
+    ConvertToPixels,
+    ConvertToPDF,
+)
+from .scheduler import ConversionJob
+from ..common import Common, get_save_filenames
+from ..progress import ConversionProgress
+
+
+class QueueItem(QtCore.QObject):
+    """
+    One document in the queue, and its row in the table
+    """
+
+    item_done = QtCore.Signal()
+
+    def __init__(self, global_common, gui_common, table, row, filename, save_filename):
+        super(QueueItem, self).__init__()
+        self.global_common = global_common
+        self.gui_common = gui_common
+        self.table = table
+        self.row = row
+
+        self.common = Common()
+        self.common.document_filename = filename
+        self.common.save_filename = save_filename
+
+        self.job = None
+        self.started_at = None
+        self.finished_at = None
+        self.succeeded = None
+
+        self.set_cell(0, os.path.basename(filename))
+        self.set_cell(1, "Waiting")
+        self.set_cell(2, "")
+        self.set_cell(3, "")
+        self.set_cell(4, "")
+        self.table.item(self.row, 0).setToolTip(filename)
+
+    def set_cell(self, column, text):
+        item = self.table.item(self.row, column)
+        if item is None:
+            item = QtWidgets.QTableWidgetItem()
+            item.setFlags(item.flags() & ~QtCore.Qt.ItemIsEditable)
+            self.table.setItem(self.row, column, item)
+        item.setText(text)
+
+    def create_job(self):
+        self.common.progress = ConversionProgress(
+            self.global_common.throughput,
+            self.common.document_filename,
+            self.global_common.settings.get("ocr"),
+        )
+        self.common.trace_track = self.global_common.tracer.new_track(
+            os.path.basename(self.common.document_filename)
+        )
+        self.tasks = [
+            ConvertToPixels(self.global_common, self.common),
+            ConvertToPDF(self.global_common, self.common),
+        ]
+        for task in self.tasks:
+            task.update_label.connect(self.update_label)
+            task.update_progress.connect(self.update_progress)
+            task.task_failed.connect(self.task_failed)
+
+        self.job = ConversionJob(self.tasks)
+        self.job.signals.job_started.connect(self.job_started)
+        self.job.signals.job_finished.connect(self.job_finished)
+        self.job.signals.job_failed.connect(self.job_failed)
+        return self.job
+
+    def update_label(self, s):
+        self.set_cell(1, s)
+
+    def update_elapsed(self):
+        if self.started_at is None:
+            return
+        if self.finished_at is None:
+            elapsed = time.monotonic() - self.started_at
+        else:
+            elapsed = self.finished_at - self.started_at
+        self.set_cell(3, f"{int(elapsed) // 60}:{int(elapsed) % 60:02d}")
+
+    def job_started(self):
+        self.started_at = time.monotonic()
+        self.update_elapsed()
+
+    def update_progress(self, percent, s):
+        progress = self.common.progress
+        if progress.num_pages:
+            self.set_cell(2, f"{progress.pages_done}/{progress.num_pages}")
+        elif progress.estimated_pages:
+            self.set_cell(2, f"{progress.pages_done}/~{progress.estimated_pages}")
+        self.table.item(self.row, 2).setToolTip(s)
+
+    def cancel(self):
+        if self.succeeded is None and not self.common.cancelled:
+            self.global_common.cancel_conversion(self.common)
+            if self.job:
+                self.gui_common.scheduler.cancel(self.job)
+
+    def task_failed(self, err):
+        if self.common.cancelled:
+            return
+
+        # Only show the first line of the error in the table, and the rest in a tooltip
+        lines = err.strip().split("\n")
+        self.set_cell(4, f"Failed: {lines[0]}")
+        self.table.item(self.row, 4).setToolTip(err)
+
+    def job_finished(self):
+        # Save safe PDF
+        try:
+            with self.global_common.tracer.span("save", self.common.trace_track):
+                self.common.save_safe_pdf()
+        except OSError as e:
+            self.task_failed(f"Couldn't save the safe PDF: {e}")
+            self.job_failed("save_failed")
+            return
+        self.global_common.metrics.document_converted(
+            self.common, self.common.save_filename
+        )
+        self.set_cell(1, "Done")
+        self.set_cell(4, f"Saved {os.path.basename(self.common.save_filename)}")
+        self.table.item(self.row, 4).setToolTip(self.common.save_filename)
+
+        # Clean up
+        self.common.cleanup()
+
+        self.succeeded = True
+        self.done()
+
+    def job_failed(self, failure_reason):
+        self.global_common.conversion_failed(
+            self.common, failure_reason, remember=False
+        )
+        self.common.cleanup()
+        if failure_reason == "cancelled":
+            self.set_cell(1, "")
+            self.set_cell(4, "Cancelled")
+        elif failure_reason == "timeout":
+            self.set_cell(1, "Timed out")
+        else:
+            self.set_cell(1, "Failed")
+        self.succeeded = False
+        self.done()
+
+    def done(self):
+        self.finished_at = time.monotonic()
+        self.update_elapsed()
+        self.item_done.emit()
+
+
+class QueueWidget(QtWidgets.QWidget):
+    """
+    Convert a whole list of documents, through the shared scheduler, showing the
+    progress of each one in a table
+    """
+
+    close_window = QtCore.Signal()
+    conversion_finished = QtCore.Signal()
+
+    def __init__(self, global_common, gui_common):
+        super(QueueWidget, self).__init__()
+        self.global_common = global_common
+        self.gui_common = gui_common
+
+        self.summary_label = QtWidgets.QLabel()
+        self.summary_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.summary_label.setStyleSheet(
+            "QLabel { font-weight: bold; font-size: 20px; }"
+        )
+
+        self.table = QtWidgets.QTableWidget()
+        self.table.setColumnCount(5)
+        self.table.setHorizontalHeaderLabels(
+            ["Document", "Stage", "Pages", "Elapsed", "Result"]
+        )
+        self.table.verticalHeader().hide()
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(3, QtWidgets.QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(4, QtWidgets.QHeaderView.Stretch)
+
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel)
+        self.cancel_button.hide()
+        cancel_layout = QtWidgets.QHBoxLayout()
+        cancel_layout.addStretch()
+        cancel_layout.addWidget(self.cancel_button)
+        cancel_layout.addStretch()
+
+        # Layout
+        layout = QtWidgets.QVBoxLayout()
+        layout.addWidget(self.summary_label)
+        layout.addWidget(self.table)
+        layout.addLayout(cancel_layout)
+        self.setLayout(layout)
+
+        # Update the elapsed times every second
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.update_elapsed)
+
+        self.items = []
+
+        # Whether the queue has been started and hasn't finished yet
+        self.converting = False
+
+    def documents_selected(self, filenames):
+        self.table.setRowCount(len(filenames))
+        self.items = []
+        save_filenames = get_save_filenames(filenames)
+        for row, filename in enumerate(filenames):
+            item = QueueItem(
+                self.global_common,
+                self.gui_common,
+                self.table,
+                row,
+                filename,
+                save_filenames[row],
+            )
+            item.item_done.connect(self.update_summary)
+            self.items.append(item)
+        self.update_summary()
+
+    def start(self, page_range=None):
+        for item in self.items:
+            item.common.page_range = page_range
+
+        self.converting = True
+        self.cancel_button.show()
+        self.timer.start(1000)
+
+        # Get the container image ready once, before any of the documents start
+        pull_task = None
+        if self.global_common.settings.get("update_container"):
+            pull_task = PullImageTask(self.global_common, None)
+        elif (
+            self.gui_common.container_image_present is None
+            and not self.global_common.custom_container
+        ):
+            pull_task = PullImageIfMissingTask(self.global_common, None)
+
+        if pull_task:
+            self.summary_label.setText("Pulling container image")
+            pull_task.task_failed.connect(self.pull_failed)
+            self.pull_job = ConversionJob([pull_task])
+            self.pull_job.signals.job_finished.connect(self.submit_documents)
+            self.gui_common.scheduler.submit(self.pull_job)
+        else:
+            self.submit_documents()
+
+    def cancel(self):
+        """
+        Cancel every document that isn't done yet. The ones that are waiting are taken
+        out of the queue.
+        """
+        if not self.converting:
+            return
+        self.cancel_button.setEnabled(False)
+        self.summary_label.setText("Cancelling")
+        for item in self.items:
+            item.cancel()
+
+    def submit_documents(self):
+        self.update_summary()
+        for item in self.items:
+            # Documents cancelled while the image was being pulled never start
+            if item.common.cancelled:
+                item.job_failed("cancelled")
+            else:
+                self.gui_common.scheduler.submit(item.create_job())
+
+    def pull_failed(self, err):
+        self.timer.stop()
+        self.summary_label.setText("Failed to get the container image :(")
+        for item in self.items:
+            item.set_cell(1, "")
+            item.set_cell(4, "Not converted")
+        self.converting = False
+        self.cancel_button.hide()
+        self.conversion_finished.emit()
+
+    def update_elapsed(self):
+        for item in self.items:
+            item.update_elapsed()
+
+    def update_summary(self):
+        done = len([item for item in self.items if item.succeeded is not None])
+        failed = len([item for item in self.items if item.succeeded is False])
+
+        text = f"{done} of {len(self.items)} documents finished"
+        if failed > 0:
+            text += f", {failed} failed"
+        self.summary_label.setText(text)
+
+        if done == len(self.items):
+            self.timer.stop()
+            if self.converting:
+                self.converting = False
+                self.cancel_button.hide()
+                self.conversion_finished.emit()
@@ -0,0 +1,102 @@
+from PySide2 import QtCore
+
+
+class ConversionJobSignals(QtCore.QObject):
+    """
+    QRunnable isn't a QObject, so a ConversionJob's signals live here
+    """
+
+    job_started = QtCore.Signal()
+    job_finished = QtCore.Signal()
+    job_failed = QtCore.Signal(str)
+
+
+class ConversionJob(QtCore.QRunnable):
+    """
+    All of the tasks to convert one document, run one after another in a single slot of
+    the scheduler's thread pool. It stops at the first task that fails, or when the
+    conversion is cancelled.
+    """
+
+    def __init__(self, tasks):
+        super(ConversionJob, self).__init__()
+        self.tasks = tasks
+        self.signals = ConversionJobSignals()
+
+        # The window that submitted the job keeps a reference to it
+        self.setAutoDelete(False)
+
+    def run(self):
+        self.signals.job_started.emit()
+        for task in self.tasks:
+            if task.common and task.common.cancelled:
+                self.signals.job_failed.emit("cancelled")
+                return
+            if not task.run():
+                failure_reason = task.failure_reason or "unknown"
+
+                # Remembering the document hashes it, which shouldn't happen on the
+                # main thread
+                if task.common:
+                    task.global_common.failure_cache.add(task.common, failure_reason)
+                self.signals.job_failed.emit(failure_reason)
+                return
+
+        self.signals.job_finished.emit()
+
+
+class ConversionScheduler(QtCore.QObject):
+    """
+    Runs the conversion jobs for every window, sharing one thread pool so that only so
+    many conversions happen at the same time. The rest wait their turn.
+    """
+
+    queue_changed = QtCore.Signal(int, int)
+
+    def __init__(self, max_concurrent_jobs):
+        super(ConversionScheduler, self).__init__()
+        self.pool = QtCore.QThreadPool()
+        self.pool.setMaxThreadCount(max(1, max_concurrent_jobs))
+
+        # Jobs that were submitted but haven't started yet, and jobs that are running
+        self.waiting_jobs = 0
+        self.running_jobs = 0
+
+    def set_max_concurrent_jobs(self, max_concurrent_jobs):
+        self.pool.setMaxThreadCount(max(1, max_concurrent_jobs))
+
+    def submit(self, job):
+        job.signals.job_started.connect(self.job_started)
+        job.signals.job_finished.connect(self.job_done)
+        job.signals.job_failed.connect(self.job_done)
+
+        self.waiting_jobs += 1
+        self.queue_changed.emit(self.waiting_jobs, self.running_jobs)
+        self.pool.start(job)
+
+    def job_started(self):
+        self.waiting_jobs -= 1
+        self.running_jobs += 1
+        self.queue_changed.emit(self.waiting_jobs, self.running_jobs)
+
+    def cancel(self, job):
+        """
+        If job hasn't started yet, take it out of the queue and fail it right away,
+        instead of leaving it to fail once it gets its turn. Returns True if it did.
+        """
+        if not self.pool.tryTake(job):
+            return False
+
+        # It never started, so it isn't running
+        job.signals.job_failed.disconnect(self.job_done)
+        self.waiting_jobs -= 1
+        self.queue_changed.emit(self.waiting_jobs, self.running_jobs)
+        job.signals.job_failed.emit("cancelled")
+        return True
+
+    def job_done(self, failure_reason=None):
+        self.running_jobs -= 1
+        self.queue_changed.emit(self.waiting_jobs, self.running_jobs)
+
+    def wait_for_done(self):
+        self.pool.waitForDone()
@@ -2,6 +2,9 @@ import os
 import platform
 from PySide2 import QtCore, QtGui, QtWidgets
 
+from ..common import get_save_filenames
+from ..page_range import parse_page_range
+
 
 class SettingsWidget(QtWidgets.QWidget):
     start_clicked = QtCore.Signal()
@@ -13,6 +16,15 @@ class SettingsWidget(QtWidgets.QWidget):
         self.gui_common = gui_common
         self.common = common
 
+        # Checks if the container image exists, in the background
+        self.container_probe = None
+
+        # Whether we're converting a queue of documents, instead of just one
+        self.queue_mode = False
+
+        # Which pages to convert, once start is clicked, or None for every page
+        self.page_range = None
+
         # Dangerous document label
         self.dangerous_doc_label = QtWidgets.QLabel()
         self.dangerous_doc_label.setAlignment(QtCore.Qt.AlignCenter)
@@ -49,12 +61,15 @@ class SettingsWidget(QtWidgets.QWidget):
             )
             self.open_checkbox.clicked.connect(self.update_ui)
             self.open_combobox = QtWidgets.QComboBox()
-            for k in self.gui_common.pdf_viewers:
-                self.open_combobox.addItem(k, self.gui_common.pdf_viewers[k])
+            self.update_pdf_viewers()
+            self.gui_common.pdf_viewers_updated.connect(self.update_pdf_viewers)
             open_layout = QtWidgets.QHBoxLayout()
             open_layout.addWidget(self.open_checkbox)
             open_layout.addWidget(self.open_combobox)
             open_layout.addStretch()
+            open_layout.setContentsMargins(0, 0, 0, 0)
+            self.open_widget = QtWidgets.QWidget()
+            self.open_widget.setLayout(open_layout)
 
         # OCR document
         self.ocr_checkbox = QtWidgets.QCheckBox("OCR document, language")
@@ -66,10 +81,27 @@ class SettingsWidget(QtWidgets.QWidget):
         ocr_layout.addWidget(self.ocr_combobox)
         ocr_layout.addStretch()
 
+        # Page range
+        self.pages_label = QtWidgets.QLabel("Only convert pages")
+        self.pages_lineedit = QtWidgets.QLineEdit()
+        self.pages_lineedit.setPlaceholderText("All, or like 1-10,15")
+        pages_layout = QtWidgets.QHBoxLayout()
+        pages_layout.addWidget(self.pages_label)
+        pages_layout.addWidget(self.pages_lineedit)
+        pages_layout.addStretch()
+
         # Update container
         self.update_checkbox = QtWidgets.QCheckBox("Update container")
+        self.update_checking_label = QtWidgets.QLabel("Checking for container...")
+        self.update_checking_label.hide()
+        self.update_checking_progress = QtWidgets.QProgressBar()
+        self.update_checking_progress.setRange(0, 0)
+        self.update_checking_progress.setMaximumWidth(80)
+        self.update_checking_progress.hide()
         update_layout = QtWidgets.QHBoxLayout()
         update_layout.addWidget(self.update_checkbox)
+        update_layout.addWidget(self.update_checking_label)
+        update_layout.addWidget(self.update_checking_progress)
         update_layout.addStretch()
 
         # Button
@@ -89,8 +121,9 @@ class SettingsWidget(QtWidgets.QWidget):
         layout.addSpacing(20)
         layout.addLayout(save_layout)
         if platform.system() != "Windows":
-            layout.addLayout(open_layout)
+            layout.addWidget(self.open_widget)
         layout.addLayout(ocr_layout)
+        layout.addLayout(pages_layout)
         layout.addLayout(update_layout)
         layout.addSpacing(20)
         layout.addLayout(button_layout)
@@ -120,41 +153,66 @@ class SettingsWidget(QtWidgets.QWidget):
             else:
                 self.open_checkbox.setCheckState(QtCore.Qt.Unchecked)
 
-            index = self.open_combobox.findText(
-                self.global_common.settings.get("open_app")
-            )
-            if index != -1:
-                self.open_combobox.setCurrentIndex(index)
-
         if self.global_common.settings.get("update_container"):
             self.update_checkbox.setCheckState(QtCore.Qt.Checked)
         else:
             self.update_checkbox.setCheckState(QtCore.Qt.Unchecked)
 
+    def update_pdf_viewers(self):
+        # Keep the PDF viewer that's already selected, if there is one
+        if self.open_combobox.count() > 0:
+            open_app = self.open_combobox.currentText()
+        else:
+            open_app = self.global_common.settings.get("open_app")
+
+        self.open_combobox.clear()
+        for k in self.gui_common.pdf_viewers:
+            self.open_combobox.addItem(k, self.gui_common.pdf_viewers[k])
+
+        index = self.open_combobox.findText(open_app)
+        if index != -1:
+            self.open_combobox.setCurrentIndex(index)
+
     def check_update_container_default_state(self):
         # Is update containers required?
         if self.global_common.custom_container:
             self.update_checkbox.setCheckState(QtCore.Qt.Unchecked)
             self.update_checkbox.setEnabled(False)
             self.update_checkbox.hide()
-        else:
-            with self.global_common.exec_dangerzone_container(
-                [
-                    "ls",
-                    self.global_common.get_container_name(),
-                ]
-            ) as p:
-                stdout_data, stderror_data = p.communicate()
-
-                # The user canceled, or permission denied
-                if p.returncode == 126 or p.returncode == 127:
-                    self.close_window.emit()
-                    return
-
-                # Check the output
-                if b"dangerzone" not in stdout_data:
-                    self.update_checkbox.setCheckState(QtCore.Qt.Checked)
-                    self.update_checkbox.setEnabled(False)
+        elif self.gui_common.container_image_present is None:
+            # Check if we have the container in the background, because the container
+            # runtime can take a while to answer. The user can still start converting
+            # before it's done.
+            self.update_checking_label.show()
+            self.update_checking_progress.show()
+
+            self.container_probe = ContainerProbe(self.global_common)
+            self.container_probe.probe_finished.connect(self.container_probe_finished)
+            self.container_probe.start()
+        elif not self.gui_common.container_image_present:
+            self.update_checkbox.setCheckState(QtCore.Qt.Checked)
+            self.update_checkbox.setEnabled(False)
+
+    def wait_for_threads(self):
+        if self.container_probe:
+            self.container_probe.wait()
+            self.container_probe = None
+
+    def container_probe_finished(self, returncode, container_found):
+        self.update_checking_label.hide()
+        self.update_checking_progress.hide()
+
+        # The user canceled, or permission denied
+        if returncode == 126 or returncode == 127:
+            self.close_window.emit()
+            return
+
+        if returncode == 0:
+            self.gui_common.container_image_present = container_found
+
+        if not container_found:
+            self.update_checkbox.setCheckState(QtCore.Qt.Checked)
+            self.update_checkbox.setEnabled(False)
 
     def update_ui(self):
         if platform.system() == "Windows":
@@ -178,10 +236,23 @@ class SettingsWidget(QtWidgets.QWidget):
         )
 
         # Update the save location
-        save_filename = f"{os.path.splitext(self.common.document_filename)[0]}-safe.pdf"
+        save_filename = get_save_filenames([self.common.document_filename])[0]
         self.common.save_filename = save_filename
         self.save_lineedit.setText(os.path.basename(save_filename))
 
+    def documents_selected(self, filenames):
+        self.queue_mode = True
+        self.dangerous_doc_label.setText(f"Dangerous: {len(filenames)} documents")
+
+        # Each safe PDF is saved next to its document, and they're not opened
+        self.save_checkbox.setCheckState(QtCore.Qt.Checked)
+        self.save_checkbox.setEnabled(False)
+        self.save_lineedit.setText("Save each as [filename]-safe.pdf")
+        self.save_browse_button.hide()
+        if platform.system() != "Windows":
+            self.open_widget.hide()
+        self.update_ui()
+
     def save_browse_button_clicked(self):
         filename = QtWidgets.QFileDialog.getSaveFileName(
             self,
@@ -194,15 +265,27 @@ class SettingsWidget(QtWidgets.QWidget):
             self.save_lineedit.setText(os.path.basename(self.common.save_filename))
 
     def start_button_clicked(self):
-        # Update settings
-        self.global_common.settings.set(
-            "save", self.save_checkbox.checkState() == QtCore.Qt.Checked
-        )
+        # The page range is only for this conversion, so it isn't saved in settings
+        try:
+            self.page_range = parse_page_range(self.pages_lineedit.text())
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(
+                self, "dangerzone", f"{e}\n\nPage ranges look like: 1-10,15,20-"
+            )
+            return
+        self.common.page_range = self.page_range
+
+        # Update settings. In queue mode, saving and opening can't be changed, so
+        # don't remember them.
+        if not self.queue_mode:
+            self.global_common.settings.set(
+                "save", self.save_checkbox.checkState() == QtCore.Qt.Checked
+            )
         self.global_common.settings.set(
             "ocr", self.ocr_checkbox.checkState() == QtCore.Qt.Checked
         )
         self.global_common.settings.set("ocr_language", self.ocr_combobox.currentText())
-        if platform.system() != "Windows":
+        if platform.system() != "Windows" and not self.queue_mode:
             self.global_common.settings.set(
                 "open", self.open_checkbox.checkState() == QtCore.Qt.Checked
             )
@@ -216,3 +299,24 @@ class SettingsWidget(QtWidgets.QWidget):
 
         # Start!
         self.start_clicked.emit()
+
+
+class ContainerProbe(QtCore.QThread):
+    """
+    Check if the container image exists, without blocking the UI
+    """
+
+    probe_finished = QtCore.Signal(int, bool)
+
+    def __init__(self, global_common):
+        super(ContainerProbe, self).__init__()
+        self.global_common = global_common
+
+    def run(self):
+        container_name = self.global_common.get_container_name()
+        with self.global_common.exec_dangerzone_container(
+            ["ls", "--container-name", container_name]
+        ) as p:
+            stdout_data, _ = p.communicate()
+
+        self.probe_finished.emit(p.returncode, b"dangerzone" in stdout_data)
@@ -0,0 +1,113 @@
+import os
+import json
+import getpass
+import hashlib
+from PySide2 import QtCore, QtNetwork
+
+from ..log import logger
+
+# How long a new launch waits for the running instance, in milliseconds
+connect_timeout = 1000
+
+
+def get_server_name():
+    """
+    The name of the local socket the running instance listens on. It's different for
+    each user, so people sharing a computer don't hand documents to each other.
+    """
+    user = hashlib.sha256(getpass.getuser().encode()).hexdigest()[:16]
+    return f"dangerzone-{user}"
+
+
+def is_instance_running():
+    socket = QtNetwork.QLocalSocket()
+    socket.connectToServer(get_server_name())
+    running = socket.waitForConnected(connect_timeout)
+    socket.abort()
+    return running
+
+
+def send_to_running_instance(filenames):
+    """
+    If dangerzone is already running, hand it the documents to open. Returns True if
+    they were handed over, and False if there's no running instance.
+    """
+    socket = QtNetwork.QLocalSocket()
+    socket.connectToServer(get_server_name())
+    if not socket.waitForConnected(connect_timeout):
+        return False
+
+    # The running instance has a different working directory
+    filenames = [os.path.abspath(os.path.expanduser(f)) for f in filenames]
+    socket.write(json.dumps({"filenames": filenames}).encode() + b"\n")
+    success = socket.waitForBytesWritten(connect_timeout)
+    socket.disconnectFromServer()
+    if socket.state() != QtNetwork.QLocalSocket.UnconnectedState:
+        socket.waitForDisconnected(connect_timeout)
+    return success
+
+
+class InstanceServer(QtCore.QObject):
+    """
+    Listens for new launches of dangerzone, and emits documents_selected with the
+    filenames each one hands over (an empty list means they just want a new window)
+    """
+
+    documents_selected = QtCore.Signal(list)
+
+    def __init__(self):
+        super(InstanceServer, self).__init__()
+        self.server = QtNetwork.QLocalServer(self)
+        self.server.newConnection.connect(self.new_connection)
+
+        # Data read from each connection so far
+        self.buffers = {}
+
+    def listen(self):
+        name = get_server_name()
+        if self.server.listen(name):
+            return True
+
+        # If dangerzone crashed, its socket might have been left behind. But if
+        # another instance is listening on it, leave it alone.
+        if (
+            self.server.serverError() == QtNetwork.QAbstractSocket.AddressInUseError
+            and not is_instance_running()
+        ):
+            QtNetwork.QLocalServer.removeServer(name)
+            if self.server.listen(name):
+                return True
+
+        logger.warning(f"Can't listen for new documents: {self.server.errorString()}")
+        return False
+
+    def new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self.buffers[socket] = b""
+            socket.readyRead.connect(lambda socket=socket: self.read(socket))
+            socket.disconnected.connect(lambda socket=socket: self.disconnected(socket))
+
+            # The data might have arrived already
+            self.read(socket)
+
+    def read(self, socket):
+        if socket not in self.buffers:
+            return
+        self.buffers[socket] += bytes(socket.readAll())
+
+        while b"\n" in self.buffers[socket]:
+            line, self.buffers[socket] = self.buffers[socket].split(b"\n", 1)
+            try:
+                filenames = json.loads(line)["filenames"]
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Invalid message from a new launch of dangerzone")
+                continue
+            self.documents_selected.emit([str(f) for f in filenames])
+
+    def disconnected(self, socket):
+        if socket not in self.buffers:
+            return
+        self.read(socket)
+        del self.buffers[socket]
+        socket.deleteLater()
@@ -1,50 +1,143 @@
 from PySide2 import QtCore, QtWidgets, QtGui
-from colorama import Style, Fore
+import time
 
+from ..log import container_logger, log_container_output, logger
+from ..watchdog import Watchdog
+from ..failures import get_retry_delay, wait_to_retry, classify_invalid_output
+from ..sniff import sniff_mime_type
+from ..page_range import format_page_range
+
+
+class TaskBase(QtCore.QObject):
+    """
+    One step of a conversion. Tasks don't have threads of their own: a ConversionJob
+    runs them one after another in the scheduler's thread pool. run() returns True if
+    the task succeeded, so the job knows whether to go on to the next one.
+    """
 
-class TaskBase(QtCore.QThread):
     task_finished = QtCore.Signal()
     task_failed = QtCore.Signal(str)
     update_label = QtCore.Signal(str)
     update_details = QtCore.Signal(str)
+    update_progress = QtCore.Signal(int, str)
 
     def __init__(self):
         super(TaskBase, self).__init__()
 
-    def exec_container(self, args):
+        # Why the task failed, for metrics
+        self.failure_reason = None
+
+    def exec_container(self, args, stage=False):
+        """
+        Run a dangerzone-container command, and run it again if it fails for a reason
+        that might not happen the next time. If it's a stage of the conversion, each
+        attempt gets its own container name, and starts with an empty output folder.
+        """
+        attempt = 0
+        while True:
+            if stage:
+                self.common.stopped_early = False
+                returncode, output, stderr = self.run_container(
+                    args + ["--name", self.common.name_container()]
+                )
+                if self.common.stage_succeeded(returncode):
+                    return 0, output, stderr
+            else:
+                returncode, output, stderr = self.run_container(args)
+            if returncode == 0:
+                return returncode, output, stderr
+
+            self.failure_reason = self.global_common.get_failure_reason(
+                returncode, self.common, output, stderr
+            )
+            delay = get_retry_delay(
+                self.global_common.settings, self.failure_reason, attempt
+            )
+            if delay is None:
+                break
+
+            self.update_details.emit(
+                f"{output}\n"
+                f"Failed ({self.failure_reason}), trying again in {delay} seconds"
+            )
+            self.global_common.metrics.retries.inc(reason=self.failure_reason)
+            if not wait_to_retry(self.common, delay):
+                self.failure_reason = "cancelled"
+                break
+            if stage:
+                self.common.clear_stage_output(args[0])
+                if self.common.progress:
+                    self.common.progress.start_stage(args[0])
+                    self.emit_progress()
+            attempt += 1
+
+        if self.failure_reason == "cancelled":
+            self.task_failed.emit("Cancelled")
+        elif self.failure_reason == "timeout":
+            self.task_failed.emit(f"Timed out: {self.common.timeout_error}")
+        elif self.failure_reason == "authorization":
+            self.task_failed.emit(f"Authorization failed")
+        else:
+            self.task_failed.emit(f"Return code: {returncode} ({self.failure_reason})")
+
+        return returncode, output, stderr
+
+    def run_container(self, args):
         output = ""
         self.update_details.emit(output)
 
-        with self.global_common.exec_dangerzone_container(args) as p:
+        progress = self.common.progress if self.common else None
+        track = self.common.trace_track if self.common else None
+        tracer = self.global_common.tracer
+        trace_state = {}
+        start_time = time.monotonic()
+
+        log_output = log_container_output()
+
+        watchdog = Watchdog(self.global_common, self.common, args[0])
+        span = tracer.span(f"dangerzone-container {args[0]}", track)
+        with watchdog, span, self.global_common.exec_dangerzone_container(args) as p:
+            if self.common:
+                self.common.running_process = p
+
             for line in p.stdout:
-                output += line.decode()
+                watchdog.activity()
+                line = line.decode()
+                if tracer.handle_trace_line(line, track, trace_state):
+                    continue
 
-                if line.startswith(b"> "):
-                    print(
-                        Style.DIM + "> " + Style.NORMAL + Fore.CYAN + line.decode()[2:],
-                        end="",
-                    )
-                else:
-                    print("  " + line.decode(), end="")
+                output += line
+
+                if progress and progress.parse_line(line):
+                    self.emit_progress()
+                if self.common and self.common.stop_past_page_range(self.global_common):
+                    logger.info("Converted every page in the page range, stopping")
+
+                if log_output:
+                    container_logger.info(line.rstrip("\n"))
 
                 self.update_details.emit(output)
 
             stderr = p.stderr.read().decode()
-            if len(stderr) > 0:
-                print("")
+            if len(stderr) > 0 and log_output:
                 for line in stderr.strip().split("\n"):
-                    print("  " + Style.DIM + line)
+                    container_logger.info(line, extra={"stream": "stderr"})
 
             self.update_details.emit(output)
 
-        if p.returncode == 126 or p.returncode == 127:
-            self.task_failed.emit(f"Authorization failed")
-        elif p.returncode != 0:
-            self.task_failed.emit(f"Return code: {p.returncode}")
+        if self.common:
+            self.common.running_container = None
+            self.common.running_process = None
 
-        print("")
+        self.global_common.metrics.stage_duration.observe(
+            time.monotonic() - start_time, stage=args[0]
+        )
         return p.returncode, output, stderr
 
+    def emit_progress(self):
+        progress = self.common.progress
+        self.update_progress.emit(int(progress.fraction() * 100), progress.describe())
+
 
 class PullImageTask(TaskBase):
     def __init__(self, global_common, common):
@@ -61,9 +154,37 @@ class PullImageTask(TaskBase):
         returncode, _, _ = self.exec_container(args)
 
         if returncode != 0:
-            return
+            return False
 
         self.task_finished.emit()
+        return True
+
+
+class PullImageIfMissingTask(PullImageTask):
+    """
+    Pull the container image, but only if we don't already have it. This is used when
+    the conversion starts before we've finished checking if the image exists.
+    """
+
+    def run(self):
+        self.update_label.emit("Checking for container image")
+        self.update_details.emit("")
+        container_name = self.global_common.get_container_name()
+        with self.global_common.exec_dangerzone_container(
+            ["ls", "--container-name", container_name]
+        ) as p:
+            stdout_data, _ = p.communicate()
+
+        if p.returncode == 126 or p.returncode == 127:
+            self.failure_reason = "authorization"
+            self.task_failed.emit(f"Authorization failed")
+            return False
+
+        if p.returncode == 0 and b"dangerzone" in stdout_data:
+            self.task_finished.emit()
+            return True
+
+        return super(PullImageIfMissingTask, self).run()
 
 
 class ConvertToPixels(TaskBase):
@@ -74,6 +195,34 @@ class ConvertToPixels(TaskBase):
 
     def run(self):
         self.update_label.emit("Converting document to pixels")
+
+        # Don't bother starting a container for files that aren't documents
+        self.common.mime_type = sniff_mime_type(self.common.document_filename)
+        if not self.common.mime_type:
+            self.failure_reason = "unsupported_format"
+            self.task_failed.emit("The document format is not supported")
+            return False
+
+        # Documents that failed before for a reason that will happen every time, fail
+        # right away
+        known_failure = self.global_common.failure_cache.get(self.common)
+        if known_failure:
+            self.failure_reason = known_failure["reason"]
+            error = known_failure["error"] or ""
+            self.task_failed.emit(
+                f"This document failed to convert before ({self.failure_reason})\n\n"
+                f"{error}"
+            )
+            return False
+
+        # Guess how many pages there are, so there's an estimate of how long it will
+        # take before the container has counted them
+        self.common.estimate_pages()
+        if self.common.progress:
+            self.common.progress.estimated_pages = self.common.estimated_pages
+            self.common.progress.page_range = self.common.page_range
+            self.common.progress.start_stage("documenttopixels")
+            self.emit_progress()
         args = [
             "documenttopixels",
             "--document-filename",
@@ -82,20 +231,28 @@ class ConvertToPixels(TaskBase):
             self.common.pixel_dir.name,
             "--container-name",
             self.global_common.get_container_name(),
+            "--mime-type",
+            self.common.mime_type,
         ]
-        returncode, output, _ = self.exec_container(args)
+        if self.common.page_range:
+            args += ["--pages", format_page_range(self.common.page_range)]
+        returncode, output, _ = self.exec_container(args, stage=True)
 
         if returncode != 0:
-            return
+            return False
 
         success, error_message = self.global_common.validate_convert_to_pixel_output(
             self.common, output
         )
         if not success:
+            self.failure_reason = classify_invalid_output(error_message)
             self.task_failed.emit(error_message)
-            return
+            return False
 
+        if self.common.progress:
+            self.common.progress.finish_stage()
         self.task_finished.emit()
+        return True
 
 
 class ConvertToPDF(TaskBase):
@@ -106,6 +263,9 @@ class ConvertToPDF(TaskBase):
 
     def run(self):
         self.update_label.emit("Converting pixels to safe PDF")
+        if self.common.progress:
+            self.common.progress.start_stage("pixelstopdf")
+            self.emit_progress()
 
         # Build environment variables list
         if self.global_common.settings.get("ocr"):
@@ -129,9 +289,13 @@ class ConvertToPDF(TaskBase):
             "--ocr-lang",
             ocr_lang,
         ]
-        returncode, _, _ = self.exec_container(args)
+        returncode, _, _ = self.exec_container(args, stage=True)
 
         if returncode != 0:
-            return
+            return False
 
+        if self.common.progress:
+            self.common.progress.finish_stage()
+            self.emit_progress()
         self.task_finished.emit()
+        return True
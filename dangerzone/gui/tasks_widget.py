@@ -1,15 +1,22 @@
-import shutil
 import tempfile
 import os
 import platform
 import subprocess
 from PySide2 import QtCore, QtGui, QtWidgets
 
-from .tasks import PullImageTask, ConvertToPixels, ConvertToPDF
+from .tasks import (
+    PullImageTask,
+    PullImageIfMissingTask,
+    ConvertToPixels,
+    ConvertToPDF,
+)
+from .scheduler import ConversionJob
+from ..progress import ConversionProgress
 
 
 class TasksWidget(QtWidgets.QWidget):
     close_window = QtCore.Signal()
+    conversion_finished = QtCore.Signal()
 
     def __init__(self, global_common, gui_common, common):
         super(TasksWidget, self).__init__()
@@ -28,6 +35,13 @@ class TasksWidget(QtWidgets.QWidget):
         self.task_label.setAlignment(QtCore.Qt.AlignCenter)
         self.task_label.setStyleSheet("QLabel { font-weight: bold; font-size: 20px; }")
 
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.hide()
+        self.progress_label = QtWidgets.QLabel()
+        self.progress_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.progress_label.hide()
+
         self.task_details = QtWidgets.QLabel()
         self.task_details.setStyleSheet(
             "QLabel { background-color: #ffffff; font-size: 12px; padding: 10px; }"
@@ -42,15 +56,30 @@ class TasksWidget(QtWidgets.QWidget):
             self.scroll_to_bottom
         )
 
+        self.cancel_button = QtWidgets.QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel)
+        self.cancel_button.hide()
+        cancel_layout = QtWidgets.QHBoxLayout()
+        cancel_layout.addStretch()
+        cancel_layout.addWidget(self.cancel_button)
+        cancel_layout.addStretch()
+
         # Layout
         layout = QtWidgets.QVBoxLayout()
         layout.addWidget(self.dangerous_doc_label)
         layout.addSpacing(20)
         layout.addWidget(self.task_label)
+        layout.addWidget(self.progress_bar)
+        layout.addWidget(self.progress_label)
         layout.addWidget(self.details_scrollarea)
+        layout.addLayout(cancel_layout)
         self.setLayout(layout)
 
         self.tasks = []
+        self.job = None
+
+        # Whether a conversion has been started and hasn't finished yet
+        self.converting = False
 
     def document_selected(self):
         # Update the danger doc label
@@ -59,24 +88,53 @@ class TasksWidget(QtWidgets.QWidget):
         )
 
     def start(self):
+        task_classes = []
         if self.global_common.settings.get("update_container"):
-            self.tasks += [PullImageTask]
-        self.tasks += [ConvertToPixels, ConvertToPDF]
-        self.next_task()
-
-    def next_task(self):
-        if len(self.tasks) == 0:
-            self.all_done()
-            return
+            task_classes += [PullImageTask]
+        elif (
+            self.gui_common.container_image_present is None
+            and not self.global_common.custom_container
+        ):
+            # We haven't finished checking if the container image exists yet
+            task_classes += [PullImageIfMissingTask]
+        task_classes += [ConvertToPixels, ConvertToPDF]
+
+        self.common.progress = ConversionProgress(
+            self.global_common.throughput,
+            self.common.document_filename,
+            self.global_common.settings.get("ocr"),
+        )
+        self.common.trace_track = self.global_common.tracer.new_track(
+            os.path.basename(self.common.document_filename)
+        )
 
+        self.tasks = []
+        for task_class in task_classes:
+            task = task_class(self.global_common, self.common)
+            task.update_label.connect(self.update_label)
+            task.update_details.connect(self.update_details)
+            task.update_progress.connect(self.update_progress)
+            task.task_failed.connect(self.task_failed)
+            self.tasks.append(task)
+
+        # Wait for a free slot in the scheduler
+        self.task_label.setText("Waiting for other conversions to finish")
         self.task_details.setText("")
 
-        self.current_task = self.tasks.pop(0)(self.global_common, self.common)
-        self.current_task.update_label.connect(self.update_label)
-        self.current_task.update_details.connect(self.update_details)
-        self.current_task.task_finished.connect(self.next_task)
-        self.current_task.task_failed.connect(self.task_failed)
-        self.current_task.start()
+        self.job = ConversionJob(self.tasks)
+        self.job.signals.job_finished.connect(self.all_done)
+        self.job.signals.job_failed.connect(self.job_failed)
+        self.converting = True
+        self.cancel_button.show()
+        self.gui_common.scheduler.submit(self.job)
+
+    def cancel(self):
+        if not self.converting or self.common.cancelled:
+            return
+        self.cancel_button.setEnabled(False)
+        self.task_label.setText("Cancelling")
+        self.global_common.cancel_conversion(self.common)
+        self.gui_common.scheduler.cancel(self.job)
 
     def update_label(self, s):
         self.task_label.setText(s)
@@ -84,24 +142,64 @@ class TasksWidget(QtWidgets.QWidget):
     def update_details(self, s):
         self.task_details.setText(s)
 
+    def update_progress(self, percent, s):
+        self.progress_bar.show()
+        self.progress_bar.setValue(percent)
+        self.progress_label.show()
+        self.progress_label.setText(s)
+
     def task_failed(self, err):
+        # A cancelled conversion is cleaned up once the job is done
+        if self.common.cancelled:
+            return
+
+        # Keep the pixel data, so it can be looked at
+        self.common.cleanup(keep_pixel_dir=True)
+
         self.task_label.setText("Failed :(")
         self.task_details.setWordWrap(True)
-        text = self.task_details.text()
-        self.task_details.setText(
-            f"{text}\n\n--\n\nDirectory with pixel data: {self.common.pixel_dir.name}\n\n{err}"
+        text = f"{self.task_details.text()}\n\n--\n\n"
+
+        # Failures before the conversion starts, like an unsupported format, don't
+        # have any pixel data
+        pixel_dir_name = self.common.get_pixel_dir_name()
+        if pixel_dir_name:
+            text += f"Directory with pixel data: {pixel_dir_name}\n\n"
+        self.task_details.setText(f"{text}{err}")
+
+    def job_failed(self, failure_reason):
+        self.global_common.conversion_failed(
+            self.common, failure_reason, remember=False
         )
+        self.converting = False
+        self.cancel_button.hide()
+        if failure_reason == "cancelled":
+            self.common.cleanup()
+            self.task_label.setText("Cancelled")
+            self.progress_bar.hide()
+            self.progress_label.hide()
+        self.conversion_finished.emit()
 
     def all_done(self):
+        self.converting = False
+        self.cancel_button.hide()
+
         # Save safe PDF
-        source_filename = f"{self.common.safe_dir.name}/safe-output-compressed.pdf"
         if self.global_common.settings.get("save"):
             dest_filename = self.common.save_filename
         else:
             # If not saving, then save it to a temp file instead
-            tmp = tempfile.mkstemp(suffix=".pdf", prefix="dangerzone_")
-            dest_filename = tmp[1]
-        shutil.move(source_filename, dest_filename)
+            fd, dest_filename = tempfile.mkstemp(suffix=".pdf", prefix="dangerzone_")
+            os.close(fd)
+        try:
+            with self.global_common.tracer.span("save", self.common.trace_track):
+                self.common.save_safe_pdf(dest_filename)
+        except OSError as e:
+            self.task_failed(f"Couldn't save the safe PDF: {e}")
+            self.job_failed("save_failed")
+            return
+
+        self.global_common.metrics.document_converted(self.common, dest_filename)
 
         # In Windows, open Explorer with the safe PDF in focus
         if platform.system() == "Windows":
@@ -115,15 +213,12 @@ class TasksWidget(QtWidgets.QWidget):
             self.gui_common.open_pdf_viewer(dest_filename)
 
         # Clean up
-        self.common.pixel_dir.cleanup()
-        self.common.safe_dir.cleanup()
+        self.common.cleanup()
+        self.conversion_finished.emit()
 
-        # Quit
-        if platform.system() == "Darwin":
-            # In macOS, just close the window
-            self.close_window.emit()
-        else:
-            self.gui_common.app.quit()
+        # Close the window. Other windows might still be open, so dangerzone only
+        # quits if this was the last one.
+        self.close_window.emit()
 
     def scroll_to_bottom(self, minimum, maximum):
         self.details_scrollarea.verticalScrollBar().setValue(maximum)
@@ -0,0 +1,160 @@
+import os
+import re
+import time
+import shutil
+import platform
+import appdirs
+
+from .common import active_scratch_dirs, active_scratch_dirs_lock
+from .log import logger
+
+# Scratch directories are named like "pixel-[pid]-[random]". Older versions didn't
+# include the pid.
+scratch_dir_re = re.compile(r"^(pixel|safe)-(?:(\d+)-)?")
+
+
+def is_process_running(pid):
+    if platform.system() == "Windows":
+        import ctypes
+
+        PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+        STILL_ACTIVE = 259
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == STILL_ACTIVE
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # It's running, it just belongs to someone else
+        return True
+    return True
+
+
+def get_dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+class ScratchJanitor(object):
+    """
+    Deletes the pixel-* and safe-* directories in the cache folder that conversions
+    leave behind when they crash, are killed or fail, and keeps the ones that are left
+    under a size quota
+    """
+
+    # Directories from older versions don't say which process they belong to, so
+    # they're deleted once they're this old, in seconds
+    unowned_max_age = 24 * 60 * 60
+
+    def __init__(self, global_common):
+        self.global_common = global_common
+        self.cache_dir = appdirs.user_cache_dir("dangerzone")
+
+    def get_scratch_dirs(self):
+        """
+        Returns a list of dicts describing each scratch directory, oldest first
+        """
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return []
+
+        scratch_dirs = []
+        for name in names:
+            m = scratch_dir_re.match(name)
+            path = os.path.join(self.cache_dir, name)
+            if not m or not os.path.isdir(path):
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            scratch_dirs.append(
+                {
+                    "path": path,
+                    "pid": int(m.group(2)) if m.group(2) else None,
+                    "mtime": mtime,
+                }
+            )
+
+        scratch_dirs.sort(key=lambda d: d["mtime"])
+        return scratch_dirs
+
+    def is_stale(self, scratch_dir):
+        if scratch_dir["pid"] is None:
+            return time.time() - scratch_dir["mtime"] > self.unowned_max_age
+        if scratch_dir["pid"] == os.getpid():
+            return False
+        return not is_process_running(scratch_dir["pid"])
+
+    def is_evictable(self, scratch_dir):
+        """
+        Whether a directory that isn't stale can be deleted to get under the quota:
+        it's one this process is done with, or one from an older version, or its
+        process isn't running anymore
+        """
+        pid = scratch_dir["pid"]
+        return pid is None or pid == os.getpid() or not is_process_running(pid)
+
+    def remove(self, scratch_dir, reason):
+        logger.info(f"Removing {reason} scratch directory {scratch_dir['path']}")
+        shutil.rmtree(scratch_dir["path"], ignore_errors=True)
+
+    def clean(self):
+        """
+        Delete stale scratch directories, and then the oldest ones until they fit in
+        the quota. Directories that are being used by a conversion in this process, or
+        that belong to another dangerzone process that's still running, are never
+        deleted. Returns a tuple like: (directories removed (int), bytes freed (int))
+        """
+        scratch_dirs = self.get_scratch_dirs()
+
+        # Get the active directories after listing them, so a directory that's created
+        # in between is never mistaken for a leftover
+        with active_scratch_dirs_lock:
+            active = set(active_scratch_dirs)
+
+        removed = 0
+        freed = 0
+        remaining = []
+        for scratch_dir in scratch_dirs:
+            if scratch_dir["path"] in active:
+                continue
+            scratch_dir["size"] = get_dir_size(scratch_dir["path"])
+            if self.is_stale(scratch_dir):
+                self.remove(scratch_dir, "stale")
+                removed += 1
+                freed += scratch_dir["size"]
+            else:
+                remaining.append(scratch_dir)
+
+        # Then evict the oldest directories that nothing is using, oldest first. Ones
+        # that belong to another process that's still running might still be in use.
+        quota = self.global_common.settings.get("scratch_quota_mb") * 1024 * 1024
+        total = sum(d["size"] for d in remaining) + sum(
+            get_dir_size(path) for path in active
+        )
+        for scratch_dir in remaining:
+            if total <= quota:
+                break
+            if self.is_evictable(scratch_dir):
+                self.remove(scratch_dir, "over quota")
+                removed += 1
+                freed += scratch_dir["size"]
+                total -= scratch_dir["size"]
+
+        return removed, freed
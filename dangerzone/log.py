@@ -0,0 +1,92 @@
+import os
+import sys
+import logging
+import logging.handlers
+from colorama import Style, Fore
+
+# General messages, like which commands are running
+logger = logging.getLogger("dangerzone")
+
+# Output from dangerzone-container. There's a lot of it (especially with OCR), so in
+# quiet mode it isn't even formatted.
+container_logger = logging.getLogger("dangerzone.container")
+
+
+class ConsoleFormatter(logging.Formatter):
+    """
+    Formats log messages for the terminal like dangerzone always has: commands in cyan,
+    container output indented, and container stderr dimmed
+    """
+
+    def __init__(self, color):
+        super(ConsoleFormatter, self).__init__()
+        self.color = color
+
+    def format(self, record):
+        msg = record.getMessage()
+
+        if msg.startswith("> "):
+            if self.color:
+                return Style.DIM + "> " + Style.NORMAL + Fore.CYAN + msg[2:]
+            return msg
+
+        if record.name == container_logger.name:
+            if self.color and getattr(record, "stream", None) == "stderr":
+                return "  " + Style.DIM + msg
+            return "  " + msg
+
+        if self.color and record.levelno >= logging.ERROR:
+            return Fore.RED + msg
+        if self.color and record.levelno >= logging.WARNING:
+            return Fore.YELLOW + msg
+        return msg
+
+
+def setup_logging(appdata_path, level="INFO", log_file=False, quiet=False, color=None):
+    """
+    Log to the terminal and, if log_file is True, to a rotating log file in the app data
+    folder. If quiet is True, output from dangerzone-container isn't logged at all.
+    If color is None, colors are only used if stdout is a terminal.
+    """
+    # Everything goes to the log file, so the level only matters without one
+    logger.setLevel(logging.DEBUG if log_file else level)
+    logger.propagate = False
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    stream = sys.stdout
+    if color is None:
+        color = hasattr(stream, "isatty") and stream.isatty()
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setLevel(level)
+    console_handler.setFormatter(ConsoleFormatter(color))
+    logger.addHandler(console_handler)
+
+    if log_file:
+        log_dir = os.path.join(appdata_path, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            os.path.join(log_dir, "dangerzone.log"),
+            maxBytes=1024 * 1024,
+            backupCount=5,
+            encoding="utf-8",
+        )
+        file_handler.setLevel(logging.DEBUG)
+        file_handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        logger.addHandler(file_handler)
+
+    if quiet:
+        container_logger.setLevel(logging.WARNING)
+    else:
+        container_logger.setLevel(logging.NOTSET)
+
+
+def log_container_output():
+    """
+    Should each line of container output be logged? Checked once per command, so when
+    it's not, the lines don't cost anything.
+    """
+    return container_logger.isEnabledFor(logging.INFO)
@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import tempfile
+import threading
+import appdirs
+
+from .log import logger
+
+
+class Metric:
+    """
+    A metric, with a value for each combination of label values
+    """
+
+    metric_type = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def label_key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = [
+            (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        ]
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def samples(self):
+        """
+        Returns a list of (name, labels (str), value) for the Prometheus text format
+        """
+        with self.lock:
+            return [
+                (self.name, self.format_labels(key), value)
+                for key, value in sorted(self.values.items())
+            ]
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key)), "value": value}
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), function=None):
+        super(Gauge, self).__init__(name, help_text, labelnames)
+
+        # If there's a function, it's called to get the value whenever it's needed
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def update(self):
+        if self.function:
+            self.set(self.function())
+
+    def samples(self):
+        self.update()
+        return super(Gauge, self).samples()
+
+    def snapshot(self):
+        self.update()
+        return super(Gauge, self).snapshot()
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=()):
+        super(Histogram, self).__init__(name, help_text, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0,
+                    "count": 0,
+                }
+            h = self.values[key]
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    h["buckets"][i] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, h in sorted(self.values.items()):
+                for bucket, count in zip(self.buckets, h["buckets"]):
+                    labels = self.format_labels(key, ("le", repr(float(bucket))))
+                    samples.append((f"{self.name}_bucket", labels, count))
+                labels = self.format_labels(key, ("le", "+Inf"))
+                samples.append((f"{self.name}_bucket", labels, h["count"]))
+                samples.append((f"{self.name}_sum", self.format_labels(key), h["sum"]))
+                samples.append(
+                    (f"{self.name}_count", self.format_labels(key), h["count"])
+                )
+        return samples
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                {
+                    "labels": dict(zip(self.labelnames, key)),
+                    "buckets": dict(zip([str(b) for b in self.buckets], h["buckets"])),
+                    "sum": h["sum"],
+                    "count": h["count"],
+                }
+                for key, h in sorted(self.values.items())
+            ]
+
+
+class MetricsRegistry:
+    """
+    A set of metrics, which can be served in the Prometheus text format on a localhost
+    port, and saved as JSON snapshots
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.server = None
+        self.snapshot_timer = None
+
+        # stop() can run while a snapshot is being saved, so scheduling the next one
+        # checks whether it stopped, under the lock
+        self.snapshot_lock = threading.Lock()
+        self.snapshots_stopped = False
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def prometheus_text(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {
+            "timestamp": time.time(),
+            "metrics": {metric.name: metric.snapshot() for metric in self.metrics},
+        }
+
+    def serve(self, port):
+        """
+        Serve the metrics in the Prometheus text format on http://127.0.0.1:[port]/metrics
+        """
+        # Only load the HTTP server if we're actually serving metrics
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ["/", "/metrics"]:
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        except OSError as e:
+            # Like the port being in use. Metrics are optional, so keep going.
+            logger.warning(f"Can't serve metrics on port {port}: {e}")
+            return
+        self.server.daemon_threads = True
+        t = threading.Thread(target=self.server.serve_forever, daemon=True)
+        t.start()
+
+    def start_snapshots(self, filename, interval):
+        """
+        Save a JSON snapshot of the metrics to filename every interval seconds
+        """
+        self.snapshot_filename = filename
+        self.snapshot_interval = interval
+        self._schedule_snapshot()
+
+    def _schedule_snapshot(self):
+        with self.snapshot_lock:
+            if self.snapshots_stopped:
+                return
+            self.snapshot_timer = threading.Timer(
+                self.snapshot_interval, self._snapshot
+            )
+            self.snapshot_timer.daemon = True
+            self.snapshot_timer.start()
+
+    def _snapshot(self):
+        self.save_snapshot()
+        self._schedule_snapshot()
+
+    def save_snapshot(self):
+        dirname = os.path.dirname(os.path.abspath(self.snapshot_filename))
+        try:
+            fd, tmp_filename = tempfile.mkstemp(
+                prefix="metrics-", suffix=".json.tmp", dir=dirname
+            )
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.snapshot(), f, indent=4)
+            os.replace(tmp_filename, self.snapshot_filename)
+        except OSError:
+            pass
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        with self.snapshot_lock:
+            self.snapshots_stopped = True
+            snapshot_timer = self.snapshot_timer
+            self.snapshot_timer = None
+        if snapshot_timer:
+            snapshot_timer.cancel()
+            self.save_snapshot()
+
+
+def get_scratch_bytes():
+    """
+    How much space the pixel-* and safe-* folders are using in the cache folder
+    """
+    cache_dir = appdirs.user_cache_dir("dangerzone")
+    total = 0
+    try:
+        for dirname in os.listdir(cache_dir):
+            if not (dirname.startswith("pixel-") or dirname.startswith("safe-")):
+                continue
+            for dirpath, _, filenames in os.walk(os.path.join(cache_dir, dirname)):
+                for filename in filenames:
+                    try:
+                        total += os.path.getsize(os.path.join(dirpath, filename))
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+    return total
+
+
+class Metrics(MetricsRegistry):
+    """
+    The metrics that dangerzone keeps track of
+    """
+
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self.documents_converted = self.add(
+            Counter(
+                "dangerzone_documents_converted_total",
+                "Documents converted to safe PDFs",
+            )
+        )
+        self.documents_failed = self.add(
+            Counter(
+                "dangerzone_documents_failed_total",
+                "Documents that failed to convert, by reason",
+                ["reason"],
+            )
+        )
+        self.retries = self.add(
+            Counter(
+                "dangerzone_retries_total",
+                "Conversion stages that were run again after failing, by reason",
+                ["reason"],
+            )
+        )
+        self.pages = self.add(
+            Counter("dangerzone_pages_total", "Pages of documents converted")
+        )
+        self.bytes_in = self.add(
+            Counter("dangerzone_input_bytes_total", "Size of the documents converted")
+        )
+        self.bytes_out = self.add(
+            Counter("dangerzone_output_bytes_total", "Size of the safe PDFs created")
+        )
+        self.stage_duration = self.add(
+            Histogram(
+                "dangerzone_stage_duration_seconds",
+                "How long each dangerzone-container command took",
+                ["stage"],
+                buckets=[0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800],
+            )
+        )
+        self.queue_depth = self.add(
+            Gauge("dangerzone_queue_depth", "Documents waiting to be converted")
+        )
+        self.jobs_running = self.add(
+            Gauge("dangerzone_jobs_running", "Conversions currently running")
+        )
+        self.cache_hits = self.add(
+            Counter("dangerzone_cache_hits_total", "Cache hits, by cache", ["cache"])
+        )
+        self.cache_misses = self.add(
+            Counter(
+                "dangerzone_cache_misses_total", "Cache misses, by cache", ["cache"]
+            )
+        )
+        self.scratch_bytes = self.add(
+            Gauge(
+                "dangerzone_scratch_bytes",
+                "Space used by pixel and safe folders in the cache folder",
+                function=get_scratch_bytes,
+            )
+        )
+
+    def document_converted(self, common, save_filename):
+        """
+        Count a converted document. save_filename is where the safe PDF was actually
+        written, which isn't common.save_filename if the GUI isn't saving it.
+        """
+        self.documents_converted.inc()
+        if common.num_pages:
+            self.pages.inc(common.num_pages)
+        for counter, filename in [
+            (self.bytes_in, common.document_filename),
+            (self.bytes_out, save_filename),
+        ]:
+            try:
+                counter.inc(os.path.getsize(filename))
+            except (OSError, TypeError):
+                pass
+
+    def document_failed(self, reason):
+        self.documents_failed.inc(reason=reason)
@@ -0,0 +1,517 @@
+import os
+import re
+import time
+import zlib
+import zipfile
+
+# Counting pages is only a guess used for scheduling and estimating how long a
+# conversion will take, so it gives up rather than read too much of a document or take
+# too long. Nothing in the document is rendered or run, it's only parsed.
+max_bytes = 8 * 1024 * 1024
+max_seconds = 1
+
+# Don't believe page counts bigger than this
+max_pages = 100000
+
+# How much of the end of a PDF to look at for the startxref line
+pdf_tail_size = 1024
+
+# How much to read for each PDF object, and for each section of a cross-reference table
+pdf_object_size = 4096
+pdf_xref_size = 1024 * 1024
+
+# Follow at most this many earlier cross-reference sections (from incremental updates)
+pdf_max_xref_sections = 32
+
+# Don't believe a cross-reference section with more objects than this
+pdf_max_objects = 1000000
+
+# How big docProps/app.xml or meta.xml can be
+zip_member_max_size = 1024 * 1024
+
+pdf_startxref_re = re.compile(rb"startxref\s+(\d+)")
+pdf_obj_re = re.compile(rb"\s*(\d+)\s+(\d+)\s+obj\b")
+pdf_xref_subsection_re = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*\r?\n")
+pdf_xref_entry_re = re.compile(rb"\s*(\d{10})\s+(\d{5})\s+([nf])")
+ooxml_pages_re = re.compile(rb"<(?:\w+:)?(?:Pages|Slides)>\s*(\d+)\s*</")
+odf_pages_re = re.compile(rb"meta:page-count\s*=\s*[\"'](\d+)[\"']")
+
+
+class PageCountLimitError(Exception):
+    pass
+
+
+class Budget(object):
+    """
+    Keeps track of how much of the document has been read, and for how long
+    """
+
+    def __init__(self):
+        self.bytes_left = max_bytes
+        self.deadline = time.monotonic() + max_seconds
+
+    def check(self):
+        if time.monotonic() > self.deadline:
+            raise PageCountLimitError("took too long")
+
+    def spend(self, size):
+        self.check()
+        if size > self.bytes_left:
+            raise PageCountLimitError("read too much")
+        self.bytes_left -= size
+
+    def read(self, f, offset, size):
+        """
+        Read up to size bytes, but never more than what's left
+        """
+        self.check()
+        if self.bytes_left <= 0:
+            raise PageCountLimitError("read too much")
+        f.seek(offset)
+        data = f.read(min(size, self.bytes_left))
+        self.bytes_left -= len(data)
+        return data
+
+
+def count_pages(filename, mime_type):
+    """
+    Guess how many pages a document has, without converting it. Returns the number of
+    pages, or None if it can't tell.
+    """
+    budget = Budget()
+    try:
+        if mime_type == "application/pdf":
+            with open(filename, "rb") as f:
+                num_pages = count_pdf_pages(f, budget)
+        elif mime_type == "image/tiff":
+            with open(filename, "rb") as f:
+                num_pages = count_tiff_pages(f, budget)
+        elif mime_type == "image/gif":
+            with open(filename, "rb") as f:
+                num_pages = count_gif_pages(f, budget)
+        elif mime_type in ["image/png", "image/jpeg"]:
+            num_pages = 1
+        elif mime_type and mime_type.startswith("application/vnd.oasis.opendocument."):
+            num_pages = count_zip_pages(filename, budget, "meta.xml", odf_pages_re)
+        elif mime_type and (
+            mime_type.startswith("application/vnd.openxmlformats-officedocument.")
+            or mime_type.startswith("application/vnd.ms-word.")
+        ):
+            num_pages = count_zip_pages(
+                filename, budget, "docProps/app.xml", ooxml_pages_re
+            )
+        else:
+            num_pages = None
+    except Exception:
+        # It's only a guess, so if the document is too big, broken or does something
+        # unusual, there's just no guess
+        return None
+
+    if num_pages is None or num_pages <= 0 or num_pages > max_pages:
+        return None
+    return num_pages
+
+
+def count_zip_pages(filename, budget, member, pages_re):
+    """
+    Office documents keep statistics about themselves, written by whatever saved them
+    last, in a small XML file inside the zip. They might be out of date.
+    """
+    with zipfile.ZipFile(filename) as z:
+        try:
+            info = z.getinfo(member)
+        except KeyError:
+            return None
+        if info.file_size > zip_member_max_size:
+            return None
+
+        # Don't trust the size in the zip, only decompress as much as is allowed
+        budget.spend(zip_member_max_size)
+        with z.open(info) as f:
+            data = f.read(zip_member_max_size)
+
+    m = pages_re.search(data)
+    if m:
+        return int(m.group(1))
+    return None
+
+
+def count_tiff_pages(f, budget):
+    """
+    Each page of a TIFF has an image file directory (IFD), and each IFD says where the
+    next one is
+    """
+    header = budget.read(f, 0, 8)
+    if header[:2] == b"II":
+        byteorder = "little"
+    elif header[:2] == b"MM":
+        byteorder = "big"
+    else:
+        return None
+
+    num_pages = 0
+    offset = int.from_bytes(header[4:8], byteorder)
+    seen = set()
+    while offset:
+        if offset in seen or num_pages >= max_pages:
+            return None
+        seen.add(offset)
+
+        data = budget.read(f, offset, 2)
+        if len(data) != 2:
+            return None
+        num_entries = int.from_bytes(data, byteorder)
+        data = budget.read(f, offset + 2 + num_entries * 12, 4)
+        if len(data) != 4:
+            return None
+        num_pages += 1
+        offset = int.from_bytes(data, byteorder)
+
+    return num_pages
+
+
+def count_gif_pages(f, budget):
+    """
+    Count the images in an animated GIF, by skipping over the blocks between them
+    """
+    data = budget.read(f, 0, budget.bytes_left)
+    if os.fstat(f.fileno()).st_size > len(data):
+        raise PageCountLimitError("read too much")
+
+    def color_table_size(flags):
+        if flags & 0x80:
+            return 3 * 2 ** ((flags & 0x07) + 1)
+        return 0
+
+    def skip_sub_blocks(pos):
+        while True:
+            size = data[pos]
+            pos += 1
+            if size == 0:
+                return pos
+            pos += size
+
+    num_pages = 0
+    try:
+        # Header and logical screen descriptor
+        pos = 13 + color_table_size(data[10])
+        while True:
+            budget.check()
+            block_type = data[pos]
+            if block_type == 0x3B:
+                break
+            elif block_type == 0x21:
+                # Extension: type, then sub-blocks
+                pos = skip_sub_blocks(pos + 2)
+            elif block_type == 0x2C:
+                # Image descriptor, local color table, LZW code size, then sub-blocks
+                pos += 10 + color_table_size(data[pos + 9])
+                pos = skip_sub_blocks(pos + 1)
+                num_pages += 1
+            else:
+                break
+    except IndexError:
+        # It's cut off, but count the images that were there
+        pass
+
+    return num_pages
+
+
+def count_pdf_pages(f, budget):
+    """
+    Follow the cross-reference table from the end of the PDF to the document catalog,
+    and then to the root of the page tree, which says how many pages there are
+    """
+    reader = PdfReader(f, budget)
+    catalog = reader.get_object(reader.root)
+    if catalog is None:
+        return None
+    pages_ref = get_ref(catalog, b"Pages")
+    if pages_ref is None:
+        return None
+    pages = reader.get_object(pages_ref)
+    if pages is None:
+        return None
+    return get_int(pages, b"Count")
+
+
+def get_int(data, key):
+    m = re.search(rb"/" + key + rb"\s+(\d+)(?![\d\s]*R\b)", data)
+    if m:
+        return int(m.group(1))
+    return None
+
+
+def get_ref(data, key):
+    m = re.search(rb"/" + key + rb"\s+(\d+)\s+\d+\s+R\b", data)
+    if m:
+        return int(m.group(1))
+    return None
+
+
+def get_int_array(data, key):
+    m = re.search(rb"/" + key + rb"\s*\[([\d\s]*)\]", data)
+    if m:
+        return [int(n) for n in m.group(1).split()]
+    return None
+
+
+def flate_decode(data, max_size):
+    decompressor = zlib.decompressobj()
+    decoded = decompressor.decompress(data, max(1, max_size))
+    if decompressor.unconsumed_tail:
+        raise PageCountLimitError("stream too big")
+    return decoded
+
+
+def png_unpredict(data, columns):
+    """
+    Undo the PNG predictors that cross-reference streams are usually encoded with
+    """
+    rows = []
+    previous = bytearray(columns)
+    for i in range(0, len(data), columns + 1):
+        predictor = data[i]
+        row = bytearray(data[i + 1 : i + 1 + columns])
+        if len(row) != columns:
+            break
+        if predictor == 1:
+            for j in range(1, columns):
+                row[j] = (row[j] + row[j - 1]) & 0xFF
+        elif predictor == 2:
+            for j in range(columns):
+                row[j] = (row[j] + previous[j]) & 0xFF
+        elif predictor != 0:
+            raise ValueError("unsupported PNG predictor")
+        rows.append(bytes(row))
+        previous = row
+    return b"".join(rows)
+
+
+class PdfReader(object):
+    """
+    Just enough of a PDF parser to find objects through the cross-reference table,
+    including compressed cross-reference streams and object streams
+    """
+
+    def __init__(self, f, budget):
+        self.f = f
+        self.budget = budget
+
+        # Offsets in the cross-reference table are from the start of the PDF, which
+        # might come after some junk
+        header = budget.read(f, 0, 1024)
+        self.start = header.find(b"%PDF-")
+        if self.start < 0:
+            raise ValueError("not a PDF")
+
+        # Object number: ("offset", offset) or ("compressed", object stream, index)
+        self.xref = {}
+        self.root = None
+        self.object_streams = {}
+
+        f.seek(0, 2)
+        size = f.tell()
+        tail = budget.read(f, max(0, size - pdf_tail_size), pdf_tail_size)
+        matches = list(pdf_startxref_re.finditer(tail))
+        if not matches:
+            raise ValueError("no startxref")
+
+        offset = int(matches[-1].group(1))
+        seen = set()
+        while offset is not None and offset not in seen:
+            if len(seen) >= pdf_max_xref_sections:
+                break
+            seen.add(offset)
+            offset = self.read_xref_section(offset)
+
+        if self.root is None:
+            raise ValueError("no document catalog")
+
+    def read_xref_section(self, offset):
+        """
+        Read one section of the cross-reference table, keeping the entries that
+        newer sections haven't already. Returns the offset of the previous section.
+        """
+        offset += self.start
+        data = self.budget.read(self.f, offset, pdf_xref_size)
+        if data.lstrip().startswith(b"xref"):
+            return self.read_xref_table(data)
+        return self.read_xref_stream(data, offset)
+
+    def read_xref_table(self, data):
+        pos = data.find(b"xref") + 4
+        while True:
+            m = pdf_xref_subsection_re.match(data, pos)
+            if not m:
+                break
+            first, count = int(m.group(1)), int(m.group(2))
+            pos = m.end()
+            for num in range(first, first + count):
+                self.budget.check()
+                m = pdf_xref_entry_re.match(data, pos)
+                if not m:
+                    raise ValueError("cut off cross-reference table")
+                pos = m.end()
+                if m.group(3) == b"n":
+                    self.xref.setdefault(num, ("offset", int(m.group(1))))
+
+        trailer_pos = data.find(b"trailer", pos)
+        if trailer_pos < 0:
+            raise ValueError("no trailer")
+        trailer = data[trailer_pos : trailer_pos + pdf_object_size]
+        if self.root is None:
+            self.root = get_ref(trailer, b"Root")
+        return get_int(trailer, b"Prev")
+
+    def read_xref_stream(self, data, offset):
+        obj = self.parse_object(data)
+        if obj is None or not re.search(rb"/Type\s*/XRef\b", obj):
+            raise ValueError("no cross-reference table")
+        decoded = self.read_stream(data, obj, offset)
+
+        widths = get_int_array(obj, b"W")
+        size = get_int(obj, b"Size")
+        index = get_int_array(obj, b"Index") or [0, size or 0]
+        if not widths or len(widths) != 3 or len(index) % 2:
+            raise ValueError("invalid cross-reference stream")
+
+        # Entries with no bytes would never run out of stream
+        entry_size = sum(widths)
+        if entry_size == 0:
+            raise ValueError("invalid cross-reference stream")
+
+        # There can't be more entries than fit in the stream
+        max_entries = min(len(decoded) // entry_size, pdf_max_objects)
+        if size is not None:
+            max_entries = min(max_entries, size)
+
+        pos = 0
+        for i in range(0, len(index), 2):
+            count = index[i + 1]
+            if count < 0 or count > max_entries:
+                raise ValueError("too many cross-reference entries")
+            max_entries -= count
+
+            for num in range(index[i], index[i] + count):
+                self.budget.check()
+                entry = decoded[pos : pos + entry_size]
+                if len(entry) != entry_size:
+                    raise ValueError("cut off cross-reference stream")
+                pos += entry_size
+
+                fields = []
+                field_pos = 0
+                for width in widths:
+                    fields.append(
+                        int.from_bytes(entry[field_pos : field_pos + width], "big")
+                    )
+                    field_pos += width
+                entry_type = fields[0] if widths[0] else 1
+                if entry_type == 1:
+                    self.xref.setdefault(num, ("offset", fields[1]))
+                elif entry_type == 2:
+                    self.xref.setdefault(num, ("compressed", fields[1], fields[2]))
+
+        if self.root is None:
+            self.root = get_ref(obj, b"Root")
+        return get_int(obj, b"Prev")
+
+    def parse_object(self, data):
+        """
+        The dictionary part of an object, which starts at the beginning of data
+        """
+        if not pdf_obj_re.match(data):
+            return None
+        end = len(data)
+        for keyword in [b"stream", b"endobj"]:
+            pos = data.find(keyword)
+            if pos >= 0:
+                end = min(end, pos)
+        return data[:end]
+
+    def read_stream(self, data, obj, offset):
+        """
+        The decoded contents of a stream object, which is at the beginning of data,
+        which was read from offset
+        """
+        if re.search(rb"/Filter\s*\[?\s*/(?!FlateDecode\b)", obj):
+            raise ValueError("unsupported filter")
+
+        length = get_int(obj, b"Length")
+        if length is None:
+            length_ref = get_ref(obj, b"Length")
+            if length_ref is None:
+                raise ValueError("stream has no length")
+            length_obj = self.get_object(length_ref)
+            m = re.match(rb"\s*(\d+)", length_obj or b"")
+            if not m:
+                raise ValueError("invalid stream length")
+            length = int(m.group(1))
+
+        m = re.compile(rb"stream\r?\n").search(data, len(obj))
+        if not m:
+            raise ValueError("no stream")
+
+        # If the stream didn't fit in what was read, read the rest
+        stream = data[m.end() : m.end() + length]
+        if len(stream) < length:
+            stream += self.budget.read(self.f, offset + len(data), length - len(stream))
+
+        decoded = stream
+        if re.search(rb"/FlateDecode\b", obj):
+            decoded = flate_decode(stream, self.budget.bytes_left)
+            self.budget.spend(len(decoded))
+
+        predictor = get_int(obj, b"Predictor") or 1
+        if predictor >= 10:
+            decoded = png_unpredict(decoded, get_int(obj, b"Columns") or 1)
+        elif predictor != 1:
+            raise ValueError("unsupported predictor")
+        return decoded
+
+    def get_object(self, num):
+        """
+        The dictionary (or other value) of an object, or None if it can't be found
+        """
+        self.budget.check()
+        entry = self.xref.get(num)
+        if entry is None:
+            return None
+
+        if entry[0] == "offset":
+            data = self.budget.read(self.f, self.start + entry[1], pdf_object_size)
+            m = pdf_obj_re.match(data)
+            if not m or int(m.group(1)) != num:
+                return None
+            return self.parse_object(data)[m.end() :]
+
+        # It's inside an object stream, which is a stream of other objects, with a
+        # header of object numbers and their offsets
+        _, stream_num, index = entry
+        if stream_num not in self.object_streams:
+            entry = self.xref.get(stream_num)
+            if entry is None or entry[0] != "offset":
+                return None
+            offset = self.start + entry[1]
+            data = self.budget.read(self.f, offset, pdf_object_size)
+            obj = self.parse_object(data)
+            if obj is None:
+                return None
+            first = get_int(obj, b"First")
+            if first is None:
+                return None
+            decoded = self.read_stream(data, obj, offset)
+            header = decoded[:first].split()
+            offsets = {}
+            for i in range(0, len(header) - 1, 2):
+                offsets[int(header[i])] = first + int(header[i + 1])
+            self.object_streams[stream_num] = (decoded, offsets)
+
+        # Each object ends where the next one starts
+        decoded, offsets = self.object_streams[stream_num]
+        start = offsets.get(num)
+        if start is None:
+            return None
+        end = min([o for o in offsets.values() if o > start] + [len(decoded)])
+        return decoded[start : min(end, start + pdf_object_size)]
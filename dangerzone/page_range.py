@@ -0,0 +1,85 @@
+import re
+
+page_range_part_re = re.compile(r"^(\d+)(?:\s*(-)\s*(\d*))?$")
+
+
+def parse_page_range(s):
+    """
+    Parse a page range like "1-10,15" or "20-" (page 20 to the end). Returns a sorted
+    list of tuples like: (first page (int), last page (int, or None for the end)),
+    with overlapping ones merged, or None if s is empty, meaning every page. Raises
+    ValueError if it isn't a valid page range.
+    """
+    if s is None or s.strip() == "":
+        return None
+
+    parts = []
+    for part in s.split(","):
+        m = page_range_part_re.match(part.strip())
+        if not m:
+            raise ValueError(f"Invalid page range: {part.strip()}")
+        first = int(m.group(1))
+        if m.group(2):
+            last = int(m.group(3)) if m.group(3) else None
+        else:
+            last = first
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"Invalid page range: {part.strip()}")
+        parts.append((first, last))
+
+    parts.sort(key=lambda p: (p[0], float("inf") if p[1] is None else p[1]))
+    page_range = [parts[0]]
+    for first, last in parts[1:]:
+        prev_first, prev_last = page_range[-1]
+        if prev_last is None:
+            break
+        if first <= prev_last + 1:
+            if last is None or last > prev_last:
+                page_range[-1] = (prev_first, last)
+        else:
+            page_range.append((first, last))
+    return page_range
+
+
+def format_page_range(page_range):
+    """
+    The string for a page range, like "1-10,15"
+    """
+    parts = []
+    for first, last in page_range:
+        if last == first:
+            parts.append(str(first))
+        elif last is None:
+            parts.append(f"{first}-")
+        else:
+            parts.append(f"{first}-{last}")
+    return ",".join(parts)
+
+
+def count_pages_before(page_range, page):
+    """
+    How many of the pages in the range come before page
+    """
+    count = 0
+    for first, last in page_range:
+        if first >= page:
+            break
+        if last is None or last >= page:
+            last = page - 1
+        count += last - first + 1
+    return count
+
+
+def select_pages(page_range, num_pages):
+    """
+    The pages in the range that a document with num_pages pages has, in order
+    """
+    if page_range is None:
+        return list(range(1, num_pages + 1))
+
+    pages = []
+    for first, last in page_range:
+        if last is None or last > num_pages:
+            last = num_pages
+        pages += range(first, last + 1)
+    return pages
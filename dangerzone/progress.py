@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+
+from .page_range import count_pages_before, select_pages
+
+# The stages of converting a document, in order
+stages = ["documenttopixels", "pixelstopdf"]
+
+# Lines in the container output that say how many pages there are, and which page is
+# being worked on. Like "Document has 12 pages", and "Converting page 3 to pixels" or
+# "Converting page 3/12 from pixels to PDF"
+num_pages_re = re.compile(r"^Document has (\d+) pages?")
+page_re = re.compile(r"\bpage (\d+)(?:/(\d+))?\b", re.IGNORECASE)
+
+
+class ThroughputHistory:
+    """
+    How many pages per second each stage has converted in the past, by document type
+    and whether OCR is on, stored in the app data folder. It's used to guess how long a
+    conversion will take.
+    """
+
+    # How much weight the newest measurement gets in the moving average
+    smoothing = 0.3
+
+    def __init__(self, appdata_path):
+        self.appdata_path = appdata_path
+        self.filename = os.path.join(appdata_path, "throughput.json")
+
+        # The GUI converts several documents at once, so record() can be called from
+        # more than one thread
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.filename) as f:
+                self.history = json.load(f)
+        except:
+            self.history = {}
+
+    def key(self, stage, doc_type, ocr):
+        return f"{stage}/{doc_type}/ocr={'1' if ocr else '0'}"
+
+    def get(self, stage, doc_type, ocr):
+        """
+        Returns the pages per second for this kind of conversion, or None if we've
+        never done one before
+        """
+        with self.lock:
+            entry = self.history.get(self.key(stage, doc_type, ocr))
+            if entry:
+                return entry["pages_per_second"]
+            return None
+
+    def record(self, stage, doc_type, ocr, num_pages, seconds):
+        if num_pages <= 0 or seconds <= 0:
+            return
+
+        pages_per_second = num_pages / seconds
+        key = self.key(stage, doc_type, ocr)
+        with self.lock:
+            entry = self.history.get(key)
+            if entry:
+                entry["pages_per_second"] = (
+                    self.smoothing * pages_per_second
+                    + (1 - self.smoothing) * entry["pages_per_second"]
+                )
+                entry["samples"] += 1
+            else:
+                self.history[key] = {"pages_per_second": pages_per_second, "samples": 1}
+
+            # Saving while holding the lock keeps an older copy from being written
+            # over a newer one
+            self.save()
+
+    def save(self):
+        """
+        Write the history to disk. Call it while holding the lock.
+        """
+        history = {key: dict(entry) for key, entry in self.history.items()}
+        try:
+            os.makedirs(self.appdata_path, exist_ok=True)
+            fd, tmp_filename = tempfile.mkstemp(
+                prefix="throughput-", suffix=".json.tmp", dir=self.appdata_path
+            )
+            with os.fdopen(fd, "w") as f:
+                json.dump(history, f, indent=4)
+            os.replace(tmp_filename, self.filename)
+        except OSError:
+            pass
+
+
+class ConversionProgress:
+    """
+    Tracks the progress of converting one document, from the page events in the
+    container output, and estimates how much time is left
+    """
+
+    def __init__(self, throughput, document_filename, ocr):
+        self.throughput = throughput
+        self.doc_type = os.path.splitext(document_filename)[1].lower().lstrip(".")
+        self.ocr = ocr
+
+        self.stage = None
+        self.stage_started_at = None
+        self.num_pages = None
+        self.pages_done = 0
+
+        # A guess at the number of pages, until the container says how many there are
+        self.estimated_pages = None
+
+        # If only some pages are converted, which ones
+        self.page_range = None
+
+        # How many pages the whole document has, once the container says
+        self.document_pages = None
+
+        # Whether the container has started converting a page after the last one in
+        # the page range, which means it has converted all of them
+        self.past_page_range = False
+
+    def start_stage(self, stage):
+        self.stage = stage
+        self.stage_started_at = time.monotonic()
+        self.pages_done = 0
+        self.past_page_range = False
+
+    def finish_stage(self):
+        """
+        The current stage succeeded, so remember how fast it was
+        """
+        if self.stage and self.num_pages:
+            seconds = time.monotonic() - self.stage_started_at
+            self.throughput.record(
+                self.stage, self.doc_type, self.ocr, self.num_pages, seconds
+            )
+            self.pages_done = self.num_pages
+
+    def parse_line(self, line):
+        """
+        Look for page events in a line of container output. Returns True if the
+        progress changed.
+        """
+        m = num_pages_re.match(line)
+        if m:
+            self.num_pages = self.count_pages(int(m.group(1)))
+            return True
+
+        m = page_re.search(line)
+        if m:
+            if m.group(2):
+                self.num_pages = self.count_pages(int(m.group(2)))
+
+            # The page that's being worked on isn't done yet
+            page = int(m.group(1))
+            pages_done = page - 1
+            if self.page_range and self.stage == "documenttopixels":
+                pages_done = count_pages_before(self.page_range, page)
+                last_page = self.get_last_page()
+                if last_page is not None and page > last_page:
+                    self.past_page_range = True
+            if self.num_pages:
+                pages_done = min(pages_done, self.num_pages)
+            if pages_done > self.pages_done:
+                self.pages_done = pages_done
+                return True
+
+        return False
+
+    def get_num_pages(self):
+        """
+        The number of pages, or the guess if the container hasn't said yet
+        """
+        return self.num_pages or self.estimated_pages
+
+    def count_pages(self, document_pages):
+        """
+        How many pages are converted, out of the pages in the document. Converting to
+        pixels is the only stage that sees the whole document, the pages are
+        renumbered after that.
+        """
+        if self.page_range and self.stage == "documenttopixels":
+            self.document_pages = document_pages
+            return count_pages_before(self.page_range, document_pages + 1)
+        return document_pages
+
+    def get_last_page(self):
+        """
+        The last page in the page range, or None if it goes to the end of a document
+        that the container hasn't said the length of yet
+        """
+        if self.document_pages:
+            pages = select_pages(self.page_range, self.document_pages)
+            return pages[-1] if pages else 0
+        return self.page_range[-1][1]
+
+    def fraction(self):
+        """
+        How much of the whole conversion is done, from 0 to 1
+        """
+        if self.stage not in stages:
+            return 0
+        stage_index = stages.index(self.stage)
+        num_pages = self.get_num_pages()
+        if num_pages:
+            stage_fraction = min(self.pages_done / num_pages, 1)
+        else:
+            stage_fraction = 0
+        return (stage_index + stage_fraction) / len(stages)
+
+    def eta(self):
+        """
+        Estimated seconds left in the whole conversion, or None if we can't tell yet
+        """
+        num_pages = self.get_num_pages()
+        if self.stage not in stages or not num_pages:
+            return None
+
+        # The rest of this stage. If we've never done this kind of conversion before,
+        # guess from how fast it's been going so far.
+        rate = self.throughput.get(self.stage, self.doc_type, self.ocr)
+        if rate is None and self.pages_done > 0:
+            rate = self.pages_done / (time.monotonic() - self.stage_started_at)
+        if rate is None:
+            return None
+        seconds = max(num_pages - self.pages_done, 0) / rate
+
+        # And all of the stages after this one
+        for stage in stages[stages.index(self.stage) + 1 :]:
+            rate = self.throughput.get(stage, self.doc_type, self.ocr)
+            if rate is None:
+                return None
+            seconds += num_pages / rate
+
+        return seconds
+
+    def describe(self):
+        """
+        A short description like "3 of 12 pages, about 0:42 left"
+        """
+        if self.num_pages:
+            s = f"{self.pages_done} of {self.num_pages} pages"
+        elif self.estimated_pages:
+            s = f"{self.pages_done} of ~{self.estimated_pages} pages"
+        else:
+            return "Counting pages"
+
+        eta = self.eta()
+        if eta is not None:
+            eta = int(eta)
+            s += f", about {eta // 60}:{eta % 60:02d} left"
+        return s
@@ -0,0 +1,74 @@
+import hashlib
+
+from .page_range import format_page_range
+
+
+def hash_file(filename):
+    """
+    The sha256 hex digest of a file, or None if it can't be read
+    """
+    h = hashlib.sha256()
+    try:
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+class DocumentReport:
+    """
+    What happened when converting one document, for dangerzone-cli --json and --report
+    """
+
+    def __init__(self, document_filename, container_name, ocr_lang, page_range=None):
+        self.document_filename = document_filename
+        self.sha256 = hash_file(document_filename)
+        self.save_filename = None
+        self.num_pages = None
+        self.estimated_pages = None
+        self.container_name = container_name
+        self.image_id = None
+        self.ocr_lang = ocr_lang
+        self.page_range = page_range
+
+        # Each dangerzone-container command that ran, in order
+        self.stages = []
+
+        self.success = False
+        self.failure_reason = None
+        self.error = None
+
+    def add_stage(self, stage, seconds, returncode):
+        self.stages.append(
+            {"stage": stage, "seconds": round(seconds, 3), "returncode": returncode}
+        )
+
+    def failed(self, failure_reason, error=None):
+        self.success = False
+        self.failure_reason = failure_reason
+        self.error = error
+
+    def succeeded(self, save_filename, num_pages):
+        self.success = True
+        self.save_filename = save_filename
+        self.num_pages = num_pages
+
+    def to_dict(self):
+        return {
+            "document": self.document_filename,
+            "sha256": self.sha256,
+            "success": self.success,
+            "output": self.save_filename,
+            "pages": self.num_pages,
+            "estimated_pages": self.estimated_pages,
+            "page_range": format_page_range(self.page_range)
+            if self.page_range
+            else None,
+            "stages": self.stages,
+            "container": {"name": self.container_name, "image_id": self.image_id},
+            "ocr": {"enabled": bool(self.ocr_lang), "lang": self.ocr_lang or None},
+            "failure_reason": self.failure_reason,
+            "error": self.error,
+        }
@@ -1,12 +1,54 @@
 import os
+import copy
 import json
-import appdirs
+import time
+import tempfile
+import platform
+
+from .log import logger
+
+if platform.system() == "Windows":
+    import msvcrt
+else:
+    import fcntl
+
+
+class SettingsLock:
+    """
+    An exclusive lock on the settings file, shared between dangerzone processes
+    """
+
+    def __init__(self, lock_filename):
+        self.lock_filename = lock_filename
+        self.lock_file = None
+
+    def __enter__(self):
+        self.lock_file = open(self.lock_filename, "a+")
+        if platform.system() == "Windows":
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        if platform.system() == "Windows":
+            self.lock_file.seek(0)
+            msvcrt.locking(self.lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
 
 
 class Settings:
+    # Don't check if the settings file has changed more often than this, in seconds
+    reload_interval = 1
+
     def __init__(self, common):
         self.common = common
         self.settings_filename = os.path.join(self.common.appdata_path, "settings.json")
+        self.lock_filename = f"{self.settings_filename}.lock"
         self.default_settings = {
             "save": True,
             "ocr": True,
@@ -15,40 +57,132 @@ class Settings:
             "open_app": None,
             "update_container": True,
             "linux_prefers_typing_password": None,
+            "max_concurrent_conversions": 2,
+            "scratch_quota_mb": 2048,
+            "timeouts": {},
+            "retries": 2,
+            "retry_backoff": 5,
+            "remember_failures": True,
         }
 
+        # Keys that were set but haven't been saved yet
+        self.changed = set()
+
+        # The mtime and size of the settings file when it was last loaded, and when we
+        # last checked it
+        self.file_stat = None
+        self.last_checked = 0
+
         self.load()
 
     def get(self, key):
+        self.reload_if_changed()
         return self.settings[key]
 
     def set(self, key, val):
+        if key in self.settings and self.settings[key] == val:
+            return
         self.settings[key] = val
+        self.changed.add(key)
 
     def load(self):
         if os.path.isfile(self.settings_filename):
             # If the settings file exists, load it
             try:
-                with open(self.settings_filename, "r") as settings_file:
-                    self.settings = json.load(settings_file)
+                self.settings = self._read()
 
                 # If it's missing any fields, add them from the default settings
                 for key in self.default_settings:
                     if key not in self.settings:
-                        self.settings[key] = self.default_settings[key]
+                        self.settings[key] = copy.deepcopy(self.default_settings[key])
+                        self.changed.add(key)
 
             except:
-                print("Error loading settings, falling back to default")
-                self.settings = self.default_settings
+                logger.warning("Error loading settings, falling back to default")
+                self.settings = copy.deepcopy(self.default_settings)
+                self.changed.update(self.settings.keys())
 
         else:
             # Save with default settings
-            print("Settings file doesn't exist, starting with default")
-            self.settings = self.default_settings
+            logger.info("Settings file doesn't exist, starting with default")
+            self.settings = copy.deepcopy(self.default_settings)
+            self.changed.update(self.settings.keys())
 
+        # Only write the file if something actually changed
         self.save()
 
     def save(self):
+        if len(self.changed) == 0:
+            return
+
         os.makedirs(self.common.appdata_path, exist_ok=True)
-        with open(self.settings_filename, "w") as settings_file:
-            json.dump(self.settings, settings_file, indent=4)
+        with SettingsLock(self.lock_filename):
+            # Another process might have saved the settings since we loaded them, so
+            # only write the keys that we changed on top of what's there now
+            try:
+                settings = self._read()
+            except:
+                settings = {}
+            for key in self.changed:
+                settings[key] = self.settings[key]
+            for key in self.settings:
+                if key not in settings:
+                    settings[key] = self.settings[key]
+
+            # Write to a temp file, and then rename it, so that the settings file is
+            # never half-written
+            fd, tmp_filename = tempfile.mkstemp(
+                prefix="settings-", suffix=".json.tmp", dir=self.common.appdata_path
+            )
+            try:
+                with os.fdopen(fd, "w") as settings_file:
+                    json.dump(settings, settings_file, indent=4)
+                os.replace(tmp_filename, self.settings_filename)
+            except:
+                os.remove(tmp_filename)
+                raise
+
+            self.settings = settings
+            self.changed = set()
+            self.file_stat = self._stat()
+
+    def reload_if_changed(self):
+        """
+        If another process changed the settings file, load it again. This only stats
+        the file, at most once per reload_interval, unless it actually changed.
+        """
+        now = time.monotonic()
+        if now - self.last_checked < self.reload_interval:
+            return
+        self.last_checked = now
+
+        file_stat = self._stat()
+        if file_stat is None or file_stat == self.file_stat:
+            return
+
+        try:
+            settings = self._read()
+        except:
+            return
+
+        # Keep any changes we haven't saved yet
+        for key in self.changed:
+            settings[key] = self.settings[key]
+        for key in self.default_settings:
+            if key not in settings:
+                settings[key] = copy.deepcopy(self.default_settings[key])
+        self.settings = settings
+
+    def _read(self):
+        file_stat = self._stat()
+        with open(self.settings_filename, "r") as settings_file:
+            settings = json.load(settings_file)
+        self.file_stat = file_stat
+        return settings
+
+    def _stat(self):
+        try:
+            st = os.stat(self.settings_filename)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
@@ -0,0 +1,86 @@
+import os
+import zipfile
+
+# How much of the start of a document to look at
+header_size = 4096
+
+ole_mime_types = {
+    ".doc": "application/msword",
+    ".xls": "application/vnd.ms-excel",
+    ".ppt": "application/vnd.ms-powerpoint",
+}
+
+ooxml_mime_types = {
+    "word/": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "xl/": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "ppt/": "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+docm_mime_type = "application/vnd.ms-word.document.macroEnabled.12"
+
+odf_mime_types = [
+    "application/vnd.oasis.opendocument.text",
+    "application/vnd.oasis.opendocument.spreadsheet",
+    "application/vnd.oasis.opendocument.presentation",
+    "application/vnd.oasis.opendocument.graphics",
+]
+
+
+def sniff_mime_type(filename):
+    """
+    Figure out what kind of document this is from its first few bytes (and for zip
+    files, the list of files inside), without trusting the extension. Returns the mime
+    type, or None if it isn't a kind of document that dangerzone can convert.
+    """
+    try:
+        with open(filename, "rb") as f:
+            header = f.read(header_size)
+    except OSError:
+        return None
+    ext = os.path.splitext(filename)[1].lower()
+
+    # PDF readers accept junk before the header, so the container does too
+    if b"%PDF-" in header[:1024]:
+        return "application/pdf"
+
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"GIF87a") or header.startswith(b"GIF89a"):
+        return "image/gif"
+    if header.startswith(b"II*\x00") or header.startswith(b"MM\x00*"):
+        return "image/tiff"
+
+    # Old Microsoft Office documents are all OLE compound files, and telling them
+    # apart means parsing the file, so go by the extension
+    if header.startswith(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"):
+        return ole_mime_types.get(ext, "application/msword")
+
+    if header.startswith(b"PK\x03\x04"):
+        return sniff_zip_mime_type(filename, header, ext)
+
+    return None
+
+
+def sniff_zip_mime_type(filename, header, ext):
+    # OpenDocument files start with an uncompressed file called "mimetype"
+    if header[30:38] == b"mimetype":
+        size = int.from_bytes(header[18:22], "little")
+        mime_type = header[38 : 38 + size].decode("ascii", "replace")
+        if mime_type in odf_mime_types:
+            return mime_type
+        return None
+
+    # Office Open XML files have a folder for the kind of document. This only reads
+    # the zip's central directory, at the end of the file.
+    try:
+        with zipfile.ZipFile(filename) as z:
+            names = z.namelist()
+    except (zipfile.BadZipFile, OSError):
+        return None
+    for prefix, mime_type in ooxml_mime_types.items():
+        if any(name.startswith(prefix) for name in names):
+            if prefix == "word/" and ext == ".docm":
+                return docm_mime_type
+            return mime_type
+    return None
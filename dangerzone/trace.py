@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import threading
+import contextlib
+
+# Lines that dangerzone-container prints (when DANGERZONE_TRACE is set) to say when
+# the container started and exited, like: "@dz-trace container-start 1623456789.123"
+trace_line_prefix = "@dz-trace "
+
+
+def now_us():
+    # Wall clock time, so timestamps from dangerzone-container line up with ours
+    return int(time.time() * 1000000)
+
+
+class Tracer:
+    """
+    Records how long each part of a conversion takes, and saves it as a Chrome trace
+    (open it in chrome://tracing or https://ui.perfetto.dev). Each document gets its own
+    track, so concurrent conversions show up side by side.
+
+    When tracing isn't enabled, spans don't record anything.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+        # Track 0 is for things that aren't part of any one document
+        self.next_track = 1
+        self.add_metadata(0, "dangerzone")
+
+    def enable(self):
+        self.enabled = True
+
+        # Ask dangerzone-container to print when containers start and exit
+        os.environ["DANGERZONE_TRACE"] = "1"
+
+    def new_track(self, name):
+        """
+        Start a new track, for one document. Returns the track id.
+        """
+        with self.lock:
+            track = self.next_track
+            self.next_track += 1
+        self.add_metadata(track, name)
+        return track
+
+    def add_metadata(self, track, name):
+        self.add_event(
+            {
+                "ph": "M",
+                "name": "thread_name",
+                "pid": self.pid,
+                "tid": track,
+                "args": {"name": name},
+            }
+        )
+
+    def add_event(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, track=None, **args):
+        if not self.enabled:
+            yield
+            return
+
+        start = now_us()
+        try:
+            yield
+        finally:
+            self.add_span(name, track, start, now_us(), **args)
+
+    def add_span(self, name, track, start, end, **args):
+        if not self.enabled:
+            return
+        self.add_event(
+            {
+                "ph": "X",
+                "name": name,
+                "pid": self.pid,
+                "tid": track or 0,
+                "ts": start,
+                "dur": max(0, end - start),
+                "args": args,
+            }
+        )
+
+    def instant(self, name, track=None, ts=None, **args):
+        if not self.enabled:
+            return
+        self.add_event(
+            {
+                "ph": "i",
+                "s": "t",
+                "name": name,
+                "pid": self.pid,
+                "tid": track or 0,
+                "ts": ts or now_us(),
+                "args": args,
+            }
+        )
+
+    def handle_trace_line(self, line, track=None, state=None):
+        """
+        If line (str) is a trace line from dangerzone-container, record it and return
+        True, so it can be left out of the output. state is a dict that's shared by the
+        lines of one command, to match container starts with their exits.
+        """
+        if not line.startswith(trace_line_prefix):
+            return False
+
+        parts = line[len(trace_line_prefix) :].split()
+        if len(parts) < 2:
+            return True
+        try:
+            ts = int(float(parts[1]) * 1000000)
+        except ValueError:
+            return True
+
+        if parts[0] == "container-start":
+            self.instant("container start", track, ts)
+            if state is not None:
+                state["container_start"] = ts
+        elif parts[0] == "container-exit":
+            returncode = parts[2] if len(parts) > 2 else None
+            self.instant("container exit", track, ts, returncode=returncode)
+            if state is not None and "container_start" in state:
+                self.add_span("container", track, state.pop("container_start"), ts)
+        return True
+
+    def save(self, filename):
+        with self.lock:
+            events = list(self.events)
+        with open(filename, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+
+from .log import logger
+
+# How many seconds each stage of a conversion can take in all, and how many it can go
+# without the container printing anything (like a page event) before it's killed, by
+# document type. "*" is for every type, and 0 means no limit. LibreOffice doesn't print
+# anything while it converts an office document to PDF, so those get longer.
+#
+# The "timeouts" setting has the same format, and overrides these.
+office_doc_types = ["doc", "docx", "odt", "xls", "xlsx", "ods", "ppt", "pptx", "odp"]
+default_timeouts = {
+    "*": {"documenttopixels": 1800, "pixelstopdf": 3600, "idle": 300},
+}
+default_timeouts.update({doc_type: {"idle": 900} for doc_type in office_doc_types})
+
+
+def get_doc_type(document_filename):
+    return os.path.splitext(document_filename)[1].lower().lstrip(".")
+
+
+def merge_timeouts(sources, doc_type, stage):
+    timeouts = {}
+    for source in sources:
+        for key in ["*", doc_type]:
+            if isinstance(source.get(key), dict):
+                timeouts.update(source[key])
+    return int(timeouts.get(stage, 0)), int(timeouts.get("idle", 0))
+
+
+def get_timeouts(settings, doc_type, stage):
+    """
+    The timeouts for a stage of converting a type of document. Returns a tuple like:
+    (stage timeout (int), idle timeout (int))
+    """
+    custom_timeouts = settings.get("timeouts")
+    if not isinstance(custom_timeouts, dict):
+        custom_timeouts = {}
+
+    try:
+        return merge_timeouts([default_timeouts, custom_timeouts], doc_type, stage)
+    except (TypeError, ValueError):
+        logger.warning("Invalid timeouts setting, falling back to default")
+        return merge_timeouts([default_timeouts], doc_type, stage)
+
+
+class Watchdog(object):
+    """
+    Kills the container running a stage of a conversion if the stage takes too long, or
+    goes too long without any output. It watches from a thread of its own, while the
+    output is read in a with block, calling activity() for each line. If it kills the
+    container, common.timeout_error says why.
+    """
+
+    def __init__(self, global_common, common, stage):
+        self.global_common = global_common
+        self.common = common
+        self.stage = stage
+
+        # Commands that aren't part of converting a document aren't watched
+        if common and common.document_filename:
+            self.timeout, self.idle_timeout = get_timeouts(
+                global_common.settings, get_doc_type(common.document_filename), stage
+            )
+        else:
+            self.timeout, self.idle_timeout = 0, 0
+
+        self.started_at = None
+        self.last_activity = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.started_at = time.monotonic()
+        self.last_activity = self.started_at
+        if self.common:
+            self.common.timeout_error = None
+        if self.timeout or self.idle_timeout:
+            self.thread = threading.Thread(target=self.watch, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def activity(self):
+        self.last_activity = time.monotonic()
+
+    def next_deadline(self):
+        """
+        Returns a tuple like: (when the next timeout expires (float), error (str))
+        """
+        deadlines = []
+        if self.timeout:
+            deadlines.append(
+                (
+                    self.started_at + self.timeout,
+                    f"{self.stage} took longer than {self.timeout} seconds",
+                )
+            )
+        if self.idle_timeout:
+            deadlines.append(
+                (
+                    self.last_activity + self.idle_timeout,
+                    f"{self.stage} made no progress for {self.idle_timeout} seconds",
+                )
+            )
+        return min(deadlines)
+
+    def watch(self):
+        while True:
+            deadline, error = self.next_deadline()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.stopped.wait(remaining):
+                return
+
+        logger.warning(f"Timed out: {error}")
+        self.common.timeout_error = error
+        self.global_common.kill_container(self.common)